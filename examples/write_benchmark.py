@@ -0,0 +1,108 @@
+import os
+import sys
+
+PATH = os.path.abspath(os.path.join(os.path.basename(__file__), "../"))
+sys.path.insert(0, PATH)
+
+import argparse
+import hashlib
+import time
+import tracemalloc
+
+from tornado import gen
+from tornado import web
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.testing import bind_unused_port
+
+from tornadorax.services.storage_service import SegmentWriter
+from tornadorax.services.storage_service import StorageService
+
+
+MB = 1024 * 1024
+
+
+@web.stream_request_body
+class DiscardHandler(web.RequestHandler):
+    # accepts uploads and throws the bytes away, like a fast object store
+
+    def prepare(self):
+        self.md5sum = hashlib.md5()
+
+    def data_received(self, chunk):
+        self.md5sum.update(chunk)
+
+    def put(self, path):
+        self.set_status(201)
+        self.set_header("ETag", self.md5sum.hexdigest())
+
+
+@gen.coroutine
+def fetch_token():
+    raise gen.Return("TOKEN")
+
+
+async def upload(url, total, write_size, segment_size):
+    client = StorageService(
+        url, fetch_token=fetch_token, ioloop=IOLoop.current())
+    container = await client.fetch_container("container")
+    obj = await container.fetch_object("object")
+    writer = await obj.upload_stream(
+        mimetype="application/octet-stream",
+        writer=SegmentWriter.with_defaults(segment_size=segment_size))
+    data = os.urandom(write_size)
+    written = 0
+    while written < total:
+        await writer.write(data)
+        written += write_size
+    result = await writer.finish()
+    assert result["status"] == "success", result
+    return written
+
+
+async def run(url, total, write_size, segment_size):
+    start = time.perf_counter()
+    written = await upload(url, total, write_size, segment_size)
+    elapsed = time.perf_counter() - start
+
+    # a second, traced pass, since tracing slows everything down
+    tracemalloc.start()
+    await upload(url, total, write_size, segment_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("{0:>10} byte writes: {1:8.1f} MB/s, peak {2:8.1f} KB traced "
+          "({3:.1f} KB per MB written)".format(
+              write_size, written / elapsed / MB, peak / 1024.0,
+              peak / 1024.0 / (written / MB)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measures SegmentWriter throughput against a local "
+        "server that discards what it receives.")
+    parser.add_argument("--size", type=int, default=256, help="MB per run")
+    parser.add_argument(
+        "--segment-size", type=int, default=64, help="segment size in MB")
+    parser.add_argument(
+        "--write-sizes", default="1024,65536,4194304",
+        help="comma separated sizes passed to each write()")
+    args = parser.parse_args()
+
+    sock, port = bind_unused_port()
+    app = web.Application([(r"/v1/(.*)", DiscardHandler)])
+    server = HTTPServer(app, max_body_size=args.segment_size * MB * 2)
+    server.add_sockets([sock])
+    url = "http://127.0.0.1:{0}/v1".format(port)
+
+    async def run_all():
+        for write_size in args.write_sizes.split(","):
+            await run(
+                url, args.size * MB, int(write_size),
+                args.segment_size * MB)
+
+    IOLoop.current().run_sync(run_all)
+
+
+if __name__ == "__main__":
+    main()
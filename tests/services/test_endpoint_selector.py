@@ -0,0 +1,47 @@
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+from testnado.service_case_helpers import ServiceCaseHelpers
+
+from tornadorax.services.endpoint_selector import EndpointSelector
+
+
+class TestEndpointSelector(ServiceCaseHelpers, AsyncTestCase):
+
+    def setUp(self):
+        super(TestEndpointSelector, self).setUp()
+
+        async def slow_handle(handler):
+            await gen.sleep(0.1)
+            handler.set_status(401)
+
+        def fast_handle(handler):
+            handler.set_status(401)
+
+        self.slow_service = self.add_service()
+        self.slow_service.add_method("HEAD", "/v1", slow_handle)
+        self.fast_service = self.add_service()
+        self.fast_service.add_method("HEAD", "/v1", fast_handle)
+        self.selector = EndpointSelector(timeout=1)
+
+    @gen_test
+    async def test_rank_orders_endpoints_by_latency(self):
+        self.start_services()
+        candidates = [
+            ("DFW", False, self.slow_service.url("/v1")),
+            ("ORD", False, self.fast_service.url("/v1"))
+        ]
+        ranked = await self.selector.rank(candidates)
+        self.assertEqual(
+            ["ORD", "DFW"], [candidate[0] for _, candidate in ranked])
+        self.assertTrue(ranked[0][0] < ranked[1][0])
+
+    @gen_test
+    async def test_rank_drops_unreachable_endpoints(self):
+        self.start_services()
+        candidates = [
+            ("DFW", True, "http://127.0.0.1:1/v1"),
+            ("DFW", False, self.fast_service.url("/v1"))
+        ]
+        ranked = await self.selector.rank(candidates)
+        self.assertEqual([("DFW", False, self.fast_service.url("/v1"))], [
+            candidate for _, candidate in ranked])
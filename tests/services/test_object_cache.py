@@ -0,0 +1,140 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+from unittest import mock
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from tornadorax.services.object_cache import InfoCache, ObjectCache
+
+
+class TestObjectCache(AsyncTestCase):
+
+    def test_put_and_get_in_memory(self):
+        cache = ObjectCache(max_bytes=100)
+        cache.put("a", "etag-a", b"aaaa")
+        entry = cache.get("a")
+        self.assertEqual("etag-a", entry.etag)
+        self.assertEqual(b"aaaa", cache.load(entry))
+        self.assertEqual(4, cache.size)
+
+    def test_put_evicts_least_recently_used(self):
+        cache = ObjectCache(max_bytes=10)
+        cache.put("a", "etag-a", b"aaaa")
+        cache.put("b", "etag-b", b"bbbb")
+        cache.get("a")
+        cache.put("c", "etag-c", b"cccc")
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertEqual(8, cache.size)
+
+    def test_put_skips_bodies_larger_than_cache(self):
+        cache = ObjectCache(max_bytes=3)
+        cache.put("a", "etag-a", b"aaaa")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, cache.size)
+
+    def test_entries_are_stored_on_disk_with_directory(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(directory))
+        cache = ObjectCache(max_bytes=5, directory=directory)
+        cache.put("a", "etag-a", b"aaaa")
+        entry = cache.get("a")
+        self.assertIsNone(entry.body)
+        self.assertEqual(b"aaaa", cache.load(entry))
+        cache.put("b", "etag-b", b"bbbb")
+        self.assertFalse(os.path.exists(entry.path))
+        self.assertEqual(1, len(os.listdir(cache.process_directory())))
+
+    def test_processes_use_their_own_directories(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(directory))
+        cache = ObjectCache(max_bytes=5, directory=directory)
+        other = ObjectCache(max_bytes=5, directory=directory)
+        cache.put("a", "etag-a", b"aaaa")
+        with mock.patch("os.getpid", return_value=-1):
+            other.put("a", "etag-a", b"aaaa")
+            other.put("b", "etag-b", b"bbbb")
+        self.assertEqual(2, len(os.listdir(directory)))
+        self.assertEqual(b"aaaa", cache.load(cache.get("a")))
+
+    def test_directories_of_exited_processes_are_removed(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(directory))
+        exited = subprocess.Popen(["true"])
+        exited.wait()
+        stale = os.path.join(directory, str(exited.pid))
+        os.makedirs(stale)
+        with open(os.path.join(stale, "orphan"), "wb") as fp:
+            fp.write(b"aaaa")
+
+        cache = ObjectCache(max_bytes=5, directory=directory)
+        cache.put("a", "etag-a", b"aaaa")
+        self.assertEqual([str(os.getpid())], os.listdir(directory))
+
+        cache.close()
+        self.assertEqual([], os.listdir(directory))
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, cache.size)
+
+    def test_missing_file_is_a_miss(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(directory))
+        cache = ObjectCache(max_bytes=5, directory=directory)
+        cache.put("a", "etag-a", b"aaaa")
+        entry = cache.get("a")
+        os.unlink(entry.path)
+        self.assertIsNone(cache.load(entry))
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, cache.size)
+
+    def test_invalidate_removes_entry(self):
+        cache = ObjectCache(max_bytes=100)
+        cache.put("a", "etag-a", b"aaaa")
+        cache.invalidate("a")
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, cache.size)
+
+    @gen_test
+    async def test_fetch_collapses_concurrent_calls(self):
+        cache = ObjectCache(max_bytes=100)
+        calls = []
+
+        async def fetch(entry):
+            calls.append(entry)
+            await gen.sleep(0.01)
+            return b"body"
+
+        results = await gen.multi([cache.fetch("a", fetch) for i in range(5)])
+        self.assertEqual([b"body"] * 5, results)
+        self.assertEqual([None], calls)
+        # and a later call fetches again
+        await cache.fetch("a", fetch)
+        self.assertEqual(2, len(calls))
+
+
+class TestInfoCache(AsyncTestCase):
+
+    def test_get_returns_entry_within_ttl(self):
+        cache = InfoCache(ttl=10)
+        cache.put("a", {"length": 1})
+        self.assertEqual({"length": 1}, cache.get("a"))
+
+    @mock.patch("time.monotonic")
+    def test_get_expires_entries(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        cache = InfoCache(ttl=10)
+        cache.put("a", {"length": 1})
+        mock_monotonic.return_value = 111
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, len(cache.entries))
+
+    def test_put_drops_oldest_entries(self):
+        cache = InfoCache(ttl=10, max_entries=2)
+        for key in ("a", "b", "c"):
+            cache.put(key, {})
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(["b", "c"], list(cache.entries))
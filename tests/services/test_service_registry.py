@@ -1,8 +1,11 @@
+from unittest import TestCase
+
 from tornado import gen
 from tornado.testing import AsyncTestCase
 
 from tests.helpers.foo_service import FooService
 from tornadorax.services import service_registry
+from tornadorax.transport import HTTPTransport
 
 from importlib import reload
 
@@ -61,6 +64,14 @@ class TestServiceRegistry(AsyncTestCase):
         with self.assertRaises(service_registry.InvalidRegion):
             self.build(internal=True, region="FOOBAR")
 
+    def test_service_registry_raises_error_with_missing_internal_url(self):
+        service_catalog = [{
+            "type": "foo:service", "name": "foo", "endpoints": [
+                {"publicURL": "https://dfw2.foo.com/v1", "region": "DFW"}]
+        }]
+        with self.assertRaises(service_registry.InvalidRegion):
+            self.build(service_catalog=service_catalog, internal=True)
+
     def test_service_registry_raises_error_with_invalid_service(self):
         with self.assertRaises(service_registry.InvalidServiceType):
             self.build("other:service")
@@ -73,3 +84,67 @@ class TestServiceRegistry(AsyncTestCase):
         self.build("rax:queues")
         self.build("object-store")
         self.build("rax:load-balancer")
+
+    def test_service_registry_accepts_indexed_catalog(self):
+        catalog = service_registry.ServiceCatalog([{
+            "type": "foo:service",
+            "name": "foo:service",
+            "endpoints": ENDPOINTS
+        }])
+        service = self.build(service_catalog=catalog, region="ORD")
+        service.assert_service_url_equals("https://ord2.foo.com/v1")
+
+    def test_service_registry_passes_transport_when_provided(self):
+        transport = HTTPTransport()
+        service = self.build("object-store", transport=transport)
+        self.assertIs(transport, service.transport)
+        # services that don't know about transports still work
+        self.build(transport=None)
+
+
+class TestServiceCatalog(TestCase):
+
+    def setUp(self):
+        self.catalog = service_registry.ServiceCatalog([
+            {"type": "foo:service", "name": "foo", "endpoints": ENDPOINTS},
+            {"type": "bar:service", "name": "bar", "endpoints": [
+                {"publicURL": "https://bar.foo.com/v1", "region": "IAD"}]}
+        ])
+
+    def test_lookup_defaults_to_first_region(self):
+        self.assertEqual(
+            "https://dfw2.foo.com/v1", self.catalog.lookup("foo:service"))
+        self.assertEqual(
+            "https://bar.foo.com/v1", self.catalog.lookup("bar:service"))
+
+    def test_lookup_by_region_and_interface(self):
+        self.assertEqual(
+            "https://ord1.foo.com/v1",
+            self.catalog.lookup("foo:service", region="ORD", internal=True))
+
+    def test_lookup_raises_error_with_unknown_region(self):
+        with self.assertRaises(service_registry.InvalidRegion):
+            self.catalog.lookup("bar:service", region="DFW")
+
+    def test_lookup_raises_error_with_missing_interface(self):
+        with self.assertRaises(service_registry.InvalidRegion):
+            self.catalog.lookup("bar:service", internal=True)
+
+    def test_lookup_raises_error_with_unknown_service(self):
+        with self.assertRaises(service_registry.InvalidServiceType):
+            self.catalog.lookup("baz:service")
+
+    def test_candidates_lists_every_endpoint(self):
+        self.assertEqual([
+            ("DFW", False, "https://dfw2.foo.com/v1"),
+            ("DFW", True, "https://dfw1.foo.com/v1"),
+            ("ORD", False, "https://ord2.foo.com/v1"),
+            ("ORD", True, "https://ord1.foo.com/v1")
+        ], self.catalog.candidates("foo:service"))
+
+    def test_candidates_filters_by_interface(self):
+        self.assertEqual([
+            ("IAD", False, "https://bar.foo.com/v1")
+        ], self.catalog.candidates("bar:service", internal=False))
+        self.assertEqual([], self.catalog.candidates(
+            "bar:service", internal=True))
@@ -1,6 +1,14 @@
 import json
 import hashlib
+import io
+import mmap
+import os
 import random
+import shutil
+import tarfile
+import tempfile
+
+from unittest import TestCase, mock
 
 try:
     from string import letters
@@ -12,14 +20,23 @@ try:
 except ImportError:
     import urllib.parse as urlparse
 
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPRequest, HTTPResponse
 from tornado.testing import AsyncTestCase, gen_test
 from testnado.service_case_helpers import ServiceCaseHelpers
 
 from tests.helpers.service_helpers import fetch_token
+from tornadorax.services.object_cache import InfoCache, ObjectCache
+from tornadorax.services.storage_service import BodyWriter
+from tornadorax.services.storage_service import StorageContainer
 from tornadorax.services.storage_service import StorageService
 from tornadorax.services.storage_service import SegmentWriter
 from tornadorax.services.storage_service import MissingTempURLKey
 from tornadorax.services.storage_service import StreamError
+from tornadorax.services.storage_service import StreamVerifier
+from tornadorax.services.storage_service import initial_segment_size
+from tornadorax.transport import HTTPTransport
 
 
 OBJECT_BODY = "".join([
@@ -107,6 +124,25 @@ class TestStorage(ServiceCaseHelpers, AsyncTestCase):
 
         self.assertEqual(b"CONTENTS", request.body)
 
+    @mock.patch("tornadorax.services.storage_service.EXECUTOR_HASH_SIZE", 4)
+    @gen_test
+    async def test_upload_stream_hashes_large_writes_off_the_ioloop(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        writer = await obj.upload_stream(mimetype="text/html")
+        with mock.patch.object(
+                self.io_loop, "run_in_executor",
+                wraps=self.io_loop.run_in_executor) as run_in_executor:
+            await writer.write(b"CON")
+            await writer.write(memoryview(b"TENTS"))
+            self.assertEqual(1, run_in_executor.call_count)
+        result = await writer.finish()
+        self.assertEqual(
+            hashlib.md5(b"CONTENTS").hexdigest(), result["md5sum"])
+        self.assertEqual(
+            hashlib.md5(b"CONTENTS").hexdigest(), writer.md5sum.hexdigest())
+
     @gen_test
     async def test_upload_stream_allows_extra_metadata(self):
         self.start_services()
@@ -172,6 +208,21 @@ class TestStorage(ServiceCaseHelpers, AsyncTestCase):
             "PUT", "/v1/container/manifest")
         self.assertEqual("dog", request.headers["X-Object-Meta-cat"])
 
+    @gen_test
+    async def test_upload_stream_supports_writers_without_new_options(self):
+        class LegacyWriter(object):
+            def __init__(
+                    self, url, container, name, token, mimetype, ioloop,
+                    content_length, extra_headers=None):
+                self.url = url
+
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        writer = await obj.upload_stream(
+            mimetype="text/html", writer=LegacyWriter)
+        self.assertEqual(obj.object_url, writer.url)
+
     @gen_test
     async def test_upload_stream_allows_segmentation(self):
         # big, nasty segment test. should be broken up later, especially
@@ -288,111 +339,1908 @@ class TestStorage(ServiceCaseHelpers, AsyncTestCase):
         self.assertEqual("text/html", request.headers["Content-type"])
         self.assertEqual(b"", request.body)
 
-    # Need to add tests that verify etags, retry manifests, etc.
+    @gen_test
+    async def test_upload_stream_sends_segments_concurrently(self):
+        in_flight = [0]
+        most_in_flight = [0]
+
+        class CountingTransport(HTTPTransport):
+
+            def fetch(self, url, **kwargs):
+                future = super(CountingTransport, self).fetch(url, **kwargs)
+                if "/segments/" in url:
+                    in_flight[0] += 1
+                    most_in_flight[0] = max(most_in_flight[0], in_flight[0])
+
+                    def finished(future):
+                        in_flight[0] -= 1
+
+                    future.add_done_callback(finished)
+                return future
+
+        self.start_services()
+        client = StorageService(
+            self.storage_service.url("/v1"), fetch_token=fetch_token,
+            ioloop=self.io_loop, transport=CountingTransport())
+        container = await client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        segment_writer = SegmentWriter.with_defaults(
+            segment_size=4, concurrency=3)
+        writer = await obj.upload_stream(
+            mimetype="text/html", writer=segment_writer)
+        await writer.write(b"abe lincoln wins by four")
+        result = await writer.finish()
+
+        self.assertEqual("success", result["status"])
+        self.assertEqual(24, result["length"])
+        self.assertEqual(3, most_in_flight[0])
+
+        request = self.storage_service.assert_requested(
+            "PUT", "/v1/container/manifest",
+            headers={"X-Auth-Token": "TOKEN"})
+        body = json.loads(request.body.decode("utf8"))
+        # manifest entries stay in order however segments finish
+        expected = [b"abe ", b"linc", b"oln ", b"wins", b" by ", b"four"]
+        self.assertEqual(
+            [hashlib.md5(content).hexdigest() for content in expected],
+            [segment["etag"] for segment in body])
+        self.assertEqual(
+            hashlib.md5("".join(
+                segment["etag"] for segment in body).encode("ascii")
+            ).hexdigest(), result["md5sum"])
 
+    @mock.patch("tornadorax.services.storage_service.CHUNK_SIZE", 4)
+    @mock.patch("tornadorax.services.storage_service.EXECUTOR_HASH_SIZE", 8)
     @gen_test
-    async def test_read_chunk(self):
+    async def test_segment_writer_hashes_small_frames_off_the_ioloop(self):
         self.start_services()
         container = await self.client.fetch_container("container")
-        obj = await container.fetch_object("object")
-        chunk1 = await obj.read(0, 1023)
-        chunk2 = await obj.read(1024)
-        total = await obj.read()
-        self.assertEqual(chunk1, OBJECT_BODY[:1024])
-        self.assertEqual(chunk2, OBJECT_BODY[1024:])
-        self.assertEqual(OBJECT_BODY, total)
+        obj = await container.fetch_object("manifest")
+        writer = await obj.upload_stream(
+            mimetype="text/html",
+            writer=SegmentWriter.with_defaults(segment_size=12))
+        with mock.patch.object(
+                self.io_loop, "run_in_executor",
+                wraps=self.io_loop.run_in_executor) as run_in_executor:
+            for offset in range(0, 24, 2):
+                await writer.write(b"abe lincoln wins by four"[offset:][:2])
+            result = await writer.finish()
+        # one batch of two frames per segment, the rest on finish
+        self.assertEqual(2, run_in_executor.call_count)
+
+        self.assertEqual("success", result["status"])
+        request = self.storage_service.assert_requested(
+            "PUT", "/v1/container/manifest")
+        body = json.loads(request.body.decode("utf8"))
+        self.assertEqual(
+            [hashlib.md5(content).hexdigest()
+             for content in (b"abe lincoln ", b"wins by four")],
+            [segment["etag"] for segment in body])
 
+    @mock.patch("tornadorax.services.storage_service.CHUNK_SIZE", 16)
     @gen_test
-    async def test_read_stream_returns_body_in_chunks(self):
+    async def test_segment_writer_frames_large_and_small_writes(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        segment_writer = SegmentWriter.with_defaults(segment_size=1000)
+        writer = await obj.upload_stream(
+            mimetype="text/html", writer=segment_writer)
+
+        # far more frames than the recursion limit would have allowed
+        body = OBJECT_BODY * 11
+        await writer.write(body[:20008])
+        writer.current_segment.put = mock.Mock(
+            side_effect=writer.current_segment.put)
+        # small writes are coalesced into whole frames
+        for offset in range(20008, 20488, 5):
+            await writer.write(body[offset:offset + 5])
+        frames = [
+            call[0][0] for call in writer.current_segment.put.call_args_list]
+        self.assertEqual([16] * 30, [len(frame) for frame in frames])
+
+        # mutable buffers can change once write() returns
+        data = bytearray(body[20488:])
+        await writer.write(data)
+        data[:] = b"x" * len(data)
+        result = await writer.finish()
+        self.assertEqual(len(body), result["length"])
+
+        request = self.storage_service.assert_requested(
+            "PUT", "/v1/container/manifest")
+        manifest = json.loads(request.body.decode("utf8"))
+        self.assertEqual(23, len(manifest))
+        self.assertEqual(
+            hashlib.md5(body[20000:21000]).hexdigest(),
+            manifest[20]["etag"])
+        self.assertEqual(
+            hashlib.md5(body[22000:]).hexdigest(), manifest[22]["etag"])
+        self.assertEqual(528, manifest[22]["size_bytes"])
+
+    def write_file(self, body, name="object.txt"):
+        path = os.path.join(os.path.dirname(self.make_path()), name)
+        with open(path, "wb") as fp:
+            fp.write(body)
+        return path
+
+    @gen_test
+    async def test_upload_file_sends_small_files_in_one_request(self):
         self.start_services()
         container = await self.client.fetch_container("container")
         obj = await container.fetch_object("object")
-        reader = await obj.read_stream()
-        body = bytearray()
-        for read_chunk in reader:
-            chunk = await read_chunk
-            body.extend(chunk)
-        self.assertEqual(OBJECT_BODY, body)
+        path = self.write_file(OBJECT_BODY)
+        result = await obj.upload_file(path, metadata={"foo": "bar"})
+        self.assertEqual("success", result["status"])
+        self.assertEqual(len(OBJECT_BODY), result["length"])
+        request = self.storage_service.assert_requested(
+            "PUT", "/v1/container/object", headers={
+                "Content-type": "text/plain", "X-Object-Meta-Foo": "bar",
+                "Content-length": str(len(OBJECT_BODY))})
+        self.assertEqual(OBJECT_BODY, request.body)
 
     @gen_test
-    async def test_read_stream_raises_with_uncomsumed_chunk(self):
+    async def test_upload_file_handles_empty_files(self):
         self.start_services()
         container = await self.client.fetch_container("container")
         obj = await container.fetch_object("object")
-        reader = await obj.read_stream()
-        next(reader)
-        with self.assertRaises(StreamError):
-            next(reader)
+        result = await obj.upload_file(
+            self.write_file(b"", name="empty"))
+        self.assertEqual("success", result["status"])
+        self.assertEqual(0, result["length"])
+        request = self.storage_service.assert_requested(
+            "PUT", "/v1/container/object",
+            headers={"Content-type": "application/octet-stream"})
+        self.assertEqual(b"", request.body)
 
+    @mock.patch("tornadorax.services.storage_service.EXECUTOR_HASH_SIZE", 256)
     @gen_test
-    async def test_read_stream_raises_with_bad_response(self):
+    async def test_upload_file_sends_segments_in_parallel(self):
         self.start_services()
         container = await self.client.fetch_container("container")
-        obj = await container.fetch_object("object2")
-        reader = await obj.read_stream()
+        obj = await container.fetch_object("manifest")
+        path = self.write_file(OBJECT_BODY)
+        with mock.patch.object(
+                SegmentWriter, "close_segment", autospec=True,
+                side_effect=SegmentWriter.close_segment) as close_segment:
+            result = await obj.upload_file(
+                path, segment_size=600, concurrency=3)
+        self.assertEqual("success", result["status"])
+        self.assertEqual(len(OBJECT_BODY), result["length"])
+        self.assertEqual(4, close_segment.call_count)
+
+        request = self.storage_service.assert_requested(
+            "PUT", "/v1/container/manifest")
+        manifest = json.loads(request.body.decode("utf8"))
+        self.assertEqual([600, 600, 600, 248], [
+            segment["size_bytes"] for segment in manifest])
+        for index, segment in enumerate(manifest):
+            self.assertEqual(
+                "/container/manifest/segments/{0:06d}".format(index + 1),
+                segment["path"])
+            content = OBJECT_BODY[index * 600:(index + 1) * 600]
+            self.assertEqual(
+                hashlib.md5(content).hexdigest(), segment["etag"])
+            request = self.storage_service.assert_requested(
+                "PUT", "/v1" + segment["path"])
+            self.assertEqual(content, request.body)
+
+    @gen_test
+    async def test_upload_file_stops_starting_segments_after_failure(self):
+        segment_requests = []
+
+        def unavailable_handle(handler):
+            segment_requests.append(handler.request.path)
+            handler.set_status(503)
+
+        self.storage_service.add_method(
+            "PUT", r"/v1/container/manifest/segments/\d+",
+            unavailable_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        path = self.write_file(OBJECT_BODY)
         with self.assertRaises(StreamError):
-            for read_chunk in reader:
-                await read_chunk
+            await obj.upload_file(path, segment_size=100, concurrency=2)
+        self.assertEqual(2, len(segment_requests))
+
+    def add_segment_store(self):
+        # segments PUT here can be HEADed afterwards
+        store = {}
+        self.segment_puts = []
+
+        def segment_write_handle(handler):
+            self.segment_puts.append(handler.request.path)
+            store[handler.request.path] = handler.request.body
+            object_write_handle(handler)
+
+        def segment_info_handle(handler):
+            body = store.get(handler.request.path)
+            if body is None:
+                handler.set_status(404)
+                return
+            handler.set_header("Etag", hashlib.md5(body).hexdigest())
+            handler.set_header("Content-length", str(len(body)))
+            handler.finish()
+
+        segments = r"/v1/container/manifest/segments/\d+"
+        self.storage_service.add_method("PUT", segments, segment_write_handle)
+        self.storage_service.add_method("HEAD", segments, segment_info_handle)
+        return store
 
     @gen_test
-    async def test_info_returns_metadata_about_object(self):
+    async def test_segment_writer_resumes_from_journal(self):
+        store = self.add_segment_store()
         self.start_services()
         container = await self.client.fetch_container("container")
-        obj = await container.fetch_object("object")
-        info = await obj.info()
-        self.assertEqual("success", info["status"])
-        self.assertEqual({"foo": "foo", "bar": "bar"}, info["metadata"])
-        self.assertEqual("value", info["x-foobar"])
-        self.assertEqual(1024, info["length"])
-        self.assertEqual("text/plain", info["type"])
-        self.assertEqual("md5sum", info["etag"])
+        obj = await container.fetch_object("manifest")
+        journal_path = self.make_path()
+        segment_writer = SegmentWriter.with_defaults(
+            segment_size=4, journal_path=journal_path)
+
+        # the first attempt dies after three segments
+        writer = await obj.upload_stream(
+            mimetype="text/html", writer=segment_writer)
+        await writer.write(b"abe lincoln ")
+        await gen.multi(writer.uploads)
+        with open(journal_path) as fp:
+            # a header naming the object, then the segments
+            self.assertEqual(4, len(fp.readlines()))
+        # and the third segment has since gone missing
+        del store["/v1/container/manifest/segments/000003"]
+
+        writer = await obj.upload_stream(
+            mimetype="text/html", writer=segment_writer)
+        offset = await writer.resume()
+        self.assertEqual(8, offset)
+        await writer.write(b"abe lincoln wins"[offset:])
+        result = await writer.finish()
+
+        self.assertEqual("success", result["status"])
+        self.assertEqual(16, result["length"])
+        self.assertFalse(os.path.exists(journal_path))
+        request = self.storage_service.assert_requested(
+            "PUT", "/v1/container/manifest")
+        manifest = json.loads(request.body.decode("utf8"))
+        self.assertEqual(
+            [hashlib.md5(content).hexdigest()
+             for content in (b"abe ", b"linc", b"oln ", b"wins")],
+            [segment["etag"] for segment in manifest])
 
     @gen_test
-    async def test_info_returns_error_with_bad_response(self):
+    async def test_upload_file_skips_journaled_segments(self):
+        store = self.add_segment_store()
         self.start_services()
         container = await self.client.fetch_container("container")
-        obj = await container.fetch_object("object2")
-        info = await obj.info()
-        self.assertEqual("error", info["status"])
-        self.assertEqual(404, info["code"])
+        obj = await container.fetch_object("manifest")
+        journal_path = self.make_path()
+        with open(journal_path, "w") as fp:
+            for index in (1, 0, 3):
+                content = OBJECT_BODY[index * 600:(index + 1) * 600]
+                path = "/container/manifest/segments/{0:06d}".format(
+                    index + 1)
+                store["/v1" + path] = content
+                fp.write(json.dumps({
+                    "index": index, "path": path, "size_bytes": 600,
+                    "etag": hashlib.md5(content).hexdigest()}) + "\n")
+            # a partial line from a crash is ignored
+            fp.write('{"index": 2, "pa')
+
+        result = await obj.upload_file(
+            self.write_file(OBJECT_BODY), segment_size=600,
+            journal_path=journal_path)
+        self.assertEqual("success", result["status"])
+        self.assertEqual(len(OBJECT_BODY), result["length"])
+        # segments 1 and 2 were kept, 3 and 4 were sent again
+        self.assertEqual([
+            "/v1/container/manifest/segments/000003",
+            "/v1/container/manifest/segments/000004"],
+            sorted(self.segment_puts))
+        self.assertEqual(OBJECT_BODY[1800:], store[
+            "/v1/container/manifest/segments/000004"])
 
+    @gen_test
+    async def test_resume_rejects_journals_for_other_objects(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        journal_path = self.make_path()
+        with open(journal_path, "w") as fp:
+            fp.write(json.dumps(
+                {"object": "/container/other", "source": None}) + "\n")
+            fp.write(json.dumps({
+                "index": 0, "path": "/container/other/segments/000001",
+                "size_bytes": 4, "etag": "etag"}) + "\n")
 
-def object_write_handle(handler):
-    handler.set_status(201)
-    handler.set_header(
-        "ETag", hashlib.md5(handler.request.body).hexdigest())
-    handler.finish()
+        writer = await obj.upload_stream(
+            mimetype="text/html", writer=SegmentWriter.with_defaults(
+                segment_size=4, journal_path=journal_path))
+        with self.assertRaises(ValueError):
+            await writer.resume()
 
+    @gen_test
+    async def test_resume_skips_segments_of_other_objects(self):
+        store = self.add_segment_store()
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        journal_path = self.make_path()
+        path = "/container/other/segments/000001"
+        store["/v1" + path] = b"abe "
+        with open(journal_path, "w") as fp:
+            fp.write(json.dumps({
+                "index": 0, "path": path, "size_bytes": 4,
+                "etag": hashlib.md5(b"abe ").hexdigest()}) + "\n")
 
-def object_write_error_handle(handler):
-    handler.set_status(401)
-    handler.write("ERROR")
+        writer = await obj.upload_stream(
+            mimetype="text/html", writer=SegmentWriter.with_defaults(
+                segment_size=4, journal_path=journal_path))
+        self.assertEqual(0, await writer.resume())
+        self.assertEqual(0, writer.segment_count)
 
+    @gen_test
+    async def test_upload_file_starts_over_when_file_changed(self):
+        self.add_segment_store()
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        journal_path = self.make_path()
+        path = self.write_file(OBJECT_BODY)
 
-def object_read_handle(handler):
-    handler.set_status(200)
-    range_string = handler.request.headers.get("Range", "bytes=0-")
-    range_parts = range_string.split("=")[1].rsplit("-", 1)
-    start, end = range_parts
-    if not end:
-        end = len(OBJECT_BODY) - 1
-    start, end = (int(start), int(end) + 1)
+        # a first attempt journals every segment, then the file changes
+        writer = await obj.upload_stream(
+            mimetype="text/html", writer=SegmentWriter.with_defaults(
+                segment_size=600, journal_path=journal_path,
+                journal_source={"size": 0, "mtime": 0}))
+        await writer.write(OBJECT_BODY[:1800])
+        await gen.multi(writer.uploads)
+        self.segment_puts[:] = []
+
+        result = await obj.upload_file(
+            path, segment_size=600, journal_path=journal_path)
+        self.assertEqual("success", result["status"])
+        self.assertEqual(4, len(self.segment_puts))
 
-    for i in range(0, end-start, 1024):
-        offset = start + i
-        offset_end = offset + 1024 if end > offset + 1024 else end
-        handler.write(OBJECT_BODY[offset:offset_end])
-        handler.flush()
+    def add_flaky_segments(self, failures):
+        # failures maps segment paths to handlers used once each
+        def flaky_write_handle(handler):
+            if handler.request.path in failures:
+                failures.pop(handler.request.path)(handler)
+                return
+            object_write_handle(handler)
 
-    handler.finish()
+        self.storage_service.add_method(
+            "PUT", r"/v1/container/manifest/segments/\d+",
+            flaky_write_handle)
 
+    @mock.patch("tornadorax.utilities.generate_backoff", lambda i: 0.01)
+    @gen_test
+    async def test_segment_writer_retries_failed_segments(self):
+        def unavailable_handle(handler):
+            handler.set_status(503)
+
+        def corrupt_handle(handler):
+            handler.set_status(201)
+            handler.set_header("ETag", hashlib.md5(b"other").hexdigest())
+
+        failures = {
+            "/v1/container/manifest/segments/000002": unavailable_handle,
+            "/v1/container/manifest/segments/000003": corrupt_handle
+        }
+        self.add_flaky_segments(failures)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        writer = await obj.upload_stream(
+            mimetype="text/html", writer=SegmentWriter.with_defaults(
+                segment_size=4, segment_retries=2, spool_size=2))
+        await writer.write(b"abe lincoln wins")
+        result = await writer.finish()
 
-def object_info_handle(handler):
-    handler.set_status(200)
-    handler.set_header("X-Object-Meta-Foo", "foo")
-    handler.set_header("X-Object-Meta-Bar", "bar")
-    handler.set_header("Etag", "md5sum")
-    handler.set_header("Content-length", "1024")
-    handler.set_header("Content-type", "text/plain")
-    handler.set_header("X-Foobar", "value")
-    handler.finish()
+        self.assertEqual("success", result["status"])
+        self.assertEqual({}, failures)
+        request = self.storage_service.assert_requested(
+            "PUT", "/v1/container/manifest/segments/000003")
+        self.assertEqual(b"oln ", request.body)
+        request = self.storage_service.assert_requested(
+            "PUT", "/v1/container/manifest")
+        manifest = json.loads(request.body.decode("utf8"))
+        self.assertEqual(
+            [hashlib.md5(content).hexdigest()
+             for content in (b"abe ", b"linc", b"oln ", b"wins")],
+            [segment["etag"] for segment in manifest])
+
+    @mock.patch("tornadorax.utilities.generate_backoff", lambda i: 0.01)
+    @gen_test
+    async def test_segment_writer_retries_dropped_retry_connections(self):
+        def unavailable_handle(handler):
+            handler.set_status(503)
+
+        send = BodyWriter._send
+        dropped = []
+
+        async def dropping_send(body_writer, data):
+            # only the retries are written without a spool
+            if body_writer.spool is None and not dropped:
+                dropped.append(body_writer.url)
+                raise IOError("Connection dropped.")
+            await send(body_writer, data)
+
+        self.add_flaky_segments({
+            "/v1/container/manifest/segments/000001": unavailable_handle})
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        writer = await obj.upload_stream(
+            mimetype="text/html", writer=SegmentWriter.with_defaults(
+                segment_size=4, segment_retries=3, spool_size=2))
+        with mock.patch.object(BodyWriter, "_send", dropping_send):
+            await writer.write(b"abe ")
+            result = await writer.finish()
+
+        self.assertEqual("success", result["status"])
+        self.assertEqual(1, len(dropped))
+        request = self.storage_service.assert_requested(
+            "PUT", "/v1/container/manifest/segments/000001")
+        self.assertEqual(b"abe ", request.body)
+
+    @gen_test
+    async def test_segment_writer_raises_without_segment_retries(self):
+        def unavailable_handle(handler):
+            handler.set_status(503)
+
+        self.add_flaky_segments({
+            "/v1/container/manifest/segments/000001": unavailable_handle})
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        writer = await obj.upload_stream(
+            mimetype="text/html",
+            writer=SegmentWriter.with_defaults(segment_size=4))
+        await writer.write(b"abe ")
+        with self.assertRaises(StreamError):
+            await writer.finish()
+
+    @mock.patch("tornadorax.utilities.generate_backoff", lambda i: 0.01)
+    @gen_test
+    async def test_segment_writer_retries_manifest(self):
+        attempts = []
+
+        def flaky_manifest_handle(handler):
+            attempts.append(handler.request.body)
+            if len(attempts) == 1:
+                handler.set_status(503)
+                return
+            object_write_handle(handler)
+
+        self.storage_service.add_method(
+            "PUT", "/v1/container/manifest", flaky_manifest_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        writer = await obj.upload_stream(
+            mimetype="text/html",
+            writer=SegmentWriter.with_defaults(segment_size=4))
+        await writer.write(b"abe ")
+        result = await writer.finish()
+        self.assertEqual("success", result["status"])
+        self.assertEqual(2, len(attempts))
+        self.assertEqual(attempts[0], attempts[1])
+
+    @gen_test
+    async def test_segment_writer_returns_error_for_rejected_manifest(self):
+        self.storage_service.add_method(
+            "PUT", "/v1/container/manifest", object_write_error_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        writer = await obj.upload_stream(
+            mimetype="text/html",
+            writer=SegmentWriter.with_defaults(segment_size=4))
+        await writer.write(b"abe ")
+        result = await writer.finish()
+        self.assertEqual("error", result["status"])
+        self.assertEqual(401, result["code"])
+
+    @gen_test
+    async def test_segment_writer_nests_large_static_manifests(self):
+        manifests = {}
+
+        def manifest_write_handle(handler):
+            self.assertEqual("put", handler.get_argument("multipart-manifest"))
+            manifests[handler.request.path] = json.loads(
+                handler.request.body.decode("utf8"))
+            object_write_handle(handler)
+
+        self.storage_service.add_method(
+            "PUT", "/v1/container/manifest", manifest_write_handle)
+        self.storage_service.add_method(
+            "PUT", r"/v1/container/manifest/manifests/\d+",
+            manifest_write_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        writer = await obj.upload_stream(
+            mimetype="text/html", writer=SegmentWriter.with_defaults(
+                segment_size=4, max_manifest_segments=2, concurrency=2))
+        body = b"abe lincoln wins again"
+        await writer.write(body[:16])
+        await gen.multi(writer.uploads)
+        # written sub-manifests no longer hold their segments in memory,
+        # and the last full run waits for a segment after it
+        self.assertEqual(1, len(writer.manifests))
+        self.assertEqual([2, 3], sorted(writer.segments))
+        # finished uploads aren't held on to either
+        self.assertTrue(len(writer.uploads) <= 2)
+        await writer.write(body[16:])
+        result = await writer.finish()
+
+        self.assertEqual("success", result["status"])
+        self.assertEqual(len(body), result["length"])
+        self.assertEqual([
+            "/v1/container/manifest",
+            "/v1/container/manifest/manifests/000001",
+            "/v1/container/manifest/manifests/000002",
+            "/v1/container/manifest/manifests/000003"], sorted(manifests))
+
+        def etag(contents):
+            return hashlib.md5(contents).hexdigest()
+
+        self.assertEqual([
+            {"path": "/container/manifest/segments/000003",
+             "etag": etag(b"oln "), "size_bytes": 4},
+            {"path": "/container/manifest/segments/000004",
+             "etag": etag(b"wins"), "size_bytes": 4}
+        ], manifests["/v1/container/manifest/manifests/000002"])
+
+        top = manifests["/v1/container/manifest"]
+        self.assertEqual([
+            "/container/manifest/manifests/000001",
+            "/container/manifest/manifests/000002",
+            "/container/manifest/manifests/000003"
+        ], [entry["path"] for entry in top])
+        self.assertEqual([8, 8, 6], [entry["size_bytes"] for entry in top])
+        self.assertEqual(
+            etag((etag(b"oln ") + etag(b"wins")).encode("ascii")),
+            top[1]["etag"])
+        self.assertEqual(etag("".join(
+            entry["etag"] for entry in top).encode("ascii")),
+            result["md5sum"])
+
+    @gen_test
+    async def test_segment_writer_does_not_nest_at_exact_limit(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        writer = await obj.upload_stream(
+            mimetype="text/html", writer=SegmentWriter.with_defaults(
+                segment_size=4, max_manifest_segments=2))
+        await writer.write(b"abe linc")
+        result = await writer.finish()
+
+        self.assertEqual("success", result["status"])
+        self.assertEqual([], writer.manifests)
+        request = self.storage_service.assert_requested(
+            "PUT", "/v1/container/manifest")
+        manifest = json.loads(request.body.decode("utf8"))
+        self.assertEqual([
+            "/container/manifest/segments/000001",
+            "/container/manifest/segments/000002"
+        ], [entry["path"] for entry in manifest])
+
+    @mock.patch("tornadorax.services.storage_service.MIN_SEGMENT_SIZE", 4)
+    @mock.patch(
+        "tornadorax.services.storage_service.TARGET_SEGMENT_SECONDS", 0)
+    @gen_test
+    async def test_segment_writer_adapts_segment_size(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        body = OBJECT_BODY[:64]
+        writer = await obj.upload_stream(
+            mimetype="text/html", content_length=len(body),
+            writer=SegmentWriter.with_defaults(adaptive=True))
+        # a quarter of the content for the single upload slot
+        self.assertEqual(16, writer.segment_size)
+        await writer.write(body)
+        result = await writer.finish()
+        self.assertEqual("success", result["status"])
+
+        request = self.storage_service.assert_requested(
+            "PUT", "/v1/container/manifest")
+        manifest = json.loads(request.body.decode("utf8"))
+        # segments that take longer than the (zero second) target halve
+        # in size each time, down to the minimum
+        self.assertEqual(
+            [16, 8] + [4] * 10,
+            [segment["size_bytes"] for segment in manifest])
+
+    def test_segment_writer_fits_spool_in_memory_budget(self):
+        writer = SegmentWriter(
+            "url", "container", "object", "TOKEN", "text/html",
+            self.io_loop, 0, concurrency=4, memory_budget=16 * 1024 * 1024)
+        self.assertEqual(
+            2 * 1024 * 1024 - writer.queue_size * 64 * 1024,
+            writer.spool_size)
+
+    @gen_test
+    async def test_segment_writer_never_nests_dynamic_manifests(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        writer = await obj.upload_stream(
+            mimetype="text/html", writer=SegmentWriter.with_defaults(
+                segment_size=4, max_manifest_segments=2, dynamic=True))
+        await writer.write(b"abe lincoln ")
+        result = await writer.finish()
+
+        self.assertEqual("success", result["status"])
+        self.assertEqual(12, result["length"])
+        self.assertEqual([], writer.manifests)
+        etags = "".join(
+            hashlib.md5(content).hexdigest()
+            for content in (b"abe ", b"linc", b"oln "))
+        self.assertEqual(
+            hashlib.md5(etags.encode("ascii")).hexdigest(), result["md5sum"])
+        request = self.storage_service.assert_requested(
+            "PUT", "/v1/container/manifest")
+        self.assertEqual(
+            "container/manifest/segments",
+            request.headers["X-Object-Manifest"])
+
+    # Need to add tests that verify etags, retry manifests, etc.
+
+    @gen_test
+    async def test_transport_is_shared_with_objects_and_writers(self):
+        self.start_services()
+        transport = HTTPTransport(max_clients=20)
+        self.addCleanup(transport.close)
+        client = StorageService(
+            self.storage_service.url("/v1"), fetch_token=fetch_token,
+            ioloop=self.io_loop, transport=transport)
+        container = await client.fetch_container("container")
+        obj = await container.fetch_object("manifest")
+        self.assertIs(transport, obj.transport)
+        self.assertIs(transport, obj.client)
+        writer = await obj.upload_stream(
+            mimetype="text/html",
+            writer=SegmentWriter.with_defaults(segment_size=4))
+        await writer.write(b"abcdef")
+        await writer.finish()
+        self.assertIs(transport, writer.transport)
+        self.assertIs(transport, writer.create_segment().transport)
+        self.assertIs(transport, writer.create_segment().client)
+
+    @gen_test
+    async def test_requests_are_labeled_for_listeners(self):
+        self.start_services()
+        transport = HTTPTransport()
+        listener = mock.Mock()
+        transport.add_listener(listener)
+        client = StorageService(
+            self.storage_service.url("/v1"), fetch_token=fetch_token,
+            ioloop=self.io_loop, transport=transport)
+        container = await client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        await obj.info()
+        await obj.read()
+
+        info_event, read_event = [
+            call[0][0] for call in listener.request_finished.call_args_list]
+        self.assertEqual("object-store", info_event.service)
+        self.assertEqual("info", info_event.operation)
+        self.assertEqual("/{container}/{object}", info_event.url_template)
+        self.assertEqual("read_stream", read_event.operation)
+        self.assertEqual(len(OBJECT_BODY), read_event.bytes_received)
+
+    @gen_test
+    async def test_read_chunk(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        chunk1 = await obj.read(0, 1023)
+        chunk2 = await obj.read(1024)
+        total = await obj.read()
+        self.assertEqual(chunk1, OBJECT_BODY[:1024])
+        self.assertEqual(chunk2, OBJECT_BODY[1024:])
+        self.assertEqual(OBJECT_BODY, total)
+
+    @gen_test
+    async def test_read_parallel_fetches_ranges(self):
+        ranges = []
+
+        def recording_read_handle(handler):
+            ranges.append(handler.request.headers["Range"])
+            object_read_handle(handler)
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", recording_read_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        body = await obj.read(
+            end=len(OBJECT_BODY) - 1, concurrency=4, part_size=300)
+        self.assertEqual(OBJECT_BODY, body)
+        self.assertEqual(7, len(ranges))
+        self.assertIn("bytes=1800-2047", ranges)
+
+    @gen_test
+    async def test_read_parallel_uses_object_length(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        # the HEAD handler reports 1024 bytes
+        body = await obj.read(concurrency=2, part_size=100)
+        self.assertEqual(OBJECT_BODY[:1024], body)
+
+    @mock.patch("tornadorax.utilities.generate_backoff", lambda i: 0.01)
+    @gen_test
+    async def test_read_parallel_retries_failed_parts(self):
+        failures = ["bytes=500-999"]
+
+        def flaky_read_handle(handler):
+            if handler.request.headers["Range"] in failures:
+                failures.remove(handler.request.headers["Range"])
+                handler.set_status(503)
+                return
+            object_read_handle(handler)
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", flaky_read_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        body = await obj.read(end=1999, concurrency=4, part_size=500)
+        self.assertEqual(OBJECT_BODY[:2000], body)
+        self.assertEqual([], failures)
+
+    @mock.patch("tornadorax.utilities.generate_backoff", lambda i: 0.01)
+    @gen_test
+    async def test_read_parallel_never_writes_error_bodies(self):
+        failures = ["bytes=0-19"]
+
+        async def flaky_read_handle(handler):
+            if handler.request.headers["Range"] in failures:
+                failures.remove(handler.request.headers["Range"])
+                # after the next range is done, so it would be overwritten
+                await gen.sleep(0.1)
+                handler.set_status(503)
+                handler.write("<html>Service Temporarily Unavailable</html>")
+                return
+            object_read_handle(handler)
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", flaky_read_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        body = await obj.read(end=59, concurrency=3, part_size=20)
+        self.assertEqual(OBJECT_BODY[:60], body)
+        self.assertEqual([], failures)
+
+    @mock.patch("tornadorax.utilities.generate_backoff", lambda i: 0.01)
+    @gen_test
+    async def test_read_parallel_rejects_responses_that_ignore_range(self):
+        def whole_object_handle(handler):
+            handler.set_status(200)
+            handler.write(OBJECT_BODY)
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", whole_object_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        body = bytearray(b"-" * 40)
+        with self.assertRaises(StreamError):
+            await obj.readinto(body, start=0, concurrency=2, part_size=20)
+        # neither the overlong first range nor the misplaced second one
+        # are written past their slots
+        self.assertEqual(OBJECT_BODY[:20] + b"-" * 20, body)
+
+    @gen_test
+    async def test_read_parallel_raises_with_bad_response(self):
+        self.storage_service.add_method(
+            "HEAD", "/v1/container/object2", object_info_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object2")
+        with self.assertRaises(StreamError):
+            await obj.read(concurrency=2)
+
+    @gen_test
+    async def test_readinto_fills_memory_mapped_file(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        path = self.make_path()
+        with open(path, "wb") as fp:
+            fp.truncate(1000)
+        with open(path, "r+b") as fp:
+            with mmap.mmap(fp.fileno(), 1000) as mapped:
+                count = await obj.readinto(
+                    mapped, start=48, concurrency=3, part_size=256)
+        self.assertEqual(1000, count)
+        with open(path, "rb") as fp:
+            self.assertEqual(OBJECT_BODY[48:1048], fp.read())
+
+    @gen_test
+    async def test_download_to_path_streams_to_file(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        path = self.make_path()
+        count = await obj.download_to_path(path)
+        self.assertEqual(len(OBJECT_BODY), count)
+        with open(path, "rb") as fp:
+            self.assertEqual(OBJECT_BODY, fp.read())
+
+    @gen_test
+    async def test_download_to_path_writes_ranges_concurrently(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        path = self.make_path()
+        # the HEAD handler reports 1024 bytes
+        count = await obj.download_to_path(
+            path, concurrency=4, part_size=100, fsync=False)
+        self.assertEqual(1024, count)
+        with open(path, "rb") as fp:
+            self.assertEqual(OBJECT_BODY[:1024], fp.read())
+
+    @mock.patch("tornadorax.utilities.generate_backoff", lambda i: 0.01)
+    @gen_test
+    async def test_download_to_path_keeps_error_bodies_out_of_file(self):
+        failures = ["bytes=0-9"]
+
+        async def flaky_read_handle(handler):
+            if handler.request.headers["Range"] in failures:
+                failures.remove(handler.request.headers["Range"])
+                await gen.sleep(0.1)
+                handler.set_status(503)
+                handler.write("<html>Service Unavailable</html>")
+                return
+            object_read_handle(handler)
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", flaky_read_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        path = self.make_path()
+        count = await obj.download_to_path(
+            path, end=19, concurrency=2, part_size=10, fsync=False)
+        self.assertEqual(20, count)
+        with open(path, "rb") as fp:
+            self.assertEqual(OBJECT_BODY[:20], fp.read())
+
+    @gen_test
+    async def test_download_to_path_removes_file_after_failure(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object2")
+        path = self.make_path()
+        with self.assertRaises(StreamError):
+            await obj.download_to_path(path, end=99, concurrency=2)
+        self.assertFalse(os.path.exists(path))
+
+    def make_path(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(directory))
+        return os.path.join(directory, "object")
+
+    def add_large_object(self, manifest_type="static", segment_handle=None):
+        self.storage_service.add_method(
+            "HEAD", "/v1/container/large",
+            lambda handler: large_object_info_handle(handler, manifest_type))
+        self.storage_service.add_method(
+            "GET", "/v1/container/large", static_manifest_handle)
+        self.storage_service.add_method(
+            "GET", "/v1/segments", dynamic_listing_handle)
+        self.storage_service.add_method(
+            "GET", r"/v1/segments/large/\d+",
+            segment_handle or segment_read_handle)
+
+    @gen_test
+    async def test_fetch_segments_returns_none_for_plain_objects(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        self.assertIsNone(await obj.fetch_segments())
+        with self.assertRaises(StreamError):
+            await obj.read_segments()
+
+    @gen_test
+    async def test_fetch_segments_reads_static_manifest(self):
+        self.add_large_object()
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("large")
+        segments = await obj.fetch_segments()
+        self.assertEqual(
+            [0, 512, 1024, 1536], [segment.offset for segment in segments])
+        self.assertEqual(
+            self.storage_service.url("/v1/segments/large/002"),
+            segments[2].url)
+        self.assertEqual(
+            hashlib.md5(OBJECT_BODY[1024:1536]).hexdigest(),
+            segments[2].etag)
+        self.storage_service.assert_requested(
+            "GET", "/v1/container/large",
+            headers={"X-Auth-Token": "TOKEN"})
+
+    @gen_test
+    async def test_read_segments_reassembles_static_large_object(self):
+        self.add_large_object()
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("large")
+        body = await obj.read_segments(concurrency=2)
+        self.assertEqual(OBJECT_BODY, body)
+
+    @gen_test
+    async def test_read_segments_reassembles_dynamic_large_object(self):
+        self.add_large_object(manifest_type="dynamic")
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("large")
+        body = await obj.read_segments(concurrency=4)
+        self.assertEqual(OBJECT_BODY, body)
+
+    @mock.patch("tornadorax.utilities.generate_backoff", lambda i: 0.01)
+    @gen_test
+    async def test_read_segments_retries_corrupt_segments(self):
+        corrupted = ["/v1/segments/large/001"]
+
+        def corrupt_segment_handle(handler):
+            if handler.request.path in corrupted:
+                corrupted.remove(handler.request.path)
+                handler.write(b"x" * 512)
+                return
+            segment_read_handle(handler)
+
+        self.add_large_object(segment_handle=corrupt_segment_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("large")
+        body = await obj.read_segments()
+        self.assertEqual(OBJECT_BODY, body)
+        self.assertEqual([], corrupted)
+
+    @mock.patch("tornadorax.utilities.generate_backoff", lambda i: 0.01)
+    @gen_test
+    async def test_read_segments_never_writes_error_bodies(self):
+        failures = ["/v1/segments/large/000"]
+
+        async def flaky_segment_handle(handler):
+            if handler.request.path in failures:
+                failures.remove(handler.request.path)
+                await gen.sleep(0.1)
+                handler.set_status(503)
+                handler.write("<html>Unavailable</html>" * 40)
+                return
+            segment_read_handle(handler)
+
+        self.add_large_object(segment_handle=flaky_segment_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("large")
+        path = self.make_path()
+        await obj.download_segments_to_path(path, concurrency=4)
+        with open(path, "rb") as fp:
+            self.assertEqual(OBJECT_BODY, fp.read())
+        self.assertEqual([], failures)
+
+    @mock.patch("tornadorax.utilities.generate_backoff", lambda i: 0.01)
+    @gen_test
+    async def test_read_segments_raises_when_segment_never_matches(self):
+        def corrupt_segment_handle(handler):
+            handler.write(b"x" * 512)
+
+        self.add_large_object(segment_handle=corrupt_segment_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("large")
+        with self.assertRaises(StreamError):
+            await obj.read_segments()
+
+    @gen_test
+    async def test_download_segments_to_path_writes_file(self):
+        self.add_large_object()
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("large")
+        path = self.make_path()
+        length = await obj.download_segments_to_path(path, concurrency=3)
+        self.assertEqual(len(OBJECT_BODY), length)
+        with open(path, "rb") as fp:
+            self.assertEqual(OBJECT_BODY, fp.read())
+
+    @gen_test
+    async def test_stream_segments_yields_segments_in_order(self):
+        self.add_large_object(manifest_type="dynamic")
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("large")
+        reader = await obj.stream_segments(concurrency=2)
+        chunks = []
+        async for chunk in reader:
+            self.assertTrue(len(reader.pending) <= 2)
+            chunks.append(chunk)
+        self.assertEqual(4, len(chunks))
+        self.assertEqual(OBJECT_BODY, b"".join(chunks))
+
+    @gen_test
+    async def test_read_window_iterates_over_bounded_windows(self):
+        ranges = []
+
+        def recording_read_handle(handler):
+            ranges.append(handler.request.headers["Range"])
+            object_read_handle(handler)
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", recording_read_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        reader = obj.read_window(window_size=1000)
+        body = bytearray()
+        async for chunk in reader:
+            self.assertTrue(reader.buffered + len(chunk) <= 1000)
+            body.extend(chunk)
+        self.assertEqual(OBJECT_BODY, body)
+        self.assertEqual(
+            ["bytes=0-999", "bytes=1000-1999", "bytes=2000-2999"], ranges)
+
+    @gen_test
+    async def test_read_window_respects_range(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        body = bytearray()
+        async for chunk in obj.read_window(start=100, end=1100,
+                                           window_size=300):
+            body.extend(chunk)
+        self.assertEqual(OBJECT_BODY[100:1101], body)
+
+    @gen_test
+    async def test_read_window_stops_at_content_range_total(self):
+        ranges = []
+
+        def content_range_handle(handler):
+            ranges.append(handler.request.headers["Range"])
+            handler.set_status(206)
+            handler.set_header(
+                "Content-Range", "bytes 0-1023/{0}".format(1024))
+            handler.write(OBJECT_BODY[:1024])
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", content_range_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        body = bytearray()
+        async for chunk in obj.read_window(window_size=1024):
+            body.extend(chunk)
+        self.assertEqual(OBJECT_BODY[:1024], body)
+        self.assertEqual(["bytes=0-1023"], ranges)
+
+    @mock.patch("tornadorax.utilities.generate_backoff", lambda i: 0.01)
+    @gen_test
+    async def test_read_window_does_not_repeat_retried_data(self):
+        attempts = []
+
+        def failing_read_handle(handler):
+            attempts.append(1)
+            if len(attempts) == 1:
+                # send part of the window, then fail
+                handler.set_status(206)
+                handler.write(OBJECT_BODY[:100])
+                handler.flush()
+                handler.request.connection.stream.close()
+                return
+            object_read_handle(handler)
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", failing_read_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        body = bytearray()
+        async for chunk in obj.read_window(end=499, window_size=500):
+            body.extend(chunk)
+        self.assertEqual(OBJECT_BODY[:500], body)
+        self.assertEqual(2, len(attempts))
+
+    @mock.patch("tornadorax.utilities.generate_backoff", lambda i: 0.01)
+    @gen_test
+    async def test_read_window_skips_error_bodies(self):
+        attempts = []
+
+        def flaky_read_handle(handler):
+            attempts.append(1)
+            if len(attempts) == 1:
+                handler.set_status(503)
+                handler.write("<html>Service Unavailable</html>")
+                return
+            object_read_handle(handler)
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", flaky_read_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        body = bytearray()
+        async for chunk in obj.read_window(end=499, window_size=500):
+            body.extend(chunk)
+        self.assertEqual(OBJECT_BODY[:500], body)
+        self.assertEqual(2, len(attempts))
+
+    @gen_test
+    async def test_read_window_raises_with_bad_response(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object2")
+        with self.assertRaises(StreamError):
+            async for chunk in obj.read_window():
+                pass
+
+    @gen_test
+    async def test_read_revalidates_cached_object_with_etag(self):
+        requests = []
+
+        def etag_read_handle(handler):
+            requests.append(handler.request)
+            etag = hashlib.md5(OBJECT_BODY).hexdigest()
+            if handler.request.headers.get("If-None-Match") == etag:
+                handler.set_status(304)
+                return
+            handler.set_header("Etag", etag)
+            handler.write(OBJECT_BODY)
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", etag_read_handle)
+        self.start_services()
+        self.client.object_cache = ObjectCache(max_bytes=10000)
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+
+        self.assertEqual(OBJECT_BODY, await obj.read())
+        self.assertEqual(OBJECT_BODY, await obj.read())
+        body = bytearray()
+        for read_future in await obj.read_stream():
+            body.extend(await read_future)
+        self.assertEqual(OBJECT_BODY, body)
+
+        self.assertEqual(3, len(requests))
+        self.assertNotIn("If-None-Match", requests[0].headers)
+        self.assertEqual(
+            hashlib.md5(OBJECT_BODY).hexdigest(),
+            requests[1].headers["If-None-Match"])
+
+        # ranges skip the cache entirely
+        await obj.read(0, 9)
+        self.assertEqual(4, len(requests))
+        self.assertEqual("bytes=0-9", requests[3].headers["Range"])
+        self.assertNotIn("If-None-Match", requests[3].headers)
+
+    @gen_test
+    async def test_cached_read_stream_streams_and_fills_cache(self):
+        requests = []
+
+        def etag_read_handle(handler):
+            requests.append(handler.request)
+            etag = hashlib.md5(OBJECT_BODY).hexdigest()
+            if handler.request.headers.get("If-None-Match") == etag:
+                handler.set_status(304)
+                return
+            handler.set_header("Etag", etag)
+            handler.write(OBJECT_BODY)
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", etag_read_handle)
+        self.start_services()
+        self.client.object_cache = ObjectCache(max_bytes=10000)
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+
+        for i in range(2):
+            body = bytearray()
+            for read_future in await obj.read_stream():
+                body.extend(await read_future)
+            self.assertEqual(OBJECT_BODY, body)
+
+        self.assertEqual(2, len(requests))
+        self.assertNotIn("Range", requests[0].headers)
+        self.assertEqual(
+            hashlib.md5(OBJECT_BODY).hexdigest(),
+            requests[1].headers["If-None-Match"])
+
+    @gen_test
+    async def test_cached_reads_skip_objects_larger_than_cache(self):
+        def etag_read_handle(handler):
+            handler.set_header("Etag", "etag")
+            handler.write(OBJECT_BODY)
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", etag_read_handle)
+        self.start_services()
+        cache = ObjectCache(max_bytes=len(OBJECT_BODY) - 1)
+        self.client.object_cache = cache
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+
+        self.assertEqual(OBJECT_BODY, await obj.read())
+        body = bytearray()
+        for read_future in await obj.read_stream():
+            body.extend(await read_future)
+        self.assertEqual(OBJECT_BODY, body)
+        self.assertIsNone(cache.get(obj.object_url))
+
+    @gen_test
+    async def test_concurrent_cached_reads_share_a_request(self):
+        requests = []
+
+        def etag_read_handle(handler):
+            requests.append(handler.request)
+            handler.set_header("Etag", "etag")
+            handler.write(OBJECT_BODY)
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", etag_read_handle)
+        self.start_services()
+        self.client.object_cache = ObjectCache(max_bytes=10000)
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        bodies = await gen.multi([obj.read() for i in range(5)])
+        self.assertEqual([OBJECT_BODY] * 5, bodies)
+        self.assertEqual(1, len(requests))
+
+    @gen_test
+    async def test_upload_stream_invalidates_cached_object(self):
+        self.start_services()
+        cache = ObjectCache(max_bytes=10000)
+        cache.put(self.storage_service.url("/v1/container/object"), "e", b"x")
+        self.client.object_cache = cache
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        writer = await obj.upload_stream(mimetype="text/html")
+        self.assertIsNone(cache.get(obj.object_url))
+
+        # a read during the upload can refill the cache with the old body
+        cache.put(obj.object_url, "e", b"x")
+        await writer.write(b"data")
+        await writer.finish()
+        self.assertIsNone(cache.get(obj.object_url))
+
+    @gen_test
+    async def test_bulk_operations_invalidate_cached_objects(self):
+        def extract_archive_handle(handler):
+            handler.write(json.dumps({
+                "Number Files Created": 1, "Response Status": "201 Created",
+                "Response Body": "", "Errors": []}))
+
+        def bulk_delete_handle(handler):
+            handler.write(json.dumps({
+                "Number Deleted": 1, "Number Not Found": 0,
+                "Response Status": "200 OK", "Response Body": "",
+                "Errors": []}))
+
+        self.storage_service.add_method(
+            "PUT", "/v1/container", extract_archive_handle)
+        self.storage_service.add_method("POST", "/v1", bulk_delete_handle)
+        self.start_services()
+        cache = ObjectCache(max_bytes=10000)
+        self.client.object_cache = cache
+        self.client.info_cache = InfoCache(ttl=60)
+        container = await self.client.fetch_container("container")
+        uploaded = await container.fetch_object("uploaded")
+        deleted = await container.fetch_object("deleted")
+        for obj in (uploaded, deleted):
+            cache.put(obj.object_url, "e", b"x")
+            self.client.info_cache.put(obj.object_url, {"status": "success"})
+
+        await container.bulk_upload([("uploaded", b"new")])
+        async for result in self.client.bulk_delete(["/container/deleted"]):
+            self.assertEqual("success", result["status"])
+
+        for obj in (uploaded, deleted):
+            self.assertIsNone(cache.get(obj.object_url))
+            self.assertIsNone(self.client.info_cache.get(obj.object_url))
+
+    @gen_test
+    async def test_read_stream_returns_body_in_chunks(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        reader = await obj.read_stream()
+        body = bytearray()
+        for read_chunk in reader:
+            chunk = await read_chunk
+            body.extend(chunk)
+        self.assertEqual(OBJECT_BODY, body)
+
+    @gen_test
+    async def test_read_stream_raises_with_uncomsumed_chunk(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        reader = await obj.read_stream()
+        next(reader)
+        with self.assertRaises(StreamError):
+            next(reader)
+
+    @gen_test
+    async def test_read_stream_raises_with_bad_response(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object2")
+        reader = await obj.read_stream()
+        with self.assertRaises(StreamError):
+            for read_chunk in reader:
+                await read_chunk
+
+    @gen_test
+    async def test_read_verifies_body_against_etag(self):
+        def etag_read_handle(handler):
+            handler.set_header("Etag", hashlib.md5(OBJECT_BODY).hexdigest())
+            object_read_handle(handler)
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", etag_read_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        body = await obj.read(verify=True)
+        self.assertEqual(OBJECT_BODY, body)
+
+    @gen_test
+    async def test_read_raises_when_verification_fails(self):
+        def etag_read_handle(handler):
+            handler.set_header("Etag", hashlib.md5(b"other").hexdigest())
+            object_read_handle(handler)
+
+        self.storage_service.add_method(
+            "GET", "/v1/container/object", etag_read_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        with self.assertRaises(StreamError):
+            await obj.read(verify=True)
+
+    @gen_test
+    async def test_read_stream_verifies_large_object_segments(self):
+        self.add_large_object()
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("large")
+        body = bytearray()
+        reader = await obj.read_stream(verify=True)
+        for read_chunk in reader:
+            body.extend(await read_chunk)
+        self.assertEqual(OBJECT_BODY, body)
+
+    @gen_test
+    async def test_verify_refuses_nested_manifests(self):
+        def nested_manifest_handle(handler):
+            handler.write(json.dumps([{
+                "name": "/segments/sub", "hash": "sub-etag",
+                "bytes": len(OBJECT_BODY), "sub_slo": True}]))
+
+        self.add_large_object()
+        self.storage_service.add_method(
+            "GET", "/v1/container/large", nested_manifest_handle)
+        self.storage_service.add_method(
+            "GET", "/v1/segments/sub", static_manifest_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("large")
+        segments = await obj.fetch_segments()
+        self.assertEqual(len(segment_entries()), len(segments))
+        self.assertTrue(all(segment.nested for segment in segments))
+        with self.assertRaises(StreamError):
+            await obj.read_stream(verify=True)
+
+    @gen_test
+    async def test_verify_requires_whole_object_single_stream(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        with self.assertRaises(ValueError):
+            await obj.read(start=10, verify=True)
+        with self.assertRaises(ValueError):
+            await obj.read(concurrency=2, verify=True)
+
+    @gen_test
+    async def test_list_objects_pages_through_container(self):
+        requests = []
+
+        def listing_handle(handler):
+            requests.append(handler.request.arguments)
+            container_listing_handle(handler)
+
+        self.storage_service.add_method("GET", "/v1/container", listing_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        entries = []
+        async for entry in container.list_objects(page_size=2):
+            entries.append(entry)
+
+        self.assertEqual(LISTING_NAMES, [entry.name for entry in entries])
+        self.assertEqual(3, entries[2].length)
+        self.assertEqual(hashlib.md5(b"b/2").hexdigest(), entries[2].etag)
+        self.assertEqual("text/plain", entries[2].content_type)
+        # three full pages and an empty one to be sure
+        self.assertEqual(4, len(requests))
+        self.assertEqual([b"c"], requests[2]["marker"])
+        self.assertEqual([b"2"], requests[2]["limit"])
+
+    @gen_test
+    async def test_list_objects_prefetches_next_page(self):
+        self.storage_service.add_method(
+            "GET", "/v1/container", container_listing_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        listing = container.list_objects(page_size=2)
+        await listing.__anext__()
+        self.assertIsNotNone(listing.next_page)
+        await listing.next_page
+        self.assertEqual("c", listing.marker)
+
+    @gen_test
+    async def test_list_objects_supports_prefix_delimiter_and_limit(self):
+        self.storage_service.add_method(
+            "GET", "/v1/container", container_listing_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+
+        entries = []
+        async for entry in container.list_objects(delimiter="/"):
+            entries.append((entry.name, entry.subdir))
+        self.assertEqual([
+            ("a", False), ("b/", True), ("c", False), ("d/", True),
+            ("e", False)], entries)
+
+        names = []
+        async for entry in container.list_objects(prefix="b/"):
+            names.append(entry.name)
+        self.assertEqual(["b/1", "b/2"], names)
+
+        names = []
+        async for entry in container.list_objects(limit=3, page_size=2):
+            names.append(entry.name)
+        self.assertEqual(["a", "b/1", "b/2"], names)
+
+    @gen_test
+    async def test_list_objects_raises_with_bad_response(self):
+        self.start_services()
+        container = await self.client.fetch_container("missing")
+        with self.assertRaises(StreamError):
+            async for entry in container.list_objects():
+                pass
+
+    @gen_test
+    async def test_delete_removes_object(self):
+        self.storage_service.add_method(
+            "DELETE", "/v1/container/object", object_delete_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        result = await obj.delete()
+        self.assertEqual({"status": "success"}, result)
+        self.storage_service.assert_requested(
+            "DELETE", "/v1/container/object",
+            headers={"X-Auth-Token": "TOKEN"})
+
+    @gen_test
+    async def test_delete_returns_error_with_bad_response(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("missing")
+        result = await obj.delete()
+        self.assertEqual("error", result["status"])
+        self.assertEqual(404, result["code"])
+
+    @gen_test
+    async def test_bulk_delete_batches_at_cluster_limit(self):
+        batches = []
+
+        def bulk_delete_handle(handler):
+            assert handler.get_argument("bulk-delete") == ""
+            paths = handler.request.body.decode("utf8").split("\n")
+            batches.append(paths)
+            errors = [
+                [path, "409 Conflict"] for path in paths
+                if path.endswith("locked")]
+            handler.write(json.dumps({
+                "Number Deleted": len(paths) - len(errors),
+                "Number Not Found": 0,
+                "Response Status": "400 Bad Request" if errors else "200 OK",
+                "Response Body": "",
+                "Errors": errors
+            }))
+
+        self.storage_service.add_method("GET", "/info", cluster_info_handle)
+        self.storage_service.add_method("POST", "/v1", bulk_delete_handle)
+        self.start_services()
+
+        paths = ["/segments/{0:03d}".format(i) for i in range(7)]
+        paths.append("/segments/with space/locked")
+        results = {}
+        async for result in self.client.bulk_delete(paths, concurrency=2):
+            results[result["path"]] = result
+
+        self.assertEqual(3, len(batches))
+        self.assertEqual(["/segments/000", "/segments/001", "/segments/002"],
+                         batches[0])
+        self.assertEqual("/segments/with%20space/locked", batches[2][-1])
+        self.assertEqual(set(paths), set(results))
+        self.assertEqual("success", results["/segments/006"]["status"])
+        locked = results["/segments/with space/locked"]
+        self.assertEqual("error", locked["status"])
+        self.assertEqual(409, locked["code"])
+
+    @gen_test
+    async def test_bulk_delete_reports_failed_batches(self):
+        def bulk_delete_handle(handler):
+            handler.set_status(401)
+
+        self.storage_service.add_method("POST", "/v1", bulk_delete_handle)
+        self.start_services()
+        results = []
+        async for result in self.client.bulk_delete(["/c/a", "/c/b"]):
+            results.append(result)
+        # the default limit is used without an /info endpoint
+        self.assertEqual(10000, self.client._bulk_delete_limit)
+        self.assertEqual(
+            [401, 401], [result["code"] for result in results])
+
+    @gen_test
+    async def test_bulk_delete_with_no_paths(self):
+        self.storage_service.add_method("GET", "/info", cluster_info_handle)
+        self.start_services()
+        async for result in self.client.bulk_delete([]):
+            self.fail("Unexpected result {0}".format(result))
+
+    @gen_test
+    async def test_bulk_upload_streams_tar_archive(self):
+        extracted = {}
+
+        def extract_archive_handle(handler):
+            self.assertEqual("tar", handler.get_argument("extract-archive"))
+            archive = tarfile.open(
+                fileobj=io.BytesIO(handler.request.body), mode="r:")
+            for member in archive.getmembers():
+                extracted[member.name] = archive.extractfile(member).read()
+            handler.write(json.dumps({
+                "Number Files Created": len(extracted) - 1,
+                "Response Status": "400 Bad Request",
+                "Response Body": "",
+                "Errors": [["/container/b%C3%A4d", "412 Precondition Failed"]]
+            }))
+
+        self.storage_service.add_method(
+            "PUT", "/v1/container", extract_archive_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        path = self.write_file(OBJECT_BODY)
+        long_name = "nested/" + "x" * 200
+        files = iter([
+            ("small", b"CONTENTS"), ("from/file", path),
+            (long_name, bytearray(b"long")), ("b\u00e4d", b"")])
+        results = await container.bulk_upload(files)
+
+        self.assertEqual({
+            "small": b"CONTENTS", "from/file": OBJECT_BODY,
+            long_name: b"long", "b\u00e4d": b""}, extracted)
+        self.assertEqual(
+            ["success", "success", "success", "error"],
+            [result["status"] for result in results])
+        self.assertEqual(412, results[3]["code"])
+        self.assertEqual("b\u00e4d", results[3]["name"])
+        self.storage_service.assert_requested(
+            "PUT", "/v1/container", headers={
+                "X-Auth-Token": "TOKEN", "Content-Type": "application/x-tar"})
+
+    @gen_test
+    async def test_bulk_upload_reports_failed_archive(self):
+        def extract_archive_handle(handler):
+            handler.write(json.dumps({
+                "Number Files Created": 0,
+                "Response Status": "413 Request Entity Too Large",
+                "Response Body": "",
+                "Errors": []
+            }))
+
+        self.storage_service.add_method(
+            "PUT", "/v1/container", extract_archive_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        results = await container.bulk_upload([("a", b"a"), ("b", b"b")])
+        self.assertEqual([413, 413], [result["code"] for result in results])
+
+    @gen_test
+    async def test_bulk_upload_reports_every_file_after_early_failure(self):
+        class RefusingTransport(HTTPTransport):
+
+            def fetch(self, url, body_producer=None, **kwargs):
+                # answered before any of the archive is read
+                future = Future()
+                future.set_result(HTTPResponse(
+                    HTTPRequest(url), 413, buffer=io.BytesIO(b"too big")))
+                return future
+
+        container = StorageContainer(
+            "https://storage.com/v1/container", "container", fetch_token,
+            self.io_loop, transport=RefusingTransport())
+        results = await container.bulk_upload(
+            iter([("a", b"a"), ("b", b"b"), ("c", b"c")]))
+        self.assertEqual(
+            ["a", "b", "c"], [result["name"] for result in results])
+        self.assertEqual([413] * 3, [result["code"] for result in results])
+
+    @gen_test
+    async def test_info_returns_metadata_about_object(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+        info = await obj.info()
+        self.assertEqual("success", info["status"])
+        self.assertEqual({"foo": "foo", "bar": "bar"}, info["metadata"])
+        self.assertEqual("value", info["x-foobar"])
+        self.assertEqual(1024, info["length"])
+        self.assertEqual("text/plain", info["type"])
+        self.assertEqual("md5sum", info["etag"])
+
+    @gen_test
+    async def test_info_many_fetches_objects_concurrently(self):
+        active = []
+        max_active = []
+
+        async def slow_info_handle(handler):
+            active.append(1)
+            max_active.append(len(active))
+            await gen.sleep(0.02)
+            active.pop()
+            object_info_handle(handler)
+
+        self.storage_service.add_method(
+            "HEAD", r"/v1/container/object\d", slow_info_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        names = ["object{0}".format(i) for i in range(8)]
+        results = await container.info_many(names, concurrency=3)
+        self.assertEqual(names, list(results))
+        self.assertEqual(
+            ["success"] * 8, [r["status"] for r in results.values()])
+        self.assertEqual(3, max(max_active))
+
+    @gen_test
+    async def test_info_many_accepts_generators(self):
+        self.storage_service.add_method(
+            "HEAD", r"/v1/container/object\d", object_info_handle)
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        results = await container.info_many(
+            "object{0}".format(i) for i in range(3))
+        self.assertEqual(["object0", "object1", "object2"], list(results))
+        self.assertEqual(
+            ["success"] * 3, [r["status"] for r in results.values()])
+
+    @gen_test
+    async def test_info_results_are_cached_until_upload(self):
+        requests = []
+
+        def counting_info_handle(handler):
+            requests.append(handler.request)
+            object_info_handle(handler)
+
+        self.storage_service.add_method(
+            "HEAD", "/v1/container/object", counting_info_handle)
+        self.start_services()
+        self.client.info_cache = InfoCache(ttl=60)
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object")
+
+        info = await obj.info()
+        info["metadata"]["foo"] = "changed"
+        cached = await obj.info()
+        self.assertEqual("foo", cached["metadata"]["foo"])
+        self.assertEqual(1, len(requests))
+
+        # our own writes invalidate the cached info
+        writer = await obj.upload_stream(mimetype="text/html")
+        await writer.write(b"CONTENTS")
+        await writer.finish()
+        await obj.info()
+        self.assertEqual(2, len(requests))
+
+    @gen_test
+    async def test_info_returns_error_with_bad_response(self):
+        self.start_services()
+        container = await self.client.fetch_container("container")
+        obj = await container.fetch_object("object2")
+        info = await obj.info()
+        self.assertEqual("error", info["status"])
+        self.assertEqual(404, info["code"])
+
+
+class TestInitialSegmentSize(TestCase):
+
+    def test_defaults_without_content_length(self):
+        self.assertEqual(64 * 1024 * 1024, initial_segment_size(0, 4, 1000))
+
+    def test_spreads_content_over_upload_slots(self):
+        gigabyte = 1024 * 1024 * 1024
+        self.assertEqual(
+            gigabyte // 16, initial_segment_size(gigabyte, 4, 1000))
+
+    def test_stays_within_manifest_and_segment_limits(self):
+        terabyte = 1024 ** 4
+        self.assertEqual(
+            -(-terabyte // 1000), initial_segment_size(terabyte, 1000, 1000))
+        self.assertEqual(
+            1024 * 1024, initial_segment_size(1024, 4, 1000))
+        self.assertEqual(
+            5 * 1024 ** 3, initial_segment_size(100 * terabyte, 1, 1000))
+
+
+class TestStreamVerifier(TestCase):
+
+    def segment_etag(self, lengths):
+        etags, offset = "", 0
+        for length in lengths:
+            etags += hashlib.md5(
+                OBJECT_BODY[offset:offset + length]).hexdigest()
+            offset += length
+        return hashlib.md5(etags.encode("ascii")).hexdigest()
+
+    def test_splits_chunks_at_segment_boundaries(self):
+        lengths = [700, 0, 1000, 348, 0]
+        verifier = StreamVerifier("url", lengths)
+        for offset in range(0, len(OBJECT_BODY), 300):
+            verifier.update(OBJECT_BODY[offset:offset + 300])
+        verifier.verify('"{0}"'.format(self.segment_etag(lengths)))
+
+    def test_raises_when_body_is_longer_than_manifest(self):
+        verifier = StreamVerifier("url", [1000])
+        with self.assertRaises(StreamError):
+            verifier.update(OBJECT_BODY)
+
+    def test_raises_when_body_is_shorter_than_manifest(self):
+        verifier = StreamVerifier("url", [1000, 1048])
+        verifier.update(OBJECT_BODY[:1500])
+        with self.assertRaises(StreamError):
+            verifier.verify(self.segment_etag([1000, 1048]))
+
+    def test_raises_without_etag(self):
+        verifier = StreamVerifier("url")
+        verifier.update(OBJECT_BODY)
+        with self.assertRaises(StreamError):
+            verifier.verify(None)
+
+
+def object_write_handle(handler):
+    handler.set_status(201)
+    handler.set_header(
+        "ETag", hashlib.md5(handler.request.body).hexdigest())
+    handler.finish()
+
+
+def object_delete_handle(handler):
+    handler.set_status(204)
+    handler.finish()
+
+
+def cluster_info_handle(handler):
+    handler.write(json.dumps({
+        "swift": {"version": "2.0"},
+        "bulk_delete": {"max_deletes_per_request": 3}
+    }))
+
+
+def object_write_error_handle(handler):
+    handler.set_status(401)
+    handler.write("ERROR")
+
+
+def object_read_handle(handler):
+    handler.set_status(206 if "Range" in handler.request.headers else 200)
+    range_string = handler.request.headers.get("Range", "bytes=0-")
+    range_parts = range_string.split("=")[1].rsplit("-", 1)
+    start, end = range_parts
+    if not end:
+        end = len(OBJECT_BODY) - 1
+    start, end = (int(start), int(end) + 1)
+
+    for i in range(0, end-start, 1024):
+        offset = start + i
+        offset_end = offset + 1024 if end > offset + 1024 else end
+        handler.write(OBJECT_BODY[offset:offset_end])
+        handler.flush()
+
+    handler.finish()
+
+
+def object_info_handle(handler):
+    handler.set_status(200)
+    handler.set_header("X-Object-Meta-Foo", "foo")
+    handler.set_header("X-Object-Meta-Bar", "bar")
+    handler.set_header("Etag", "md5sum")
+    handler.set_header("Content-length", "1024")
+    handler.set_header("Content-type", "text/plain")
+    handler.set_header("X-Foobar", "value")
+    handler.finish()
+
+
+def large_object_info_handle(handler, manifest_type):
+    handler.set_status(200)
+    if manifest_type == "static":
+        handler.set_header("X-Static-Large-Object", "True")
+    else:
+        handler.set_header("X-Object-Manifest", "segments/large/")
+    handler.set_header("Etag", "manifest")
+    handler.set_header("Content-length", str(len(OBJECT_BODY)))
+    handler.set_header("Content-type", "text/plain")
+    handler.finish()
+
+
+def segment_entries():
+    return [{
+        "name": "large/{0:03d}".format(index),
+        "hash": hashlib.md5(
+            OBJECT_BODY[offset:offset + 512]).hexdigest(),
+        "bytes": 512
+    } for index, offset in enumerate(range(0, len(OBJECT_BODY), 512))]
+
+
+def static_manifest_handle(handler):
+    if handler.get_argument("multipart-manifest", None) != "get":
+        # the assembled object, with swift's etag of the segment etags
+        etags = "".join(entry["hash"] for entry in segment_entries())
+        handler.set_header("Etag", '"{0}"'.format(
+            hashlib.md5(etags.encode("ascii")).hexdigest()))
+        handler.write(OBJECT_BODY)
+        return
+    manifest = []
+    for entry in segment_entries():
+        entry["name"] = "/segments/" + entry["name"]
+        manifest.append(entry)
+    handler.write(json.dumps(manifest))
+
+
+def dynamic_listing_handle(handler):
+    assert handler.get_argument("prefix") == "large/"
+    marker = handler.get_argument("marker", "")
+    limit = int(handler.get_argument("limit"))
+    entries = [
+        entry for entry in segment_entries() if entry["name"] > marker]
+    handler.write(json.dumps(entries[:limit]))
+
+
+LISTING_NAMES = ["a", "b/1", "b/2", "c", "d/1", "e"]
+
+
+def container_listing_handle(handler):
+    prefix = handler.get_argument("prefix", "")
+    delimiter = handler.get_argument("delimiter", None)
+    marker = handler.get_argument("marker", "")
+    limit = int(handler.get_argument("limit"))
+    listing = []
+    for name in LISTING_NAMES:
+        if not name.startswith(prefix):
+            continue
+        if delimiter and delimiter in name[len(prefix):]:
+            subdir = name[:name.index(delimiter, len(prefix)) + 1]
+            if subdir > marker and listing[-1:] != [{"subdir": subdir}]:
+                listing.append({"subdir": subdir})
+            continue
+        if name > marker:
+            listing.append({
+                "name": name, "bytes": len(name), "content_type": "text/plain",
+                "hash": hashlib.md5(name.encode("utf8")).hexdigest(),
+                "last_modified": "2016-01-01T00:00:00.000000"})
+    handler.write(json.dumps(listing[:limit]))
+
+
+def segment_read_handle(handler):
+    index = int(handler.request.path.rsplit("/", 1)[1])
+    handler.write(OBJECT_BODY[index * 512:(index + 1) * 512])
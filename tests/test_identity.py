@@ -1,13 +1,19 @@
+import copy
 import datetime
 import json
 import time
 
 from unittest import mock
+from tornado import gen
 from tornado.testing import AsyncTestCase, gen_test
 from testnado.service_case_helpers import ServiceCaseHelpers
 
+from tornadorax import identity_client
+from tornadorax import utilities
 from tornadorax.services import service_registry
 from tornadorax.identity_client import IdentityClient, NoServiceCatalog
+from tornadorax.retry_policy import RetryPolicy
+from tornadorax.transport import HTTPTransport
 from tests.helpers.foo_service import FooService
 from tests.samples import identity_samples
 
@@ -98,6 +104,43 @@ class TestIdentity(ServiceCaseHelpers, AsyncTestCase):
         self.assertEqual("TOKEN", result["token"])
         self.assertEqual(4, len(identity_requests))
 
+    @gen_test
+    async def test_authorize_retries_through_transport_retry_policy(self):
+        responses = [(503, ""), (503, ""), (503, ""), (201, self.auth_data)]
+        identity_requests = []
+
+        def id_handle(handler):
+            status, body = responses.pop(0)
+            identity_requests.append(time.time())
+            handler.set_status(status)
+            handler.write(body)
+
+        self.identity_service.add_method("POST", "/v2.0/tokens", id_handle)
+        self.start_services()
+        policy = RetryPolicy(max_retries=2)
+        client = IdentityClient(
+            self.identity_service.base_url, self.credentials, self.io_loop,
+            transport=HTTPTransport(retry_policy=policy))
+
+        with mock.patch("tornadorax.utilities.generate_backoff") as mocked:
+            mocked.return_value = 0.01
+            result = await client.authorize()
+
+        # the policy's limit applies, rather than another retry loop
+        self.assertEqual("error", result["status"])
+        self.assertEqual(503, result["code"])
+        self.assertEqual(3, len(identity_requests))
+
+    def test_client_is_an_alias_for_transport(self):
+        transport = HTTPTransport()
+        client = IdentityClient(
+            self.identity_service.base_url, self.credentials, self.io_loop,
+            transport=transport)
+        self.assertIs(transport, client.transport)
+        self.assertIs(transport, client.client)
+        self.assertIsInstance(self.client.transport, HTTPTransport)
+        self.assertIs(self.client.transport, self.client.client)
+
     @gen_test
     async def test_build_service_returns_properly_configured_instance(self):
         self.start_services()
@@ -174,3 +217,272 @@ class TestIdentity(ServiceCaseHelpers, AsyncTestCase):
         result = await self.client.fetch_token()
         self.assertEqual("TOKEN", result)
         self.assertEqual(1, len(self.identity_requests))
+
+    @gen_test
+    async def test_fetch_token_shares_a_single_authorization(self):
+        self.start_services()
+        results = await gen.multi([
+            self.client.fetch_token() for i in range(10)])
+        self.assertEqual(["TOKEN"] * 10, results)
+        self.assertEqual(1, len(self.identity_requests))
+
+    @gen_test
+    async def test_fetch_token_shares_authorization_failure(self):
+        calls = []
+
+        async def authorize():
+            calls.append(1)
+            await gen.sleep(0.01)
+            raise utilities.MaxRetriesExceeded("Attempted operation 1 times.")
+
+        self.client.authorize = authorize
+        futures = [
+            gen.convert_yielded(self.client.fetch_token()) for i in range(5)]
+        for future in futures:
+            with self.assertRaises(utilities.MaxRetriesExceeded):
+                await future
+
+        self.assertEqual(1, len(calls))
+
+    @gen_test
+    async def test_fetch_token_authorizes_again_after_shared_failure(self):
+        self.start_services()
+        self.client.authorize = mock.Mock(
+            side_effect=[ValueError("boom"), self.client.authorize()])
+        with self.assertRaises(ValueError):
+            await self.client.fetch_token()
+        result = await self.client.fetch_token()
+        self.assertEqual("TOKEN", result)
+
+    @gen_test
+    async def test_authorize_does_not_schedule_renewal_by_default(self):
+        self.start_services()
+        await self.client.authorize()
+        self.assertIsNone(self.client._renewal)
+
+    @mock.patch("tornadorax.identity_client.MIN_RENEWAL_DELAY", 0)
+    @gen_test
+    async def test_renewal_replaces_token_before_expiration(self):
+        expiration = datetime.datetime.utcfromtimestamp(time.time() + 65)
+        self.auth_data = copy.deepcopy(identity_samples.KEYSTONE_RESPONSE)
+        self.auth_data["access"]["token"] = {
+            "id": "TOKEN", "expires": expiration.strftime("%Y-%m-%dT%H:%M:%SZ")
+        }
+        client = IdentityClient(
+            self.identity_service.base_url, self.credentials, self.io_loop,
+            renew_before=64.9)
+        self.addCleanup(client.cancel_renewal)
+        self.start_services()
+
+        await client.authorize()
+        self.assertIsNotNone(client._renewal)
+
+        self.auth_data = copy.deepcopy(identity_samples.KEYSTONE_RESPONSE)
+        self.auth_data["access"]["token"] = {
+            "id": "TOKEN2",
+            "expires": identity_samples.FUTURE_EXPIRATION.strftime(
+                "%Y-%m-%dT%H:%M:%SZ")
+        }
+
+        # the old token is still served until the renewal lands
+        self.assertEqual("TOKEN", await client.fetch_token())
+        await gen.sleep(0.5)
+        self.identity_requests = []
+        self.assertEqual("TOKEN2", await client.fetch_token())
+        self.assertEqual(0, len(self.identity_requests))
+
+    @gen_test
+    async def test_renewal_waits_at_least_minimum_delay(self):
+        # renew_before is longer than the token's whole lifetime
+        client = IdentityClient(
+            self.identity_service.base_url, self.credentials, self.io_loop,
+            renew_before=10 ** 9)
+        self.addCleanup(client.cancel_renewal)
+        self.start_services()
+
+        with mock.patch.object(self.io_loop, "call_later") as mocked:
+            await client.authorize()
+
+        mocked.assert_called_once_with(
+            identity_client.MIN_RENEWAL_DELAY, client._renew)
+
+    @gen_test
+    async def test_renewal_keeps_token_and_retries_after_failure(self):
+        client = IdentityClient(
+            self.identity_service.base_url, self.credentials, self.io_loop,
+            renew_before=60)
+        self.addCleanup(client.cancel_renewal)
+        self.start_services()
+        await client.authorize()
+
+        def id_handle(handler):
+            handler.set_status(401)
+
+        self.identity_service.add_method("POST", "/v2.0/tokens", id_handle)
+        client.cancel_renewal()
+
+        with mock.patch.object(client, "schedule_renewal") as mocked:
+            client._renew()
+            await client.shared_authorize()
+            await gen.sleep(0)
+
+        mocked.assert_called_once_with(identity_client.RENEWAL_RETRY_INTERVAL)
+        self.assertEqual("TOKEN", await client.fetch_token())
+
+    @gen_test
+    async def test_authorize_stores_token_in_cache(self):
+        cache = mock.Mock()
+        client = IdentityClient(
+            self.identity_service.base_url, self.credentials, self.io_loop,
+            token_cache=cache)
+        self.start_services()
+        await client.authorize()
+        identity_url, credentials, entry = cache.store.call_args[0]
+        self.assertEqual(self.identity_service.base_url, identity_url)
+        self.assertEqual(self.credentials, credentials)
+        self.assertEqual("TOKEN", entry["token"])
+        self.assertEqual(
+            self.auth_data["access"]["serviceCatalog"],
+            entry["service_catalog"])
+
+    @gen_test
+    async def test_cached_authorization_builds_services_without_identity(self):
+        cache = mock.Mock()
+        cache.load.return_value = {
+            "token": "CACHED",
+            "expires": identity_samples.FUTURE_EXPIRATION.strftime(
+                "%Y-%m-%dT%H:%M:%SZ"),
+            "default_region": "ORD",
+            "service_catalog": self.auth_data["access"]["serviceCatalog"]
+        }
+        client = IdentityClient(
+            self.identity_service.base_url, self.credentials, self.io_loop,
+            token_cache=cache)
+        self.start_services()
+
+        self.assertTrue(client.load_cached_authorization())
+        service = client.build_service("foo:service")
+        service.assert_service_url_equals("https://ord.public.com/v1")
+        await service.assert_token_equals("CACHED")
+        self.assertEqual(0, len(self.identity_requests))
+
+    @gen_test
+    async def test_fetch_token_ignores_cached_token_near_expiration(self):
+        expiration = datetime.datetime.utcfromtimestamp(time.time() + 30)
+        cache = mock.Mock()
+        cache.load.return_value = {
+            "token": "CACHED",
+            "expires": expiration.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "default_region": None,
+            "service_catalog": []
+        }
+        client = IdentityClient(
+            self.identity_service.base_url, self.credentials, self.io_loop,
+            token_cache=cache)
+        self.start_services()
+
+        self.assertEqual("TOKEN", await client.fetch_token())
+        self.assertEqual(1, len(self.identity_requests))
+        self.assertEqual(1, cache.store.call_count)
+
+    @gen_test
+    async def test_build_service_reuses_instances(self):
+        self.start_services()
+        await self.client.authorize()
+        service = self.client.build_service("foo:service")
+        self.assertIs(service, self.client.build_service("foo:service"))
+        self.assertIsNot(
+            service, self.client.build_service("foo:service", region="ORD"))
+
+        # the same catalog from a new authorization keeps the instances
+        await self.client.authorize()
+        self.assertIs(service, self.client.build_service("foo:service"))
+
+    @gen_test
+    async def test_build_service_rebuilds_instances_with_new_catalog(self):
+        self.start_services()
+        await self.client.authorize()
+        service = self.client.build_service("foo:service")
+
+        self.auth_data = copy.deepcopy(identity_samples.KEYSTONE_RESPONSE)
+        catalog = self.auth_data["access"]["serviceCatalog"]
+        catalog[0]["endpoints"][0]["publicURL"] = "https://dfw2.public.com/v1"
+        await self.client.authorize()
+
+        new_service = self.client.build_service("foo:service")
+        self.assertIsNot(service, new_service)
+        new_service.assert_service_url_equals("https://dfw2.public.com/v1")
+
+    @gen_test
+    async def test_build_fastest_service_uses_best_ranked_endpoint(self):
+        self.start_services()
+        await self.client.authorize()
+
+        async def rank(candidates):
+            self.assertEqual(4, len(candidates))
+            return [(0.01, ("ORD", True, "https://ord.internal.com/v1"))]
+
+        self.client.endpoint_selector.rank = mock.Mock(side_effect=rank)
+        service = await self.client.build_fastest_service("foo:service")
+        service.assert_service_url_equals("https://ord.internal.com/v1")
+        self.assertIs(
+            service, await self.client.build_fastest_service("foo:service"))
+        self.assertEqual(1, self.client.endpoint_selector.rank.call_count)
+
+    @gen_test
+    async def test_build_fastest_service_probes_again_with_new_catalog(self):
+        self.start_services()
+        await self.client.authorize()
+
+        async def rank(candidates):
+            return [(0.01, ("ORD", True, "https://ord.internal.com/v1"))]
+
+        self.client.endpoint_selector.rank = mock.Mock(side_effect=rank)
+        await self.client.build_fastest_service("foo:service")
+
+        self.auth_data = copy.deepcopy(identity_samples.KEYSTONE_RESPONSE)
+        catalog = self.auth_data["access"]["serviceCatalog"]
+        catalog[0]["endpoints"][0]["publicURL"] = "https://dfw2.public.com/v1"
+        await self.client.authorize()
+        self.assertEqual({}, self.client.preferred_endpoints)
+
+        await self.client.build_fastest_service("foo:service")
+        self.assertEqual(2, self.client.endpoint_selector.rank.call_count)
+
+    @gen_test
+    async def test_build_fastest_service_falls_back_without_endpoints(self):
+        self.start_services()
+        await self.client.authorize()
+
+        async def rank(candidates):
+            return []
+
+        self.client.endpoint_selector.rank = rank
+        service = await self.client.build_fastest_service("foo:service")
+        service.assert_service_url_equals("https://dfw.public.com/v1")
+
+    @gen_test
+    async def test_endpoint_selection_reevaluates_periodically(self):
+        self.start_services()
+        await self.client.authorize()
+        rankings = [
+            [(0.01, ("ORD", False, "https://ord.public.com/v1"))],
+            [(0.01, ("DFW", False, "https://dfw.public.com/v1"))]
+        ]
+
+        async def rank(candidates):
+            return rankings.pop(0) if len(rankings) > 1 else rankings[0]
+
+        self.client.endpoint_selector.rank = rank
+        service = await self.client.build_fastest_service(
+            "foo:service", internal=False)
+        service.assert_service_url_equals("https://ord.public.com/v1")
+
+        self.client.start_endpoint_selection(
+            ["foo:service"], interval=0.05, internal=False)
+        self.addCleanup(self.client.stop_endpoint_selection)
+        await gen.sleep(0.1)
+
+        service = await self.client.build_fastest_service(
+            "foo:service", internal=False)
+        service.assert_service_url_equals("https://dfw.public.com/v1")
@@ -0,0 +1,91 @@
+from tornado.testing import AsyncTestCase, gen_test
+from testnado.service_case_helpers import ServiceCaseHelpers
+
+from tornadorax.instrumentation import RequestListener
+from tornadorax.transport import HTTPTransport
+
+
+class RecordingListener(RequestListener):
+
+    def __init__(self):
+        self.events = []
+
+    def request_finished(self, event):
+        self.events.append(event)
+
+
+class TestInstrumentation(ServiceCaseHelpers, AsyncTestCase):
+
+    def setUp(self):
+        super(TestInstrumentation, self).setUp()
+
+        def handle(handler):
+            handler.write(b"x" * 100)
+
+        def handle_put(handler):
+            handler.set_status(201)
+            handler.finish()
+
+        self.service = self.add_service()
+        self.service.add_method("GET", "/v1/resource", handle)
+        self.service.add_method("PUT", "/v1/resource", handle_put)
+        self.transport = HTTPTransport()
+        self.listener = RecordingListener()
+        self.transport.add_listener(self.listener)
+
+    @gen_test
+    async def test_listener_receives_labeled_event(self):
+        self.start_services()
+        await self.transport.fetch(
+            self.service.url("/v1/resource"), service="foo:service",
+            operation="fetch_resource", url_template="/resource")
+        event = self.listener.events[0]
+        self.assertEqual("foo:service", event.service)
+        self.assertEqual("fetch_resource", event.operation)
+        self.assertEqual("/resource", event.url_template)
+        self.assertEqual("GET", event.method)
+        self.assertEqual(200, event.status)
+        self.assertEqual(100, event.bytes_received)
+        self.assertEqual(0, event.bytes_sent)
+        self.assertTrue(event.total_time > 0)
+
+    @gen_test
+    async def test_listener_counts_streamed_bytes(self):
+        self.start_services()
+        chunks = []
+
+        async def body_producer(write):
+            await write(b"abc")
+            await write(b"defg")
+
+        await self.transport.fetch(
+            self.service.url("/v1/resource"), method="PUT",
+            body_producer=body_producer)
+        await self.transport.fetch(
+            self.service.url("/v1/resource"), streaming_callback=chunks.append)
+
+        put_event, get_event = self.listener.events
+        self.assertEqual(7, put_event.bytes_sent)
+        self.assertEqual(201, put_event.status)
+        self.assertEqual(100, get_event.bytes_received)
+        self.assertEqual(b"x" * 100, b"".join(chunks))
+
+    @gen_test
+    async def test_listener_receives_failed_requests(self):
+        self.start_services()
+        with self.assertRaises(Exception):
+            await self.transport.fetch("http://127.0.0.1:1/v1/resource")
+        event = self.listener.events[0]
+        self.assertEqual(599, event.status)
+        self.assertIsNotNone(event.error)
+
+    @gen_test
+    async def test_broken_listener_does_not_break_requests(self):
+        self.start_services()
+        broken = RecordingListener()
+        broken.request_finished = lambda event: 1 / 0
+        self.transport.add_listener(broken)
+        response = await self.transport.fetch(self.service.url("/v1/resource"))
+        self.assertEqual(200, response.code)
+        self.assertEqual(1, len(self.listener.events))
+        self.transport.remove_listener(broken)
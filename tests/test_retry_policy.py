@@ -0,0 +1,168 @@
+from unittest import mock
+
+from tornado import gen
+from tornado.httpclient import HTTPClientError
+from tornado.testing import AsyncTestCase, gen_test
+from testnado.service_case_helpers import ServiceCaseHelpers
+
+from tornadorax import retry_policy
+from tornadorax.transport import HTTPTransport
+
+
+URL = "https://storage.foo.com/v1/container/object"
+
+
+class FakeResponse(object):
+
+    def __init__(self, code):
+        self.code = code
+
+
+def make_fetch(*codes):
+    codes = list(codes)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        code = codes.pop(0)
+        if isinstance(code, Exception):
+            raise code
+        return FakeResponse(code)
+
+    fetch.calls = calls
+    return fetch
+
+
+@mock.patch("tornadorax.utilities.generate_backoff", lambda *a, **k: 0.01)
+class TestRetryPolicy(AsyncTestCase):
+
+    @gen_test
+    async def test_fetch_retries_idempotent_failures(self):
+        policy = retry_policy.RetryPolicy()
+        fetch = make_fetch(503, IOError("reset"), 200)
+        response = await policy.fetch(fetch, URL, method="GET")
+        self.assertEqual(200, response.code)
+        self.assertEqual(3, len(fetch.calls))
+
+    @gen_test
+    async def test_fetch_does_not_retry_non_idempotent_methods(self):
+        policy = retry_policy.RetryPolicy()
+        fetch = make_fetch(503, 200)
+        response = await policy.fetch(fetch, URL, method="POST")
+        self.assertEqual(503, response.code)
+        self.assertEqual(1, len(fetch.calls))
+
+    @gen_test
+    async def test_fetch_allows_idempotency_override(self):
+        policy = retry_policy.RetryPolicy()
+        fetch = make_fetch(503, 201)
+        response = await policy.fetch(fetch, URL, method="POST", retry=True)
+        self.assertEqual(201, response.code)
+
+    @gen_test
+    async def test_fetch_does_not_retry_client_errors(self):
+        policy = retry_policy.RetryPolicy()
+        fetch = make_fetch(HTTPClientError(404), 200)
+        with self.assertRaises(HTTPClientError):
+            await policy.fetch(fetch, URL)
+        self.assertEqual(1, len(fetch.calls))
+
+    @gen_test
+    async def test_fetch_stops_at_max_retries(self):
+        policy = retry_policy.RetryPolicy(max_retries=2)
+        fetch = make_fetch(500, 500, 500, 200)
+        response = await policy.fetch(fetch, URL)
+        self.assertEqual(500, response.code)
+        self.assertEqual(3, len(fetch.calls))
+
+    @gen_test
+    async def test_fetch_respects_retry_budget(self):
+        budget = retry_policy.RetryBudget(ratio=0, minimum=1)
+        policy = retry_policy.RetryPolicy(budget=budget)
+        fetch = make_fetch(500, 500, 500, 200)
+        response = await policy.fetch(fetch, URL)
+        self.assertEqual(500, response.code)
+        self.assertEqual(2, len(fetch.calls))
+
+    @gen_test
+    async def test_fetch_fails_fast_with_open_circuit(self):
+        breaker = retry_policy.CircuitBreaker(failure_threshold=2)
+        policy = retry_policy.RetryPolicy(max_retries=0, breaker=breaker)
+        fetch = make_fetch(500, 500, 200)
+        await policy.fetch(fetch, URL)
+        await policy.fetch(fetch, URL)
+        with self.assertRaises(retry_policy.CircuitOpenError):
+            await policy.fetch(fetch, URL)
+        self.assertEqual(2, len(fetch.calls))
+        # other endpoints are unaffected
+        other = make_fetch(200)
+        await policy.fetch(other, "https://other.foo.com/v1")
+
+    @gen_test
+    async def test_cancel_aborts_pending_retries(self):
+        policy = retry_policy.RetryPolicy()
+        fetch = make_fetch(500, 200)
+        with mock.patch(
+                "tornadorax.utilities.generate_backoff", lambda *a, **k: 10):
+            future = gen.convert_yielded(policy.fetch(fetch, URL))
+            await gen.sleep(0.01)
+            policy.cancel()
+            with self.assertRaises(retry_policy.RetryCancelled):
+                await future
+        self.assertEqual(1, len(fetch.calls))
+
+
+class TestCircuitBreaker(AsyncTestCase):
+
+    def test_half_open_allows_a_single_trial(self):
+        breaker = retry_policy.CircuitBreaker(
+            failure_threshold=1, reset_timeout=0)
+        breaker.record_failure("foo.com")
+        breaker.before_request("foo.com")
+        with self.assertRaises(retry_policy.CircuitOpenError):
+            breaker.before_request("foo.com")
+        breaker.record_success("foo.com")
+        self.assertEqual(retry_policy.CLOSED, breaker.state("foo.com"))
+
+    def test_failed_trial_reopens_circuit(self):
+        breaker = retry_policy.CircuitBreaker(
+            failure_threshold=3, reset_timeout=30)
+        breaker.states["foo.com"] = retry_policy.HALF_OPEN
+        breaker.record_failure("foo.com")
+        self.assertEqual(retry_policy.OPEN, breaker.state("foo.com"))
+
+
+class TestTransportRetries(ServiceCaseHelpers, AsyncTestCase):
+
+    def setUp(self):
+        super(TestTransportRetries, self).setUp()
+        self.codes = [503, 200]
+        self.requests = []
+
+        def handle(handler):
+            self.requests.append(handler.request)
+            handler.set_status(self.codes.pop(0))
+            handler.finish()
+
+        self.service = self.add_service()
+        self.service.add_method("GET", "/v1/resource", handle)
+        self.transport = HTTPTransport(
+            retry_policy=retry_policy.RetryPolicy())
+
+    @mock.patch("tornadorax.utilities.generate_backoff", lambda *a, **k: 0)
+    @gen_test
+    async def test_transport_retries_with_policy(self):
+        self.start_services()
+        response = await self.transport.fetch(
+            self.service.url("/v1/resource"), raise_error=False)
+        self.assertEqual(200, response.code)
+        self.assertEqual(2, len(self.requests))
+
+    @gen_test
+    async def test_transport_does_not_retry_streamed_requests(self):
+        self.start_services()
+        response = await self.transport.fetch(
+            self.service.url("/v1/resource"), raise_error=False,
+            streaming_callback=lambda chunk: None)
+        self.assertEqual(503, response.code)
+        self.assertEqual(1, len(self.requests))
@@ -0,0 +1,54 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tornadorax import token_cache
+
+
+CREDENTIALS = {
+    "passwordCredentials": {"username": "user", "password": "password"}
+}
+
+
+class TestFileTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.directory))
+        self.path = os.path.join(self.directory, "tokens.json")
+        self.cache = token_cache.FileTokenCache(self.path)
+
+    def test_load_returns_none_without_file(self):
+        self.assertEqual(None, self.cache.load("http://id", CREDENTIALS))
+
+    def test_store_and_load_entry(self):
+        self.cache.store("http://id", CREDENTIALS, {"token": "TOKEN"})
+        other_cache = token_cache.FileTokenCache(self.path)
+        self.assertEqual(
+            {"token": "TOKEN"}, other_cache.load("http://id", CREDENTIALS))
+
+    def test_entries_are_keyed_by_url_and_credentials(self):
+        self.cache.store("http://id", CREDENTIALS, {"token": "TOKEN"})
+        self.cache.store("http://id2", CREDENTIALS, {"token": "TOKEN2"})
+        self.assertEqual(None, self.cache.load("http://id", {"other": {}}))
+        self.assertEqual(
+            {"token": "TOKEN2"}, self.cache.load("http://id2", CREDENTIALS))
+        self.assertEqual(
+            {"token": "TOKEN"}, self.cache.load("http://id", CREDENTIALS))
+
+    def test_credentials_are_not_written_to_disk(self):
+        self.cache.store("http://id", CREDENTIALS, {"token": "TOKEN"})
+        with open(self.path) as fp:
+            contents = fp.read()
+        self.assertNotIn("password", contents)
+        self.assertEqual(0o600, os.stat(self.path).st_mode & 0o777)
+
+    def test_corrupt_cache_is_ignored(self):
+        with open(self.path, "w") as fp:
+            fp.write("{not json")
+        self.assertEqual(None, self.cache.load("http://id", CREDENTIALS))
+        self.cache.store("http://id", CREDENTIALS, {"token": "TOKEN"})
+        with open(self.path) as fp:
+            self.assertEqual(1, len(json.load(fp)))
@@ -0,0 +1,66 @@
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+from tornado.simple_httpclient import SimpleAsyncHTTPClient
+from tornado.testing import AsyncTestCase, gen_test
+from testnado.service_case_helpers import ServiceCaseHelpers
+
+from tornadorax.transport import HTTPTransport
+
+
+class TestHTTPTransport(ServiceCaseHelpers, AsyncTestCase):
+
+    def setUp(self):
+        super(TestHTTPTransport, self).setUp()
+        self.active = []
+        self.max_active = []
+
+        async def handle(handler):
+            self.active.append(handler.request)
+            self.max_active.append(len(self.active))
+            await gen.sleep(0.05)
+            self.active.remove(handler.request)
+            handler.write(handler.request.headers.get("Connection", ""))
+
+        self.service = self.add_service()
+        self.service.add_method("GET", "/v1/resource", handle)
+
+    def test_default_transport_uses_shared_client(self):
+        transport = HTTPTransport()
+        self.assertIs(AsyncHTTPClient(), transport.client)
+        transport.close()
+        # closing the transport must not close the shared client
+        self.assertFalse(AsyncHTTPClient()._closed)
+
+    def test_configured_transport_uses_private_client(self):
+        transport = HTTPTransport(
+            max_clients=50, connect_timeout=3, request_timeout=300)
+        self.addCleanup(transport.close)
+        self.assertIsNot(AsyncHTTPClient(), transport.client)
+        self.assertIsInstance(transport.client, SimpleAsyncHTTPClient)
+        self.assertEqual(50, transport.client.max_clients)
+        self.assertEqual(3, transport.client.defaults["connect_timeout"])
+        self.assertEqual(300, transport.client.defaults["request_timeout"])
+
+    def test_transport_accepts_implementation_class(self):
+        transport = HTTPTransport(implementation=SimpleAsyncHTTPClient)
+        self.addCleanup(transport.close)
+        self.assertIsInstance(transport.client, SimpleAsyncHTTPClient)
+        self.assertIsNot(AsyncHTTPClient(), transport.client)
+
+    @gen_test
+    async def test_fetch_limits_requests_per_host(self):
+        self.start_services()
+        transport = HTTPTransport(max_clients=10, max_clients_per_host=2)
+        self.addCleanup(transport.close)
+        url = self.service.url("/v1/resource")
+        responses = await gen.multi([transport.fetch(url) for i in range(6)])
+        self.assertEqual([200] * 6, [r.code for r in responses])
+        self.assertEqual(2, max(self.max_active))
+
+    @gen_test
+    async def test_fetch_closes_connections_without_keep_alive(self):
+        self.start_services()
+        transport = HTTPTransport(keep_alive=False)
+        response = await transport.fetch(
+            self.service.url("/v1/resource"), headers={"X-Foo": "bar"})
+        self.assertEqual(b"close", response.body)
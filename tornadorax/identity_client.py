@@ -1,29 +1,60 @@
+import asyncio
 import calendar
 import json
 import logging
 import time
 
 import dateutil.parser
-from tornado.httpclient import AsyncHTTPClient
+from tornado import gen
+from tornado.ioloop import PeriodicCallback
 
 from tornadorax.services import service_registry
+from tornadorax.services.endpoint_selector import EndpointSelector
+from tornadorax.transport import HTTPTransport
 from tornadorax import utilities
 
 
 LOGGER = logging.getLogger("rax:identity")
 
+# how long to wait before retrying a failed background renewal
+RENEWAL_RETRY_INTERVAL = 30
+# the soonest a renewal is scheduled after authorizing, so a renew_before
+# longer than the token's lifetime can't re-authorize in a tight loop
+MIN_RENEWAL_DELAY = 30
+
 
 class IdentityClient(object):
 
-    def __init__(self, identity_url, credentials, ioloop):
+    def __init__(
+            self, identity_url, credentials, ioloop, renew_before=None,
+            token_cache=None, transport=None):
         self.identity_url = identity_url
         self.credentials = credentials
-        self.client = AsyncHTTPClient()
+        # handed to every service built from this client when provided
+        self.service_transport = transport
+        self.transport = transport or HTTPTransport()
+        self.endpoint_selector = EndpointSelector(transport=self.transport)
+        self.preferred_endpoints = {}
+        self._endpoint_selection = None
         self.ioloop = ioloop
         self.service_catalog = None
+        self.catalog_index = None
+        self._services = {}
         self.token = None
         self._token_expires = 0
         self.default_region = None
+        self._authorization = None
+        # seconds before expiration to re-authorize in the background.
+        # should be comfortably larger than the 60 second skew window
+        # fetch_token uses, otherwise callers will still wait on identity.
+        self.renew_before = renew_before
+        self._renewal = None
+        self.token_cache = token_cache
+
+    @property
+    def client(self):
+        # the name used before transports, kept for compatibility
+        return self.transport
 
     @property
     def token_expires(self):
@@ -31,16 +62,9 @@ class IdentityClient(object):
 
     @token_expires.setter
     def token_expires(self, expiration_string):
-        self._token_expires = calendar.timegm(
-            dateutil.parser.parse(expiration_string).utctimetuple())
+        self._token_expires = parse_expiration(expiration_string)
 
     async def fetch_token(self):
-        # FIXME: If the identity service actually goes down for any
-        # measurable length of time, these operations and retries may
-        # start stacking and hammering the external service far more
-        # than desired. Better result would make everyone wait on a
-        # single authorization, and everyone gets success / failure
-
         # giving a minute of buffer for slight clock skew
         if self.token_expires < time.time() + 60:
             self.token = None
@@ -48,28 +72,57 @@ class IdentityClient(object):
         if self.token:
             return self.token
 
-        result = await self.authorize()
+        # shielded so one impatient (cancelled) caller doesn't cancel the
+        # authorization everyone else is waiting on
+        result = await asyncio.shield(self.shared_authorize())
         return result["token"]
 
+    def shared_authorize(self):
+        # everyone waiting on a token shares a single in-flight
+        # authorization (and its success / failure), so an expired token
+        # or an identity outage doesn't turn into a request per caller.
+        if self._authorization is None:
+            self._authorization = gen.convert_yielded(
+                self._authorize_once())
+        return self._authorization
+
+    async def _authorize_once(self):
+        try:
+            # another process may have already done the work for us
+            if self.load_cached_authorization():
+                return {"status": "success", "token": self.token}
+            return await self.authorize()
+        finally:
+            self._authorization = None
+
     async def authorize(self):
         full_url = self.identity_url + "/v2.0/tokens"
         body = json.dumps({"auth": self.credentials})
         headers = {"Content-type": "application/json"}
 
-        with utilities.gen_retry(self.ioloop) as wait:
-            while True:
-                response = await self.client.fetch(
-                    full_url, method="POST", body=body, headers=headers,
-                    raise_error=False)
+        def request_token(retry=None):
+            return self.transport.fetch(
+                full_url, method="POST", body=body, headers=headers,
+                raise_error=False, retry=retry, service="identity",
+                operation="authorize", url_template="/v2.0/tokens")
+
+        if self.transport.retry_policy is not None:
+            # the transport's policy retries it (within its budget and
+            # circuit breaker), since asking for a token is safe to repeat
+            response = await request_token(retry=True)
+        else:
+            with utilities.gen_retry(self.ioloop) as wait:
+                while True:
+                    response = await request_token()
 
-                if response.code not in range(500, 600):
-                    # an invalid request error or success
-                    break
+                    if response.code not in range(500, 600):
+                        # an invalid request error or success
+                        break
 
-                LOGGER.warning(
-                    "Retrying identity request ({0})".format(response.code))
+                    LOGGER.warning("Retrying identity request ({0})".format(
+                        response.code))
 
-                await wait()
+                    await wait()
 
         if response.code > 299:
             return {
@@ -78,24 +131,173 @@ class IdentityClient(object):
                 "body": response.body
             }
 
-        auth_response = json.loads(response.body.decode("utf8"))
-        self.token = auth_response["access"]["token"]["id"]
-        # this will need to be augmented for other openstack providers
-        self.default_region = auth_response["access"].get("user", {}).get(
-            "RAX-AUTH:defaultRegion", None)
-        self.token_expires = auth_response["access"]["token"]["expires"]
-        self.service_catalog = auth_response["access"]["serviceCatalog"]
+        access = json.loads(response.body.decode("utf8"))["access"]
+        self.update_authorization(
+            token=access["token"]["id"],
+            expires=access["token"]["expires"],
+            # this will need to be augmented for other openstack providers
+            default_region=access.get("user", {}).get(
+                "RAX-AUTH:defaultRegion", None),
+            service_catalog=access["serviceCatalog"])
+
+        if self.token_cache:
+            self.token_cache.store(self.identity_url, self.credentials, {
+                "token": self.token,
+                "expires": access["token"]["expires"],
+                "default_region": self.default_region,
+                "service_catalog": self.service_catalog
+            })
+
         return {"status": "success", "token": self.token}
 
+    def load_cached_authorization(self):
+        # returns True if a cached token was loaded, so a fresh process
+        # can build_service() without ever calling authorize().
+        if not self.token_cache:
+            return False
+
+        entry = self.token_cache.load(self.identity_url, self.credentials)
+        if not entry:
+            return False
+
+        # don't bother with an entry we'd refresh right away anyway
+        expires = parse_expiration(entry["expires"])
+        if expires < time.time() + max(60, self.renew_before or 0):
+            return False
+
+        LOGGER.debug("Using cached token for {0}".format(self.identity_url))
+        self.update_authorization(
+            token=entry["token"], expires=entry["expires"],
+            default_region=entry["default_region"],
+            service_catalog=entry["service_catalog"])
+        return True
+
+    def update_authorization(
+            self, token, expires, default_region, service_catalog):
+        # everything is swapped in without yielding, so no caller can see
+        # a new token alongside an old catalog (or vice versa).
+        self.token_expires = expires
+        self.token = token
+        self.default_region = default_region
+        if service_catalog != self.service_catalog:
+            self.service_catalog = service_catalog
+            self.catalog_index = service_registry.ServiceCatalog(
+                service_catalog)
+            self._services = {}
+            # ranked against the old catalog's endpoints, so re-probe
+            self.preferred_endpoints = {}
+        self.schedule_renewal()
+
+    def schedule_renewal(self, delay=None):
+        if self.renew_before is None:
+            return
+        self.cancel_renewal()
+        if delay is None:
+            delay = max(
+                self.token_expires - self.renew_before - time.time(),
+                MIN_RENEWAL_DELAY)
+        LOGGER.debug("Renewing token in {0} seconds".format(delay))
+        self._renewal = self.ioloop.call_later(delay, self._renew)
+
+    def cancel_renewal(self):
+        if self._renewal is not None:
+            self.ioloop.remove_timeout(self._renewal)
+            self._renewal = None
+
+    def _renew(self):
+        # the current token keeps being served while this is in flight,
+        # and a successful authorization schedules the next renewal.
+        self._renewal = None
+        self.shared_authorize().add_done_callback(self._renewal_finished)
+
+    def _renewal_finished(self, future):
+        if future.exception() is None and \
+                future.result()["status"] == "success":
+            return
+        LOGGER.warning("Background token renewal failed, retrying.")
+        if self._renewal is None:
+            self.schedule_renewal(RENEWAL_RETRY_INTERVAL)
+
     def build_service(self, service_type, region=None, internal=False):
         if not self.service_catalog:
             raise NoServiceCatalog(
                 "No service catalog has been associated with this "
                 "identity client. Try yielding authorize() first.")
         region = region or self.default_region
-        return service_registry.build_service(
-            service_type, self.service_catalog, ioloop=self.ioloop,
-            fetch_token=self.fetch_token, region=region, internal=internal)
+        # services only hold the catalog URL and a token callback, so one
+        # instance per key is reused until a different catalog arrives.
+        key = (service_type, region, internal)
+        if key not in self._services:
+            self._services[key] = service_registry.build_service(
+                service_type, self.catalog_index, ioloop=self.ioloop,
+                fetch_token=self.fetch_token, region=region,
+                internal=internal, transport=self.service_transport)
+        return self._services[key]
+
+    async def select_endpoint(self, service_type, internal=None):
+        # probes every candidate endpoint for the service and remembers
+        # the fastest reachable one. internal=None lets ServiceNet and
+        # public URLs compete, so unreachable internal URLs are skipped.
+        if not self.service_catalog:
+            raise NoServiceCatalog(
+                "No service catalog has been associated with this "
+                "identity client. Try yielding authorize() first.")
+
+        candidates = self.catalog_index.candidates(service_type, internal)
+        ranked = await self.endpoint_selector.rank(candidates)
+        if not ranked:
+            LOGGER.warning("No reachable endpoints for {0}".format(
+                service_type))
+            return None
+
+        latency, (region, is_internal, url) = ranked[0]
+        LOGGER.debug("Selected {0} for {1} ({2:.3f}s)".format(
+            url, service_type, latency))
+        self.preferred_endpoints[(service_type, internal)] = (
+            region, is_internal)
+        return region, is_internal
+
+    async def build_fastest_service(self, service_type, internal=None):
+        # only probes the first time, after that it's the memoized service
+        # for whichever endpoint was last measured as fastest.
+        key = (service_type, internal)
+        if key not in self.preferred_endpoints:
+            await self.select_endpoint(service_type, internal=internal)
+
+        if key not in self.preferred_endpoints:
+            # nothing answered, so fall back to the usual choice
+            return self.build_service(service_type, internal=bool(internal))
+
+        region, is_internal = self.preferred_endpoints[key]
+        return self.build_service(
+            service_type, region=region, internal=is_internal)
+
+    def start_endpoint_selection(self, service_types, interval, internal=None):
+        # periodically re-ranks endpoints, so build_fastest_service follows
+        # changes in network conditions. interval is in seconds.
+        self.stop_endpoint_selection()
+
+        async def reevaluate():
+            for service_type in service_types:
+                try:
+                    await self.select_endpoint(service_type, internal)
+                except Exception:
+                    LOGGER.exception("Failed to rank endpoints for {0}".format(
+                        service_type))
+
+        self._endpoint_selection = PeriodicCallback(
+            reevaluate, interval * 1000)
+        self._endpoint_selection.start()
+
+    def stop_endpoint_selection(self):
+        if self._endpoint_selection is not None:
+            self._endpoint_selection.stop()
+            self._endpoint_selection = None
+
+
+def parse_expiration(expiration_string):
+    return calendar.timegm(
+        dateutil.parser.parse(expiration_string).utctimetuple())
 
 
 class NoServiceCatalog(Exception):
@@ -0,0 +1,98 @@
+import logging
+
+
+LOGGER = logging.getLogger("rax:instrumentation")
+
+
+class RequestEvent(object):
+    # one per HTTP attempt (so retries show up separately). the timing
+    # phases come from tornado's time_info, which only the curl client
+    # fills in, so queue / connect / ttfb may be None with the simple one.
+
+    __slots__ = (
+        "service", "operation", "url_template", "method", "url", "status",
+        "bytes_sent", "bytes_received", "queue_time", "connect_time",
+        "ttfb", "total_time", "error")
+
+    def __init__(self, service, operation, url_template, method, url):
+        self.service = service
+        self.operation = operation
+        self.url_template = url_template
+        self.method = method
+        self.url = url
+        self.status = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.queue_time = None
+        self.connect_time = None
+        self.ttfb = None
+        self.total_time = None
+        self.error = None
+
+    def record_response(self, response):
+        self.status = response.code
+        self.total_time = response.request_time
+        time_info = response.time_info or {}
+        self.queue_time = time_info.get("queue")
+        self.connect_time = time_info.get("connect")
+        self.ttfb = time_info.get("starttransfer")
+
+
+class RequestListener(object):
+    # subclass (or duck type) this and add it to an HTTPTransport.
+    # called on the IOLoop, so listeners should hand off anything slow.
+
+    def request_finished(self, event):
+        pass
+
+
+def instrument(listeners, fetch_function, url, labels, kwargs):
+    # wraps a single fetch attempt so every listener gets an event with
+    # byte counts and timings once it completes (or fails).
+    event = RequestEvent(
+        service=labels.get("service"), operation=labels.get("operation"),
+        url_template=labels.get("url_template"),
+        method=kwargs.get("method", "GET"), url=url)
+
+    body = kwargs.get("body")
+    if body:
+        event.bytes_sent = len(body)
+
+    body_producer = kwargs.get("body_producer")
+    if body_producer is not None:
+        def counting_producer(write):
+            def counting_write(chunk):
+                event.bytes_sent += len(chunk)
+                return write(chunk)
+            return body_producer(counting_write)
+        kwargs["body_producer"] = counting_producer
+
+    streaming_callback = kwargs.get("streaming_callback")
+    if streaming_callback is not None:
+        def counting_callback(chunk):
+            event.bytes_received += len(chunk)
+            return streaming_callback(chunk)
+        kwargs["streaming_callback"] = counting_callback
+
+    def finished(future):
+        if future.exception() is not None:
+            event.error = future.exception()
+            event.status = getattr(event.error, "code", 599)
+            response = getattr(event.error, "response", None)
+        else:
+            response = future.result()
+
+        if response is not None:
+            event.record_response(response)
+            if streaming_callback is None and response.body:
+                event.bytes_received = len(response.body)
+
+        for listener in listeners:
+            try:
+                listener.request_finished(event)
+            except Exception:
+                LOGGER.exception("Request listener failed.")
+
+    future = fetch_function(url, kwargs)
+    future.add_done_callback(finished)
+    return future
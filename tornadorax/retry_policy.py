@@ -0,0 +1,201 @@
+import collections
+import datetime
+import logging
+import time
+
+try:
+    import urlparse
+except ImportError:
+    import urllib.parse as urlparse
+
+from tornado import gen
+from tornado import locks
+from tornado.httpclient import HTTPClientError
+
+from tornadorax import utilities
+
+
+LOGGER = logging.getLogger("rax:retries")
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+RETRY_CODES = (500, 502, 503, 504, 599)
+
+
+class RetryPolicy(object):
+    # decides whether a failed request may be retried, and how long to
+    # wait. shared by everything using a transport, so the budget and
+    # circuit breaker see the library's traffic as a whole.
+
+    def __init__(
+            self, max_retries=3, max_wait=10, retry_codes=RETRY_CODES,
+            idempotent_methods=IDEMPOTENT_METHODS, budget=None,
+            breaker=None):
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self.retry_codes = retry_codes
+        self.idempotent_methods = idempotent_methods
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self._cancelled = locks.Event()
+
+    def is_idempotent(self, method):
+        return method.upper() in self.idempotent_methods
+
+    def is_failure(self, response=None, error=None):
+        if isinstance(error, HTTPClientError):
+            # raised instead of returned when raise_error is set
+            return error.code in self.retry_codes
+        if error is not None:
+            # connection problems and timeouts, but not programming errors
+            return isinstance(error, (IOError, gen.TimeoutError))
+        return response.code in self.retry_codes
+
+    def cancel(self):
+        # aborts pending retry waits, and stops retrying until reset()
+        self._cancelled.set()
+
+    def reset(self):
+        self._cancelled.clear()
+
+    async def fetch(self, fetch_function, url, method="GET", retry=None):
+        # fetch_function makes a single attempt. retry=None falls back to
+        # the method's idempotency, and True / False overrides it for
+        # operations that know better (e.g. a POST that is safe to repeat).
+        endpoint = urlparse.urlparse(url).netloc
+        retry = self.is_idempotent(method) if retry is None else retry
+        attempt = 0
+
+        while True:
+            self.breaker.before_request(endpoint)
+            self.budget.record_request()
+
+            response = error = None
+            try:
+                response = await fetch_function()
+            except Exception as exception:
+                error = exception
+
+            failed = self.is_failure(response, error)
+            if failed:
+                self.breaker.record_failure(endpoint)
+            else:
+                self.breaker.record_success(endpoint)
+
+            if not failed or not self._can_retry(retry, attempt):
+                if error is not None:
+                    raise error
+                return response
+
+            LOGGER.warning("Retrying {0} {1} ({2})".format(
+                method, url, error or response.code))
+            await self._wait(attempt)
+            attempt += 1
+
+    def _can_retry(self, retry, attempt):
+        if not retry or attempt >= self.max_retries:
+            return False
+        if self._cancelled.is_set():
+            return False
+        return self.budget.withdraw()
+
+    async def _wait(self, attempt):
+        delay = utilities.generate_backoff(attempt, max_wait=self.max_wait)
+        try:
+            await gen.with_timeout(
+                datetime.timedelta(seconds=delay), self._cancelled.wait())
+        except gen.TimeoutError:
+            return
+        raise RetryCancelled("Retries were cancelled.")
+
+
+class RetryBudget(object):
+    # caps retries to a ratio of recent requests (plus a small floor for
+    # low traffic), so an outage can't multiply the load on a backend.
+
+    def __init__(self, ratio=0.2, minimum=10, window=10):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+        self.requests = collections.deque()
+        self.retries = collections.deque()
+
+    def _expire(self, now):
+        cutoff = now - self.window
+        for timestamps in (self.requests, self.retries):
+            while timestamps and timestamps[0] < cutoff:
+                timestamps.popleft()
+
+    def record_request(self):
+        now = time.monotonic()
+        self._expire(now)
+        self.requests.append(now)
+
+    def withdraw(self):
+        now = time.monotonic()
+        self._expire(now)
+        allowed = self.minimum + self.ratio * len(self.requests)
+        if len(self.retries) >= allowed:
+            LOGGER.warning("Retry budget exhausted.")
+            return False
+        self.retries.append(now)
+        return True
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker(object):
+    # tracked per endpoint (host:port). after failure_threshold failures
+    # in a row requests fail fast for reset_timeout seconds, then a single
+    # trial request decides whether the endpoint is healthy again.
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = collections.defaultdict(int)
+        self.states = {}
+        self.opened_at = {}
+
+    def state(self, endpoint):
+        state = self.states.get(endpoint, CLOSED)
+        if state == OPEN and \
+                time.monotonic() - self.opened_at[endpoint] \
+                >= self.reset_timeout:
+            return HALF_OPEN
+        return state
+
+    def before_request(self, endpoint):
+        state = self.state(endpoint)
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN and self.states[endpoint] == OPEN:
+            # let exactly one trial request through
+            self.states[endpoint] = HALF_OPEN
+            return
+        raise CircuitOpenError(
+            "Endpoint {0} is failing, not sending requests.".format(
+                endpoint))
+
+    def record_success(self, endpoint):
+        self.failures.pop(endpoint, None)
+        self.states.pop(endpoint, None)
+        self.opened_at.pop(endpoint, None)
+
+    def record_failure(self, endpoint):
+        self.failures[endpoint] += 1
+        if self.states.get(endpoint) == HALF_OPEN or \
+                self.failures[endpoint] >= self.failure_threshold:
+            if self.states.get(endpoint) != OPEN:
+                LOGGER.warning("Opening circuit for {0}".format(endpoint))
+            self.states[endpoint] = OPEN
+            self.opened_at[endpoint] = time.monotonic()
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class RetryCancelled(Exception):
+    pass
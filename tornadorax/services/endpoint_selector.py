@@ -0,0 +1,49 @@
+import logging
+import time
+
+from tornado import gen
+
+from tornadorax.transport import HTTPTransport
+
+
+LOGGER = logging.getLogger("rax:endpoints")
+
+
+class EndpointSelector(object):
+    # ranks catalog endpoints by how quickly they answer a cheap request
+    # from wherever we're running. any HTTP response (even a 401) counts
+    # as reachable, since we only care about the round trip.
+
+    def __init__(self, transport=None, method="HEAD", timeout=5):
+        self.transport = transport or HTTPTransport()
+        self.method = method
+        self.timeout = timeout
+
+    async def probe(self, url):
+        start = time.monotonic()
+        try:
+            response = await self.transport.fetch(
+                url, method=self.method, raise_error=False, retry=False,
+                connect_timeout=self.timeout, request_timeout=self.timeout,
+                operation="probe_endpoint")
+        except Exception as exception:
+            LOGGER.debug("Endpoint {0} unreachable: {1}".format(
+                url, exception))
+            return None
+        if response.code == 599:
+            LOGGER.debug("Endpoint {0} unreachable".format(url))
+            return None
+        return time.monotonic() - start
+
+    async def rank(self, candidates):
+        # candidates are (region, internal, url) from ServiceCatalog, and
+        # unreachable ones (e.g. ServiceNet from outside) are dropped.
+        latencies = await gen.multi([
+            self.probe(candidate[2]) for candidate in candidates])
+        ranked = [
+            (latency, candidate)
+            for latency, candidate in zip(latencies, candidates)
+            if latency is not None
+        ]
+        ranked.sort(key=lambda pair: pair[0])
+        return ranked
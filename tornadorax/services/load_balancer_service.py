@@ -1,24 +1,31 @@
 import json
 
 from tornado import gen
-from tornado.httpclient import AsyncHTTPClient
 from tornadorax import errors
+from tornadorax.transport import HTTPTransport
 
 
 class LoadBalancerService(object):
 
-    def __init__(self, service_url, fetch_token, ioloop):
+    def __init__(self, service_url, fetch_token, ioloop, transport=None):
         self.service_url = service_url
         self.fetch_token = fetch_token
         self.ioloop = ioloop
-        self.client = AsyncHTTPClient()
+        self.transport = transport or HTTPTransport()
+
+    @property
+    def client(self):
+        # the name used before transports, kept for compatibility
+        return self.transport
 
     @gen.coroutine
     def fetch_load_balancers(self):
         url = "{0}/loadbalancers".format(self.service_url)
         token = yield self.fetch_token()
-        response = yield self.client.fetch(
-            url, headers={"X-Auth-Token": token}, raise_error=False)
+        response = yield self.transport.fetch(
+            url, headers={"X-Auth-Token": token}, raise_error=False,
+            service="rax:load-balancer", operation="fetch_load_balancers",
+            url_template="/loadbalancers")
         errors.check_service_response(response, "loadbalancers")
         body = json.loads(response.body.decode("utf8"))
         load_balancers = []
@@ -31,8 +38,10 @@ class LoadBalancerService(object):
     def fetch_load_balancer(self, lb_id):
         url = "{0}/loadbalancers/{1}".format(self.service_url, lb_id)
         token = yield self.fetch_token()
-        response = yield self.client.fetch(
-            url, headers={"X-Auth-Token": token}, raise_error=False)
+        response = yield self.transport.fetch(
+            url, headers={"X-Auth-Token": token}, raise_error=False,
+            service="rax:load-balancer", operation="fetch_load_balancer",
+            url_template="/loadbalancers/{lb_id}")
         errors.check_service_response(response, "loadbalancers")
         body = json.loads(response.body.decode("utf8"))
         lb_config = body["loadBalancer"]
@@ -43,9 +52,11 @@ class LoadBalancerService(object):
     def delete_load_balancer(self, lb_id):
         url = "{0}/loadbalancers/{1}".format(self.service_url, lb_id)
         token = yield self.fetch_token()
-        response = yield self.client.fetch(
+        response = yield self.transport.fetch(
             url, method="DELETE", headers={"X-Auth-Token": token},
-            raise_error=False)
+            raise_error=False, service="rax:load-balancer",
+            operation="delete_load_balancer",
+            url_template="/loadbalancers/{lb_id}")
         errors.check_service_response(response, "loadbalancers")
 
     @gen.coroutine
@@ -61,8 +72,10 @@ class LoadBalancerService(object):
             }
         })
         headers = {"X-Auth-Token": token, "Content-type": "application/json"}
-        response = yield self.client.fetch(
-            url, method="POST", headers=headers, body=body, raise_error=False)
+        response = yield self.transport.fetch(
+            url, method="POST", headers=headers, body=body, raise_error=False,
+            service="rax:load-balancer", operation="create_load_balancer",
+            url_template="/loadbalancers")
         errors.check_service_response(response, "loadbalancers")
         lb_config = json.loads(response.body.decode("utf8"))["loadBalancer"]
         lb = LoadBalancer.from_config(lb_config)
@@ -0,0 +1,187 @@
+import collections
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from tornado import gen
+
+
+LOGGER = logging.getLogger("rax:object-cache")
+
+
+class CacheEntry(object):
+
+    __slots__ = ("etag", "length", "body", "path")
+
+    def __init__(self, etag, length, body=None, path=None):
+        self.etag = etag
+        self.length = length
+        self.body = body
+        self.path = path
+
+
+class ObjectCache(object):
+    # an LRU of object bodies keyed by URL, capped at max_bytes. bodies
+    # live in memory, or in files under directory (with only the index in
+    # memory) when one is given. entries are revalidated by the caller
+    # with their ETag, so this never decides on its own that one is stale.
+    # each process (e.g. pre-forked workers) writes to its own directory,
+    # since the index only knows about its own files. directories left by
+    # processes that have exited are removed when a process starts using
+    # the cache, and close() removes the current process's.
+
+    def __init__(self, max_bytes, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self._fetches = {}
+        self._pid = None
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def load(self, entry):
+        # None if the entry's file has gone, which counts as a miss
+        if entry.body is not None:
+            return entry.body
+        try:
+            with open(entry.path, "rb") as fp:
+                return fp.read()
+        except FileNotFoundError:
+            LOGGER.warning("Cached file {0} is missing.".format(entry.path))
+            for key, cached in list(self.entries.items()):
+                if cached is entry:
+                    self.invalidate(key)
+            return None
+
+    def process_directory(self):
+        pid = os.getpid()
+        directory = os.path.join(self.directory, str(pid))
+        if self._pid != pid:
+            self._pid = pid
+            os.makedirs(directory, exist_ok=True)
+            self._remove_stale_directories()
+        return directory
+
+    def _remove_stale_directories(self):
+        for name in os.listdir(self.directory):
+            if name.isdigit() and not process_running(int(name)):
+                LOGGER.debug("Removing stale cache directory {0}".format(
+                    name))
+                shutil.rmtree(
+                    os.path.join(self.directory, name), ignore_errors=True)
+
+    def close(self):
+        # forgets every entry, along with this process's files
+        for key in list(self.entries):
+            self.invalidate(key)
+        if self.directory is not None and self._pid == os.getpid():
+            shutil.rmtree(
+                os.path.join(self.directory, str(self._pid)),
+                ignore_errors=True)
+            self._pid = None
+
+    def put(self, key, etag, body):
+        self.invalidate(key)
+        if len(body) > self.max_bytes:
+            return
+
+        entry = CacheEntry(etag, len(body))
+        if self.directory is None:
+            entry.body = bytes(body)
+        else:
+            entry.path = self._write(key, body)
+
+        self.entries[key] = entry
+        self.size += entry.length
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self._discard(evicted)
+
+    def invalidate(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self._discard(entry)
+
+    async def fetch(self, key, fetch_function):
+        # fetch_function(entry) gets the current entry (or None) and
+        # returns the body. concurrent calls for the same key share one.
+        if key not in self._fetches:
+            self._fetches[key] = gen.convert_yielded(
+                self._fetch_once(key, fetch_function))
+        return await self._fetches[key]
+
+    async def _fetch_once(self, key, fetch_function):
+        try:
+            return await fetch_function(self.get(key))
+        finally:
+            del self._fetches[key]
+
+    def _write(self, key, body):
+        directory = self.process_directory()
+        name = hashlib.sha1(key.encode("utf8")).hexdigest()
+        path = os.path.join(directory, name)
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(body)
+            os.replace(temp_path, path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+        return path
+
+    def _discard(self, entry):
+        self.size -= entry.length
+        if entry.path is not None:
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+class InfoCache(object):
+    # parsed info() results keyed by URL, each trusted for ttl seconds.
+    # the oldest entries are dropped beyond max_entries.
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        cached = self.entries.get(key)
+        if cached is None:
+            return None
+        expires, info = cached
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+        return info
+
+    def put(self, key, info):
+        self.entries.pop(key, None)
+        self.entries[key] = (time.monotonic() + self.ttl, info)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+
+def process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # it exists, it just isn't ours
+        return True
+    return True
@@ -7,7 +7,7 @@ try:
 except ImportError:
     import urllib.parse as urlparse
 
-from tornado.httpclient import AsyncHTTPClient
+from tornadorax.transport import HTTPTransport
 
 
 LOGGER = logging.getLogger("rax:queues")
@@ -15,32 +15,41 @@ LOGGER = logging.getLogger("rax:queues")
 
 class QueueService(object):
 
-    def __init__(self, service_url, fetch_token, ioloop):
+    def __init__(self, service_url, fetch_token, ioloop, transport=None):
         self.service_url = service_url
         self.fetch_token = fetch_token
         self.ioloop = ioloop
+        self.transport = transport or HTTPTransport()
 
     async def fetch_queue(self, queue_name):
         # TODO: check it exists, create it, or something. this
         # is pretty simple now.
         return Queue(
-            self.service_url, queue_name, self.fetch_token, self.ioloop)
+            self.service_url, queue_name, self.fetch_token, self.ioloop,
+            transport=self.transport)
 
 
 class Queue(object):
 
-    def __init__(self, service_url, queue_name, fetch_token, ioloop):
+    def __init__(
+            self, service_url, queue_name, fetch_token, ioloop,
+            transport=None):
         parsed_uri = urlparse.urlparse(service_url)
         self.ioloop = ioloop
         self.service_url = service_url
         self.protocol = parsed_uri.scheme
         self.fetch_token = fetch_token
         self.queue = queue_name
-        self.client = AsyncHTTPClient()
+        self.transport = transport or HTTPTransport()
         self.receive_client_id = uuid.uuid4().hex
         self.send_client_id = uuid.uuid4().hex
         self.next_url = None
 
+    @property
+    def client(self):
+        # the name used before transports, kept for compatibility
+        return self.transport
+
     async def fetch_messages(self):
         token = await self.fetch_token()
 
@@ -48,11 +57,13 @@ class Queue(object):
             self.next_url = "{}/queues/{}/messages".format(
                 self.service_url, self.queue)
 
-        response = await self.client.fetch(
+        response = await self.transport.fetch(
             self.next_url, headers={
                 "X-Auth-Token": token,
                 "Client-Id": self.receive_client_id
-            }, raise_error=False)
+            }, raise_error=False, service="rax:queues",
+            operation="fetch_messages",
+            url_template="/queues/{queue}/messages")
 
         if response.code > 399:
             return {
@@ -82,10 +93,12 @@ class Queue(object):
         messages_url = "{}/queues/{}/messages".format(
             self.service_url, self.queue)
         body = json.dumps([{"ttl": ttl, "body": message}])
-        response = await self.client.fetch(
+        response = await self.transport.fetch(
             messages_url, method="POST", body=body, headers={
                 "X-Auth-Token": token,
-                "Client-Id": self.send_client_id}, raise_error=False)
+                "Client-Id": self.send_client_id}, raise_error=False,
+            service="rax:queues", operation="push_message",
+            url_template="/queues/{queue}/messages")
 
         if response.code != 201:
             LOGGER.error(
@@ -16,38 +16,80 @@ register_service("rax:load-balancer", LoadBalancerService)
 register_service("object-store", StorageService)
 
 
+class ServiceCatalog(object):
+    # indexes the raw identity catalog once, so each lookup is a single
+    # dictionary hit on (service type, region, interface).
+
+    def __init__(self, service_catalog):
+        self.endpoints = {}
+        self.default_regions = {}
+
+        # some of this could be left to an internal service classmethod
+        # if it turns out these structures deviate widely across providers
+        # and services
+        for service in service_catalog:
+            service_type = service["type"]
+            for endpoint in service["endpoints"]:
+                self.default_regions.setdefault(
+                    service_type, endpoint["region"])
+                for url_key in ("publicURL", "internalURL"):
+                    # a missing interface is an unknown region for lookup()
+                    if not endpoint.get(url_key):
+                        continue
+                    key = (service_type, endpoint["region"], url_key)
+                    self.endpoints[key] = endpoint[url_key]
+
+    def lookup(self, service_type, region=None, internal=False):
+        if service_type not in self.default_regions:
+            raise InvalidServiceType(
+                "Server catalog does not contain service type {0}".format(
+                    service_type))
+
+        url_key = "internalURL" if internal else "publicURL"
+        region_key = region or self.default_regions[service_type]
+        key = (service_type, region_key, url_key)
+
+        if key not in self.endpoints:
+            raise InvalidRegion(
+                "Unknown region {0} for service {1}".format(
+                    region_key, service_type))
+
+        return self.endpoints[key]
+
+    def candidates(self, service_type, internal=None):
+        # every (region, internal, url) for a service type, optionally
+        # limited to one interface, for callers choosing between them.
+        if internal is None:
+            url_keys = ("publicURL", "internalURL")
+        else:
+            url_keys = ("internalURL",) if internal else ("publicURL",)
+
+        return [
+            (region, url_key == "internalURL", url)
+            for (s_type, region, url_key), url in self.endpoints.items()
+            if s_type == service_type and url_key in url_keys
+        ]
+
+
 def build_service(
         service_type, service_catalog, fetch_token, ioloop, region=None,
-        internal=False):
+        internal=False, transport=None):
 
     if service_type not in SERVICES:
         raise InvalidServiceType(
             "Unregistered service type {0}".format(service_type))
 
-    services = dict([(s["type"], s) for s in service_catalog])
-
-    if service_type not in services:
-        raise InvalidServiceType(
-            "Server catalog does not contain service type {0}".format(
-                service_type))
-
-    # some of this could be left to an internal service classmethod
-    # if it turns out these structures deviate widely across providers
-    # and services
-
-    endpoints = services[service_type]["endpoints"]
-    url_key = "internalURL" if internal else "publicURL"
-    regions = dict([(e["region"], e) for e in endpoints])
-    region_keys = [e["region"] for e in endpoints]
-    region_key = region or region_keys[0]
-
-    if region_key not in regions:
-        raise InvalidRegion(
-            "Unknown region {0} for service {1}".format(
-                region_key, service_type))
-
-    service_url = regions[region_key][url_key]
-    return SERVICES[service_type](service_url, fetch_token, ioloop)
+    if not isinstance(service_catalog, ServiceCatalog):
+        service_catalog = ServiceCatalog(service_catalog)
+
+    service_url = service_catalog.lookup(
+        service_type, region=region, internal=internal)
+    # only passed along when provided, so services registered before
+    # transports existed keep working
+    kwargs = {}
+    if transport is not None:
+        kwargs["transport"] = transport
+    return SERVICES[service_type](service_url, fetch_token, ioloop, **kwargs)
 
 
 class InvalidRegion(Exception):
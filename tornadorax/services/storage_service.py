@@ -1,7 +1,15 @@
+import collections
 import json
 import logging
 import hashlib
 import hmac
+import inspect
+import mimetypes
+import mmap
+import os
+import tarfile
+import tempfile
+import time
 
 try:
     from urllib import urlencode
@@ -13,63 +21,212 @@ try:
 except ImportError:
     import urllib.parse as urlparse
 
+from tornado import gen
+from tornado import httputil
+from tornado import locks
+from tornado import queues
 from tornado.concurrent import Future
-from tornado.httpclient import AsyncHTTPClient
+from tornado.httpclient import HTTPClientError
+
+from tornadorax import utilities
+from tornadorax.transport import HTTPTransport
 
 
 CHUNK_SIZE = 64 * 1024
+# writes at least this big are hashed off the IOLoop, while being sent
+EXECUTOR_HASH_SIZE = 1024 * 1024
+# byte range size for parallel reads
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+# attempts per byte range before a parallel read gives up
+PART_RETRIES = 3
+# most bytes a windowed reader holds at once
+DEFAULT_WINDOW_SIZE = 1024 * 1024
+# 1GB default segment size
+DEFAULT_SEGMENT_SIZE = 1024 * 1024 * 1024
+# bytes queued for each segment in flight, waiting to be sent
+DEFAULT_SEGMENT_BUFFER = 4 * CHUNK_SIZE
+# bytes of a segment kept in memory for retries, before going to disk
+DEFAULT_SPOOL_SIZE = 16 * 1024 * 1024
+# attempts at writing a manifest
+MANIFEST_RETRIES = 3
+# swift's default limit on the segments in one static manifest
+MAX_MANIFEST_SEGMENTS = 1000
+# adaptive segment sizes stay within swift's limits for static segments
+MIN_SEGMENT_SIZE = 1024 * 1024
+MAX_SEGMENT_SIZE = 5 * 1024 * 1024 * 1024
+# starting size when the content length isn't known
+DEFAULT_ADAPTIVE_SEGMENT_SIZE = 64 * 1024 * 1024
+# long enough that per-request overhead doesn't matter, short enough
+# that a retry doesn't cost much
+TARGET_SEGMENT_SECONDS = 30
+# segments per upload slot, so slots don't sit idle near the end
+SEGMENTS_PER_SLOT = 4
 # sentinel value
 READ_DONE = dict()
 
 
 LOGGER = logging.getLogger("rax:storage")
 
+# labels for transport listeners
+SERVICE_LABEL = "object-store"
+OBJECT_TEMPLATE = "/{container}/{object}"
+CONTAINER_TEMPLATE = "/{container}"
+
+# the most objects swift returns in one listing
+DEFAULT_PAGE_SIZE = 10000
+# used when the cluster doesn't publish its bulk delete limit
+DEFAULT_BULK_DELETE_LIMIT = 10000
+
 
 class StorageService(object):
 
-    def __init__(self, service_url, fetch_token, ioloop):
+    def __init__(
+            self, service_url, fetch_token, ioloop, transport=None,
+            object_cache=None, info_cache=None):
         self.service_url = service_url
         self.fetch_token = fetch_token
         self.ioloop = ioloop
+        self.transport = transport or HTTPTransport()
+        # optional ObjectCache / InfoCache shared by every object here
+        self.object_cache = object_cache
+        self.info_cache = info_cache
+        self._bulk_delete_limit = None
 
     async def fetch_container(self, container_name):
         LOGGER.debug("Fetching container {0}".format(container_name))
         container_url = "{0}/{1}".format(self.service_url, container_name)
         container = StorageContainer(
             container_url, container_name, self.fetch_token,
-            ioloop=self.ioloop)
+            ioloop=self.ioloop, transport=self.transport,
+            object_cache=self.object_cache, info_cache=self.info_cache)
         return container
 
+    def bulk_delete(self, paths, concurrency=2):
+        # paths are "/container/object". returns an async iterator of
+        # per-path result dictionaries, in the order batches complete.
+        return BulkDelete(self, paths, concurrency=concurrency)
+
+    async def fetch_bulk_delete_limit(self):
+        # swift publishes its capabilities at /info on the same host
+        if self._bulk_delete_limit is not None:
+            return self._bulk_delete_limit
+
+        parsed = urlparse.urlparse(self.service_url)
+        info_url = "{0}://{1}/info".format(parsed.scheme, parsed.netloc)
+        response = await self.transport.fetch(
+            info_url, raise_error=False, service=SERVICE_LABEL,
+            operation="capabilities", url_template="/info")
+
+        limit = DEFAULT_BULK_DELETE_LIMIT
+        if response.code == 200:
+            try:
+                capabilities = json.loads(response.body.decode("utf8"))
+                limit = int(capabilities["bulk_delete"][
+                    "max_deletes_per_request"])
+            except (ValueError, KeyError, TypeError):
+                pass
+        self._bulk_delete_limit = limit
+        return limit
+
 
 class StorageContainer(object):
 
-    def __init__(self, container_url, name, fetch_token, ioloop):
+    def __init__(
+            self, container_url, name, fetch_token, ioloop, transport=None,
+            object_cache=None, info_cache=None):
         self.name = name
         self.container_url = container_url
         self.fetch_token = fetch_token
         self.ioloop = ioloop
+        self.transport = transport or HTTPTransport()
+        self.object_cache = object_cache
+        self.info_cache = info_cache
 
     async def fetch_object(self, object_name, tempurl_key=None):
         LOGGER.debug("Fetching object {0}".format(object_name))
         object_url = "{0}/{1}".format(self.container_url, object_name)
         storage_object = StorageObject(
             object_url, self.name, object_name, self.fetch_token, self.ioloop,
-            tempurl_key=tempurl_key)
+            tempurl_key=tempurl_key, transport=self.transport,
+            object_cache=self.object_cache, info_cache=self.info_cache)
         return storage_object
 
+    async def info_many(self, object_names, concurrency=10):
+        # HEADs many objects at once (at most concurrency in flight) and
+        # returns a dictionary of name -> info() result.
+        # names can be any iterable, and are needed twice
+        object_names = list(object_names)
+        semaphore = locks.Semaphore(concurrency)
+
+        async def fetch_info(object_name):
+            async with semaphore:
+                storage_object = await self.fetch_object(object_name)
+                return await storage_object.info()
+
+        results = await gen.multi([
+            fetch_info(object_name) for object_name in object_names])
+        return dict(zip(object_names, results))
+
+    async def bulk_upload(self, files):
+        # files are (object_name, data) pairs, where data is bytes or the
+        # path of a local file. they're streamed to swift as one tar archive
+        # (built on the fly, never on disk) and extracted into this
+        # container. returns a result dictionary for each file, in order.
+        # every file gets a result, even if the request fails early.
+        files = list(files)
+        names = [name for name, _ in files]
+        token = await self.fetch_token()
+
+        async def body_producer(write):
+            for name, data in files:
+                await write_tar_member(write, name, data)
+            # two empty blocks end the archive
+            await write(b"\0" * (2 * tarfile.BLOCKSIZE))
+
+        response = await self.transport.fetch(
+            self.container_url + "?extract-archive=tar", method="PUT",
+            body_producer=body_producer, raise_error=False, headers={
+                "X-Auth-Token": token,
+                "Content-Type": "application/x-tar",
+                "Accept": "application/json"
+            }, service=SERVICE_LABEL, operation="bulk_upload",
+            url_template=CONTAINER_TEMPLATE)
+        for name in names:
+            invalidate_caches(
+                "{0}/{1}".format(self.container_url, name),
+                self.object_cache, self.info_cache)
+        return parse_extract_archive(self.name, names, response)
+
+    def list_objects(
+            self, prefix=None, delimiter=None, limit=None,
+            page_size=DEFAULT_PAGE_SIZE):
+        # an async iterator of ListingEntry, in name order, stopping after
+        # limit entries if given. pages are fetched one ahead.
+        return ContainerListing(
+            self, prefix=prefix, delimiter=delimiter, limit=limit,
+            page_size=page_size)
+
 
 class StorageObject(object):
 
     def __init__(
             self, url, container, object_name, fetch_token, ioloop,
-            tempurl_key=None):
+            tempurl_key=None, transport=None, object_cache=None,
+            info_cache=None):
         self.object_url = url
         self.container = container
         self.name = object_name
         self.fetch_token = fetch_token
         self.ioloop = ioloop
         self.tempurl_key = tempurl_key
-        self.client = AsyncHTTPClient()
+        self.transport = transport or HTTPTransport()
+        self.object_cache = object_cache
+        self.info_cache = info_cache
+
+    @property
+    def client(self):
+        # the name used before transports, kept for compatibility
+        return self.transport
 
     def generate_tempurl(self, method, expires):
         if not self.tempurl_key:
@@ -86,11 +243,18 @@ class StorageObject(object):
         return self.object_url + "?" + params
 
     async def info(self):
+        if self.info_cache is not None:
+            cached = self.info_cache.get(self.object_url)
+            if cached is not None:
+                return copy_info(cached)
+
         LOGGER.debug("Fetching object info: {0}".format(self.object_url))
         token = await self.fetch_token()
         headers = {"X-Auth-Token": token}
-        response = await self.client.fetch(
-            self.object_url, method="HEAD", headers=headers, raise_error=False)
+        response = await self.transport.fetch(
+            self.object_url, method="HEAD", headers=headers, raise_error=False,
+            service=SERVICE_LABEL, operation="info",
+            url_template=OBJECT_TEMPLATE)
         if response.code >= 400:
             return {
                 "status": "error",
@@ -116,11 +280,17 @@ class StorageObject(object):
             "etag": response.headers["Etag"]
         })
 
+        if self.info_cache is not None:
+            self.info_cache.put(self.object_url, copy_info(values))
+
         return values
 
     async def upload_stream(
             self, mimetype, writer=None, content_length=0, metadata=None):
         LOGGER.debug("Creating upload stream for {0}".format(self.object_url))
+        # cached copies are dropped now and again once the writer finishes,
+        # in case they were refilled while the upload was in progress
+        self.invalidate_caches()
         metadata = metadata or {}
         extra_headers = dict([
             ("X-Object-Meta-{0}".format(key), value)
@@ -128,61 +298,623 @@ class StorageObject(object):
         ])
         token = await self.fetch_token()
         writer = writer or BodyWriter
+        # writers written before these options existed don't take them
+        options = supported_options(
+            writer, transport=self.transport,
+            on_finish=self.invalidate_caches)
         writer_instance = writer(
             self.object_url, self.container, self.name, mimetype=mimetype,
             token=token, ioloop=self.ioloop, content_length=content_length,
-            extra_headers=extra_headers)
+            extra_headers=extra_headers, **options)
         return writer_instance
 
-    async def read(self, start=0, end=0):
+    def invalidate_caches(self):
+        invalidate_caches(self.object_url, self.object_cache, self.info_cache)
+
+    async def upload_file(
+            self, path, mimetype=None, metadata=None,
+            segment_size=DEFAULT_SEGMENT_SIZE, concurrency=4, dynamic=False,
+            journal_path=None):
+        # files up to segment_size go up in one PUT, bigger ones as
+        # segments sent side by side. either way the bytes are views of a
+        # memory mapped file, so nothing is copied on the way out. with a
+        # journal_path, segmented uploads pick up where a previous attempt
+        # with the same journal (and an unchanged file) left off.
+        if mimetype is None:
+            mimetype = mimetypes.guess_type(path)[0] or \
+                "application/octet-stream"
+        stat = os.stat(path)
+        size = stat.st_size
+
+        if size > segment_size:
+            writer = await self.upload_stream(
+                mimetype, content_length=size, metadata=metadata,
+                writer=SegmentWriter.with_defaults(
+                    segment_size=segment_size, dynamic=dynamic,
+                    journal_path=journal_path, journal_source={
+                        "size": size, "mtime": stat.st_mtime_ns}))
+        else:
+            writer = await self.upload_stream(
+                mimetype, content_length=size, metadata=metadata)
+
+        if size == 0:
+            # an empty file can't be mapped
+            return await writer.finish()
+
+        with open(path, "rb") as fp:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            view = memoryview(mapped)
+            if size > segment_size:
+                start = 0
+                if journal_path is not None:
+                    start = await writer.resume()
+                await self._upload_segments(
+                    writer, view, segment_size, concurrency, start)
+            else:
+                await write_frames(writer, view)
+            del view
+        finally:
+            try:
+                mapped.close()
+            except BufferError:
+                # a view is still referenced (e.g. by a failed request's
+                # traceback), so leave the mapping to be closed when freed
+                pass
+
+        return await writer.finish()
+
+    async def _upload_segments(
+            self, writer, view, segment_size, concurrency, start=0):
+        semaphore = locks.Semaphore(concurrency)
+        failures = []
+
+        async def upload_segment(segment, offset):
+            try:
+                await write_frames(
+                    segment, view[offset:offset + segment_size])
+                await writer.close_segment(segment)
+            except Exception:
+                failures.append(segment)
+                raise
+            finally:
+                semaphore.release()
+
+        uploads = []
+        # segments are created in order (as slots free up), which is the
+        # order they're listed in the manifest
+        for offset in range(start, len(view), segment_size):
+            await semaphore.acquire()
+            if failures:
+                # the upload has already failed, so the rest would be wasted
+                break
+            uploads = [upload for upload in uploads if not upload.done()]
+            uploads.append(gen.convert_yielded(
+                upload_segment(writer.create_segment(), offset)))
+        await gen.multi(uploads)
+
+    async def delete(self):
+        LOGGER.debug("Deleting object {0}".format(self.object_url))
+        self.invalidate_caches()
+
+        token = await self.fetch_token()
+        response = await self.transport.fetch(
+            self.object_url, method="DELETE",
+            headers={"X-Auth-Token": token}, raise_error=False,
+            service=SERVICE_LABEL, operation="delete",
+            url_template=OBJECT_TEMPLATE)
+        if response.code >= 400:
+            return {
+                "status": "error",
+                "code": response.code,
+                "body": response.body
+            }
+        return {"status": "success"}
+
+    async def read(
+            self, start=0, end=0, concurrency=1,
+            part_size=DEFAULT_PART_SIZE, verify=False):
+        if verify and concurrency > 1:
+            raise ValueError("Only single stream reads can be verified.")
+
+        if self._use_cache(start, end) and not verify:
+            return bytearray(await self.read_cached())
+
+        if concurrency > 1:
+            return await self.read_parallel(
+                start=start, end=end, concurrency=concurrency,
+                part_size=part_size)
+
         body = bytearray()
-        reader = await self.read_stream(start=start, end=end)
+        reader = await self.read_stream(start=start, end=end, verify=verify)
         for read_future in reader:
             chunk = await read_future
             body.extend(chunk)
         return body
 
-    async def read_stream(self, start=0, end=0):
+    async def read_parallel(
+            self, start=0, end=0, concurrency=4,
+            part_size=DEFAULT_PART_SIZE):
+        # splits the object into byte ranges fetched side by side, each
+        # written straight into its slot of a preallocated buffer.
+        if end == 0:
+            end = await self.fetch_length() - 1
+
+        body = bytearray(max(end - start + 1, 0))
+        await self.readinto(
+            body, start=start, concurrency=concurrency, part_size=part_size)
+        return body
+
+    async def readinto(
+            self, buffer, start=0, concurrency=1,
+            part_size=DEFAULT_PART_SIZE):
+        # fills any writable buffer (a bytearray, an mmap of a file, ...)
+        # with the len(buffer) bytes of the object starting at start.
+        if not len(buffer):
+            return 0
+
+        end = start + len(buffer) - 1
+        view = memoryview(buffer)
+
+        def write_chunk(offset, chunk):
+            position = offset - start
+            view[position:position + len(chunk)] = chunk
+
+        await self.read_ranges(
+            self._plan_ranges(start, end, concurrency, part_size),
+            write_chunk, concurrency=concurrency)
+        return len(buffer)
+
+    async def download_to_path(
+            self, path, start=0, end=0, concurrency=1,
+            part_size=DEFAULT_PART_SIZE, fsync=True):
+        # each chunk is written at its offset as it arrives, so memory use
+        # stays flat no matter how large the object is.
+        if end == 0 and concurrency > 1:
+            end = await self.fetch_length() - 1
+
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        written = [0]
+        complete = False
+
+        def write_chunk(offset, chunk):
+            # read_range keeps chunks within their range
+            os.pwrite(fd, chunk, offset - start)
+            written[0] = max(written[0], offset - start + len(chunk))
+
+        try:
+            if end == 0:
+                # a single stream to the end, no need to know the length
+                await self.read_range(start, "", write_chunk)
+            else:
+                os.ftruncate(fd, max(end - start + 1, 0))
+                await self.read_ranges(
+                    self._plan_ranges(start, end, concurrency, part_size),
+                    write_chunk, concurrency=concurrency)
+            if fsync:
+                os.fsync(fd)
+            complete = True
+        finally:
+            os.close(fd)
+            if not complete:
+                # a partial file could be mistaken for the object
+                os.unlink(path)
+
+        return written[0]
+
+    def _plan_ranges(self, start, end, concurrency, part_size):
+        if concurrency > 1:
+            return split_range(start, end, part_size)
+        return [(start, end)]
+
+    async def fetch_length(self):
+        info = await self.info()
+        if info["status"] != "success":
+            raise StreamError(
+                "Error retrieving object: {0}".format(info["code"]))
+        return info["length"]
+
+    async def read_ranges(self, ranges, write_chunk, concurrency=4):
+        # ranges are inclusive (start, end) pairs. write_chunk(offset,
+        # chunk) is called as data arrives.
+        semaphore = locks.Semaphore(concurrency)
+
+        async def read_part(start, end):
+            async with semaphore:
+                await self.read_range(start, end, write_chunk)
+
+        await gen.multi([read_part(start, end) for start, end in ranges])
+
+    async def read_range(self, start, end, write_chunk):
+        # a range that fails is retried from its start on its own, so
+        # write_chunk may see the same offsets more than once.
+        length = None if end == "" else end - start + 1
+        return await self._read_with_retries(
+            self.object_url, start, write_chunk, byte_range=(start, end),
+            length=length, operation="read_range")
+
+    async def read_segment(self, segment, write_chunk):
+        # like read_range, but for one segment of a manifest, which is also
+        # retried if its contents don't match the manifest's etag.
+        return await self._read_with_retries(
+            segment.url, segment.offset, write_chunk,
+            byte_range=segment.byte_range, length=segment.length,
+            etag=segment.etag, operation="read_segment")
+
+    async def _read_with_retries(
+            self, url, offset, write_chunk, byte_range=None, length=None,
+            etag=None, operation=None):
+        with utilities.gen_retry(
+                self.ioloop, max_retries=PART_RETRIES) as wait:
+            while True:
+                response = await self._read_part(
+                    url, offset, write_chunk, byte_range, length, etag,
+                    operation)
+                if response is not None:
+                    return response
+                try:
+                    await wait()
+                except utilities.MaxRetriesExceeded:
+                    raise StreamError("Failed to read {0}".format(
+                        describe_part(url, byte_range)))
+
+    async def _read_part(
+            self, url, offset, write_chunk, byte_range, length, etag,
+            operation):
+        # returns None if the part should be retried. only the body of a
+        # response that is the part goes to write_chunk, and never more
+        # than length bytes of it (when the length is known).
+        token = await self.fetch_token()
+        headers = {"X-Auth-Token": token}
+        if byte_range is not None:
+            headers["Range"] = "bytes={0}-{1}".format(*byte_range)
+
+        status = [None]
+        received = [0]
+        md5sum = hashlib.md5() if etag else None
+
+        def header_callback(line):
+            if line.startswith("HTTP/"):
+                status[0] = httputil.parse_response_start_line(
+                    line.strip()).code
+
+        def body_callback(chunk):
+            if not is_part_response(status[0], byte_range):
+                # error pages and the like are never written
+                return
+            position = received[0]
+            received[0] += len(chunk)
+            if length is not None:
+                chunk = chunk[:max(length - position, 0)]
+            if md5sum is not None:
+                md5sum.update(chunk)
+            write_chunk(offset + position, chunk)
+
+        try:
+            response = await self.transport.fetch(
+                url, headers=headers, header_callback=header_callback,
+                streaming_callback=body_callback, raise_error=False,
+                service=SERVICE_LABEL, operation=operation,
+                url_template=OBJECT_TEMPLATE)
+        except (IOError, HTTPClientError) as error:
+            LOGGER.warning("Retrying {0} ({1})".format(
+                describe_part(url, byte_range), error))
+            return None
+
+        if response.code >= 500:
+            LOGGER.warning("Retrying {0} ({1})".format(
+                describe_part(url, byte_range), response.code))
+            return None
+
+        if response.code >= 400:
+            raise StreamError(
+                "Error retrieving object: {0}".format(response.code))
+
+        if not is_part_response(response.code, byte_range):
+            LOGGER.warning("Retrying {0} (unexpected {1} response)".format(
+                describe_part(url, byte_range), response.code))
+            return None
+
+        if length is not None and received[0] > length:
+            # more than was asked for, so it isn't (only) the part
+            LOGGER.warning("Retrying {0} ({1} bytes, expected {2})".format(
+                describe_part(url, byte_range), received[0], length))
+            return None
+
+        if md5sum is not None and md5sum.hexdigest() != etag:
+            LOGGER.warning("Retrying {0} (checksum mismatch)".format(
+                describe_part(url, byte_range)))
+            return None
+
+        return response
+
+    async def build_verifier(self, start, end):
+        if start != 0 or end != 0:
+            raise ValueError("Only whole objects can be verified.")
+        # a large object's etag covers its segments' etags, so the body
+        # has to be hashed at the same boundaries.
+        segments = await self.fetch_segments()
+        if segments is None:
+            return StreamVerifier(self.object_url)
+        if any(segment.etag is None for segment in segments):
+            raise StreamError(
+                "Object {0} has partial segments and can't be "
+                "verified.".format(self.object_url))
+        if any(segment.nested for segment in segments):
+            # the etag covers the sub-manifests' etags, not their segments'
+            raise StreamError(
+                "Object {0} has nested manifests and can't be "
+                "verified.".format(self.object_url))
+        return StreamVerifier(
+            self.object_url, [segment.length for segment in segments])
+
+    @property
+    def account_url(self):
+        suffix = "/{0}/{1}".format(self.container, self.name)
+        return self.object_url[:-len(suffix)]
+
+    async def fetch_segments(self):
+        # the segments of a static or dynamic large object, in order, or
+        # None if this object isn't a manifest.
+        info = await self.info()
+        if info["status"] != "success":
+            raise StreamError(
+                "Error retrieving object: {0}".format(info["code"]))
+
+        if info.get("x-static-large-object", "").lower() == "true":
+            entries = await self._fetch_static_manifest(self.object_url)
+        elif "x-object-manifest" in info:
+            entries = await self._fetch_dynamic_manifest(
+                info["x-object-manifest"])
+        else:
+            return None
+
+        segments = []
+        offset = 0
+        for name, etag, length, byte_range, nested in entries:
+            segment_url = self.account_url + urlparse.quote(name)
+            segments.append(Segment(
+                segment_url, offset, length, etag, byte_range, nested))
+            offset += length
+        return segments
+
+    async def _fetch_static_manifest(self, manifest_url):
+        token = await self.fetch_token()
+        response = await self.transport.fetch(
+            manifest_url + "?multipart-manifest=get",
+            headers={"X-Auth-Token": token}, raise_error=False,
+            service=SERVICE_LABEL, operation="fetch_manifest",
+            url_template=OBJECT_TEMPLATE)
+        if response.code >= 400:
+            raise StreamError(
+                "Error retrieving manifest: {0}".format(response.code))
+
+        entries = []
+        for item in json.loads(response.body.decode("utf8")):
+            if item.get("sub_slo"):
+                # nested manifests are flattened into their segments
+                sub_entries = await self._fetch_static_manifest(
+                    self.account_url + urlparse.quote(item["name"]))
+                entries.extend(entry[:4] + (True,) for entry in sub_entries)
+                continue
+            if "range" in item:
+                # only part of the segment is used, so its etag won't match
+                start, end = [int(x) for x in item["range"].split("-")]
+                entries.append(
+                    (item["name"], None, end - start + 1, (start, end), False))
+                continue
+            entries.append(
+                (item["name"], item["hash"], item["bytes"], None, False))
+        return entries
+
+    async def _fetch_dynamic_manifest(self, manifest):
+        # segments are every object under container/prefix, by name
+        container_name, prefix = manifest.split("/", 1)
+        container = StorageContainer(
+            "{0}/{1}".format(self.account_url, container_name),
+            container_name, self.fetch_token, self.ioloop,
+            transport=self.transport)
+        entries = []
+        async for entry in container.list_objects(prefix=prefix):
+            entries.append((
+                "/{0}/{1}".format(container_name, entry.name),
+                entry.etag, entry.length, None, False))
+        return entries
+
+    async def read_segments(self, concurrency=4):
+        # downloads a large object segment by segment (concurrency at a
+        # time), checking each against its etag, into a single buffer.
+        segments = await self._require_segments()
+        body = bytearray(sum(segment.length for segment in segments))
+        view = memoryview(body)
+
+        def write_chunk(offset, chunk):
+            view[offset:offset + len(chunk)] = chunk
+
+        await self._read_segments(segments, write_chunk, concurrency)
+        return body
+
+    async def download_segments_to_path(
+            self, path, concurrency=4, fsync=True):
+        segments = await self._require_segments()
+        length = sum(segment.length for segment in segments)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        complete = False
+        try:
+            os.ftruncate(fd, length)
+            await self._read_segments(
+                segments, lambda offset, chunk: os.pwrite(fd, chunk, offset),
+                concurrency)
+            if fsync:
+                os.fsync(fd)
+            complete = True
+        finally:
+            os.close(fd)
+            if not complete:
+                os.unlink(path)
+        return length
+
+    async def stream_segments(self, concurrency=4):
+        # an async iterator of whole segments, in order, with up to
+        # concurrency segments downloading (and held in memory) at once.
+        segments = await self._require_segments()
+        return SegmentReader(self, segments, concurrency)
+
+    async def _require_segments(self):
+        segments = await self.fetch_segments()
+        if segments is None:
+            raise StreamError(
+                "Object {0} is not a manifest.".format(self.object_url))
+        return segments
+
+    async def _read_segments(self, segments, write_chunk, concurrency):
+        semaphore = locks.Semaphore(concurrency)
+
+        async def read_segment(segment):
+            async with semaphore:
+                await self.read_segment(segment, write_chunk)
+
+        await gen.multi([read_segment(segment) for segment in segments])
+
+    def read_window(self, start=0, end=0, window_size=DEFAULT_WINDOW_SIZE):
+        # an async iterator of chunks that never buffers more than
+        # window_size bytes, however slowly it is consumed.
+        return WindowedReader(
+            self, start=start, end=end, window_size=window_size)
+
+    def _use_cache(self, start, end):
+        # only whole objects are cached
+        return self.object_cache is not None and start == 0 and end == 0
+
+    async def read_cached(self):
+        return await self.object_cache.fetch(
+            self.object_url, self._revalidate)
+
+    async def _revalidate(self, entry):
+        token = await self.fetch_token()
+        headers = {"X-Auth-Token": token}
+        if entry is not None:
+            headers["If-None-Match"] = entry.etag
+
+        # streamed, so objects past the client's buffer size still work
+        body = bytearray()
+        response = await self.transport.fetch(
+            self.object_url, headers=headers, streaming_callback=body.extend,
+            raise_error=False, service=SERVICE_LABEL,
+            operation="read_cached", url_template=OBJECT_TEMPLATE)
+
+        if response.code == 304:
+            cached = self.object_cache.load(entry)
+            if cached is not None:
+                LOGGER.debug("Serving {0} from cache".format(self.object_url))
+                return cached
+            # the cached copy went missing, so fetch it again in full
+            return await self._revalidate(None)
+
+        if response.code >= 400:
+            raise StreamError(
+                "Error retrieving object: {0}".format(response.code))
+
+        etag = response.headers.get("Etag")
+        if etag:
+            # put() skips anything over the cache's max_bytes
+            self.object_cache.put(self.object_url, etag, body)
+        return bytes(body)
+
+    async def read_stream(self, start=0, end=0, verify=False):
+        # with verify, the body is hashed as it arrives and checked against
+        # the ETag once it ends, raising StreamError from the last chunk.
         LOGGER.debug("Creating read stream {0}".format(self.object_url))
+        verifier = None
+        # with a cache, the body is streamed as usual and a copy is kept
+        # (while it fits in the cache) to store once it ends
+        cache_entry = None
+        cache_copy = None
+        if verify:
+            verifier = await self.build_verifier(start, end)
+        elif self._use_cache(start, end):
+            cache_entry = self.object_cache.get(self.object_url)
+            cache_copy = [bytearray()]
+
         token = await self.fetch_token()
         if end == 0:
             end = ""
 
-        headers = {
-            "X-Auth-Token": token,
-            "Range": "bytes={0}-{1}".format(start, end)
-        }
+        headers = {"X-Auth-Token": token}
+        if cache_copy is None:
+            headers["Range"] = "bytes={0}-{1}".format(start, end)
+        elif cache_entry is not None:
+            headers["If-None-Match"] = cache_entry.etag
 
-        chunks = []
-        futures = []
+        chunks = collections.deque()
+        futures = collections.deque()
 
-        def body_callback(chunk):
+        def deliver(chunk):
             if futures:
-                future = futures.pop(0)
+                future = futures.popleft()
                 future.set_result(chunk)
             else:
                 chunks.append(chunk)
 
+        def body_callback(chunk):
+            if verifier is not None:
+                verifier.update(chunk)
+            if cache_copy is not None and cache_copy[0] is not None:
+                if len(cache_copy[0]) + len(chunk) > \
+                        self.object_cache.max_bytes:
+                    cache_copy[0] = None
+                else:
+                    cache_copy[0].extend(chunk)
+            deliver(chunk)
+
         def response_callback(f):
             response = f.result()
+            exception = None
+            if response.code == 304 and cache_entry is not None:
+                cached = self.object_cache.load(cache_entry)
+                if cached is None:
+                    exception = StreamError(
+                        "Cached copy of {0} is missing.".format(
+                            self.object_url))
+                else:
+                    LOGGER.debug("Serving {0} from cache".format(
+                        self.object_url))
+                    for chunk in iterate_chunks(cached):
+                        deliver(chunk)
+            elif cache_copy is not None and cache_copy[0] is not None and \
+                    response.code < 300 and response.headers.get("Etag"):
+                self.object_cache.put(
+                    self.object_url, response.headers["Etag"], cache_copy[0])
+
             if response.code >= 400:
                 LOGGER.debug("Error reading {0} ({1})".format(
                     self.object_url, response.code))
                 exception = StreamError(
                     "Error retrieving object: {0}".format(response.code))
+            elif verifier is not None:
+                try:
+                    verifier.verify(response.headers.get("Etag"))
+                except StreamError as error:
+                    exception = error
+
+            if exception is not None:
                 if not futures:
-                    raise exception
-                future = futures.pop(0)
+                    # raised once the buffered chunks are consumed
+                    chunks.append(exception)
+                    return
+                future = futures.popleft()
                 future.set_exception(exception)
             else:
                 if futures:
-                    futures.pop(0).set_result("")
+                    futures.popleft().set_result("")
             LOGGER.debug("Finished reading {0}".format(self.object_url))
             chunks.append(READ_DONE)
 
-        response_future = self.client.fetch(
+        response_future = self.transport.fetch(
             self.object_url, headers=headers,
-            streaming_callback=body_callback, raise_error=False)
+            streaming_callback=body_callback, raise_error=False,
+            service=SERVICE_LABEL, operation="read_stream",
+            url_template=OBJECT_TEMPLATE)
 
         response_future.add_done_callback(response_callback)
 
@@ -197,22 +929,360 @@ class StorageObject(object):
                     yield future
                     continue
 
-                chunk = chunks.pop(0)
+                chunk = chunks.popleft()
 
                 if chunk is READ_DONE:
                     break
 
+                if isinstance(chunk, StreamError):
+                    future.set_exception(chunk)
+                    yield future
+                    break
+
                 future.set_result(chunk)
                 yield future
 
         return iterate()
 
 
+class Segment(object):
+
+    __slots__ = ("url", "offset", "length", "etag", "byte_range", "nested")
+
+    def __init__(
+            self, url, offset, length, etag, byte_range=None, nested=False):
+        self.url = url
+        # where this segment starts in the assembled object
+        self.offset = offset
+        self.length = length
+        self.etag = etag
+        self.byte_range = byte_range
+        # whether it came from a sub-manifest of a static large object
+        self.nested = nested
+
+
+class ListingEntry(object):
+    # with a delimiter, names that share a prefix up to it are collapsed
+    # into a single entry with subdir set and no other details.
+
+    __slots__ = (
+        "name", "length", "etag", "content_type", "last_modified", "subdir")
+
+    def __init__(
+            self, name, length=None, etag=None, content_type=None,
+            last_modified=None, subdir=False):
+        self.name = name
+        self.length = length
+        self.etag = etag
+        self.content_type = content_type
+        self.last_modified = last_modified
+        self.subdir = subdir
+
+    @classmethod
+    def from_listing(cls, item):
+        if "subdir" in item:
+            return cls(item["subdir"], subdir=True)
+        return cls(
+            item["name"], length=item["bytes"], etag=item["hash"],
+            content_type=item.get("content_type"),
+            last_modified=item.get("last_modified"))
+
+
+class ContainerListing(object):
+    # walks a container with marker paging. the request for the next page
+    # goes out as soon as a page arrives, so it overlaps with the caller
+    # working through the current one.
+
+    def __init__(
+            self, container, prefix=None, delimiter=None, limit=None,
+            page_size=DEFAULT_PAGE_SIZE):
+        self.container = container
+        self.prefix = prefix
+        self.delimiter = delimiter
+        self.remaining = limit
+        self.page_size = page_size
+        self.marker = None
+        self.finished = limit == 0
+        self.entries = collections.deque()
+        self.next_page = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.entries:
+            if self.next_page is None:
+                if self.finished:
+                    raise StopAsyncIteration
+                self._prefetch()
+            page, self.next_page = self.next_page, None
+            self.entries.extend(await page)
+            self._prefetch()
+        return self.entries.popleft()
+
+    def _prefetch(self):
+        if not self.finished:
+            self.next_page = gen.convert_yielded(self._fetch_page())
+
+    async def _fetch_page(self):
+        page_size = self.page_size
+        if self.remaining is not None:
+            page_size = min(page_size, self.remaining)
+
+        params = [("format", "json"), ("limit", page_size)]
+        for name in ("prefix", "delimiter", "marker"):
+            if getattr(self, name):
+                params.append((name, getattr(self, name)))
+
+        token = await self.container.fetch_token()
+        response = await self.container.transport.fetch(
+            self.container.container_url + "?" + urlencode(params),
+            headers={"X-Auth-Token": token}, raise_error=False,
+            service=SERVICE_LABEL, operation="list_objects",
+            url_template=CONTAINER_TEMPLATE)
+        if response.code >= 400:
+            self.finished = True
+            raise StreamError(
+                "Error listing container: {0}".format(response.code))
+
+        listing = []
+        if response.code != 204 and response.body:
+            listing = json.loads(response.body.decode("utf8"))
+
+        entries = [ListingEntry.from_listing(item) for item in listing]
+        if self.remaining is not None:
+            self.remaining -= len(entries)
+        if entries:
+            self.marker = entries[-1].name
+        # a short page is the last one
+        self.finished = len(entries) < page_size or self.remaining == 0
+        return entries
+
+
+class BulkDelete(object):
+    # deletes paths in batches of the cluster's bulk delete limit, with
+    # up to concurrency batches in flight, yielding each path's result as
+    # its batch finishes. swift only reports the paths that failed, so
+    # the rest (including ones that were already gone) are successes.
+
+    def __init__(self, service, paths, concurrency=2):
+        self.service = service
+        self.paths = list(paths)
+        self.semaphore = locks.Semaphore(concurrency)
+        self.results = collections.deque()
+        self.batches = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.results:
+            if self.batches is None:
+                await self._start()
+            if self.batches.done():
+                raise StopAsyncIteration
+            self.results.extend(await self.batches.next())
+        return self.results.popleft()
+
+    async def _start(self):
+        batch_size = await self.service.fetch_bulk_delete_limit()
+        futures = [
+            gen.convert_yielded(self._delete_batch(
+                self.paths[index:index + batch_size]))
+            for index in range(0, len(self.paths), batch_size)]
+        self.batches = gen.WaitIterator(*futures)
+
+    async def _delete_batch(self, paths):
+        async with self.semaphore:
+            token = await self.service.fetch_token()
+            body = "\n".join(urlparse.quote(path) for path in paths)
+            # POST isn't idempotent in general, but deleting again is safe
+            response = await self.service.transport.fetch(
+                self.service.service_url + "?bulk-delete", method="POST",
+                body=body.encode("utf8"), retry=True,
+                headers={
+                    "X-Auth-Token": token,
+                    "Content-Type": "text/plain",
+                    "Accept": "application/json"
+                }, raise_error=False, service=SERVICE_LABEL,
+                operation="bulk_delete", url_template="/")
+        for path in paths:
+            invalidate_caches(
+                self.service.service_url + path, self.service.object_cache,
+                self.service.info_cache)
+        return parse_bulk_delete(paths, response)
+
+
+class StreamVerifier(object):
+    # hashes a whole object as it streams. with segment lengths, each
+    # segment is hashed on its own and the result is the md5 of their
+    # hex digests, which is how swift computes a manifest's etag.
+
+    def __init__(self, url, segment_lengths=None):
+        self.url = url
+        self.md5sum = hashlib.md5()
+        self.segment_lengths = None
+        if segment_lengths is not None:
+            self.segment_lengths = collections.deque(segment_lengths)
+            self.segment_md5sum = hashlib.md5()
+            self.remaining = self._next_length()
+
+    def _next_length(self):
+        if not self.segment_lengths:
+            raise StreamError(
+                "Object {0} is longer than its manifest.".format(self.url))
+        return self.segment_lengths.popleft()
+
+    def _finish_segment(self):
+        self.md5sum.update(self.segment_md5sum.hexdigest().encode("ascii"))
+        self.segment_md5sum = hashlib.md5()
+
+    def update(self, chunk):
+        if self.segment_lengths is None:
+            self.md5sum.update(chunk)
+            return
+
+        view = memoryview(chunk)
+        while view:
+            while self.remaining == 0:
+                self._finish_segment()
+                self.remaining = self._next_length()
+            part = view[:self.remaining]
+            self.segment_md5sum.update(part)
+            self.remaining -= len(part)
+            view = view[len(part):]
+
+    def hexdigest(self):
+        if self.segment_lengths is not None:
+            if self.remaining or any(self.segment_lengths):
+                raise StreamError(
+                    "Object {0} is shorter than its manifest.".format(
+                        self.url))
+            self._finish_segment()
+            for _ in self.segment_lengths:
+                # trailing empty segments
+                self.md5sum.update(
+                    hashlib.md5().hexdigest().encode("ascii"))
+            self.segment_lengths = None
+        return self.md5sum.hexdigest()
+
+    def verify(self, etag):
+        if not etag:
+            raise StreamError(
+                "Object {0} has no ETag to verify.".format(self.url))
+        # manifests' etags are quoted
+        etag = etag.strip('"')
+        digest = self.hexdigest()
+        if digest != etag:
+            raise StreamError(
+                "Object {0} failed verification ({1} != {2}).".format(
+                    self.url, digest, etag))
+
+
+class SegmentReader(object):
+    # yields each segment's bytes in order, keeping the next few segments
+    # downloading in the background.
+
+    def __init__(self, storage_object, segments, concurrency):
+        self.storage_object = storage_object
+        self.segments = collections.deque(segments)
+        self.concurrency = concurrency
+        self.pending = collections.deque()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while self.segments and len(self.pending) < self.concurrency:
+            self.pending.append(gen.convert_yielded(
+                self._read(self.segments.popleft())))
+        if not self.pending:
+            raise StopAsyncIteration
+        return await self.pending.popleft()
+
+    async def _read(self, segment):
+        body = bytearray(segment.length)
+        view = memoryview(body)
+
+        def write_chunk(offset, chunk):
+            position = offset - segment.offset
+            view[position:position + len(chunk)] = chunk
+
+        await self.storage_object.read_segment(segment, write_chunk)
+        return body
+
+
+class WindowedReader(object):
+    # reads successive windows of an object with Range requests, only
+    # fetching the next window once the previous one has been consumed.
+
+    def __init__(
+            self, storage_object, start=0, end=0,
+            window_size=DEFAULT_WINDOW_SIZE):
+        self.storage_object = storage_object
+        self.position = start
+        # inclusive, with 0 meaning the end of the object
+        self.end = end
+        self.window_size = window_size
+        self.chunks = collections.deque()
+        self.buffered = 0
+        self.done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.chunks:
+            if self.done:
+                raise StopAsyncIteration
+            await self._read_window()
+        chunk = self.chunks.popleft()
+        self.buffered -= len(chunk)
+        return chunk
+
+    async def _read_window(self):
+        window_start = self.position
+        window_end = window_start + self.window_size - 1
+        if self.end:
+            window_end = min(window_end, self.end)
+
+        # read_range only writes the bodies of 206s (or a 200 from the
+        # start), but a window is still held back until it's read in full
+        staged = collections.deque()
+        position = [window_start]
+
+        def write_chunk(offset, chunk):
+            # skip anything already received if a window is retried
+            skip = position[0] - offset
+            if skip >= len(chunk):
+                return
+            if skip > 0:
+                chunk = chunk[skip:]
+            staged.append(chunk)
+            position[0] += len(chunk)
+
+        response = await self.storage_object.read_range(
+            window_start, window_end, write_chunk)
+        self.chunks.extend(staged)
+        self.buffered += position[0] - window_start
+        self.position = position[0]
+
+        total = parse_content_range(response.headers.get("Content-Range"))
+        if self.position <= window_end:
+            # a short read means we've hit the end of the object
+            self.done = True
+        elif self.end and self.position > self.end:
+            self.done = True
+        elif total is not None and self.position >= total:
+            self.done = True
+
+
 class BodyWriter(object):
 
     def __init__(
             self, url, container_name, object_name, token, mimetype,
-            ioloop, content_length, extra_headers=None):
+            ioloop, content_length, extra_headers=None, transport=None,
+            spool=None, on_finish=None, hash_batch_size=None):
         self.url = url
         self.content_length = content_length
         self.transferred_length = 0
@@ -227,12 +1297,36 @@ class BodyWriter(object):
         if content_length > 0:
             self.headers["Content-length"] = str(content_length)
 
-        self.client = AsyncHTTPClient()
+        self.transport = transport or HTTPTransport()
+        # a file object that gets a copy of everything written, so the
+        # upload can be repeated if it fails
+        self.spool = spool
+        # called once finish() is over, however it went
+        self.on_finish = on_finish
+        # with hash_batch_size, written frames are trusted not to change
+        # and are hashed together in the executor once that much is queued,
+        # so small frames don't tie up the IOLoop either
+        self.hash_batch_size = hash_batch_size
+        self.unhashed = []
+        self.unhashed_size = 0
+        self.hashing = None
         self.initialized_future = Future()
         self.finish_future = Future()
-        self.request_future = self.client.fetch(
+        self.request_future = self.transport.fetch(
             url, method="PUT", body_producer=self.body_producer,
-            raise_error=False, headers=self.headers)
+            raise_error=False, headers=self.headers, service=SERVICE_LABEL,
+            operation="upload_stream", url_template=OBJECT_TEMPLATE)
+        self.request_future.add_done_callback(self._request_finished)
+
+    @property
+    def client(self):
+        # the name used before transports, kept for compatibility
+        return self.transport
+
+    def _request_finished(self, future):
+        # a request that fails before sending the body never asks for it
+        if not self.initialized_future.done():
+            self.initialized_future.set_result(None)
 
     async def body_producer(self, write_function):
         LOGGER.debug("Starting transfer to {0}".format(self.url))
@@ -242,16 +1336,85 @@ class BodyWriter(object):
 
     async def write(self, data):
         await self.initialized_future
-        self.md5sum.update(data)
         self.transferred_length += len(data)
-        await self.write_function(data)
+        if self.spool is not None:
+            self.spool.write(data)
+
+        if self.request_future.done():
+            # the request is already over and finish() will report how,
+            # so the data is only hashed (and spooled)
+            if self.hash_batch_size is None:
+                self.md5sum.update(data)
+            else:
+                self._queue_hash(data)
+            return len(data)
+
+        try:
+            await self._send(data)
+        except IOError as error:
+            if self.spool is None:
+                raise
+            LOGGER.warning("Failed writing to {0} ({1})".format(
+                self.url, error))
+        return len(data)
+
+    async def _send(self, data):
+        if self.hash_batch_size is not None:
+            self._queue_hash(data)
+            await self.write_function(data)
+        elif len(data) < EXECUTOR_HASH_SIZE:
+            self.md5sum.update(data)
+            await self.write_function(data)
+        else:
+            # hashlib releases the GIL for large buffers, so the digest
+            # runs in a thread alongside the write instead of blocking it.
+            hashed = self.ioloop.run_in_executor(
+                None, self.md5sum.update, data)
+            try:
+                await self.write_function(data)
+            finally:
+                await hashed
         LOGGER.debug("Sent {0} to {1}".format(
             self.transferred_length, self.url))
-        return len(data)
+
+    def _queue_hash(self, data):
+        self.unhashed.append(data)
+        self.unhashed_size += len(data)
+        if self.unhashed_size >= self.hash_batch_size:
+            frames = self._take_unhashed()
+            self.hashing = gen.convert_yielded(
+                self._hash_batch(self.hashing, frames))
+
+    def _take_unhashed(self):
+        frames = self.unhashed
+        self.unhashed = []
+        self.unhashed_size = 0
+        return frames
+
+    async def _hash_batch(self, previous, frames):
+        # batches go through the digest in the order they were written
+        if previous is not None:
+            await previous
+        await self.ioloop.run_in_executor(
+            None, hash_frames, self.md5sum, frames)
+
+    async def _flush_hash(self):
+        if self.hashing is not None:
+            await self.hashing
+            self.hashing = None
+        hash_frames(self.md5sum, self._take_unhashed())
 
     async def finish(self):
+        try:
+            return await self._finish()
+        finally:
+            if self.on_finish is not None:
+                self.on_finish()
+
+    async def _finish(self):
         self.finish_future.set_result(None)
         LOGGER.debug("Closing file: {}".format(self.url))
+        await self._flush_hash()
 
         response = await self.request_future
 
@@ -273,10 +1436,6 @@ class BodyWriter(object):
         }
 
 
-# 1GB default segment size
-DEFAULT_SEGMENT_SIZE = 1024 * 1024 * 1024
-
-
 class SegmentWriter(object):
 
     @classmethod
@@ -289,7 +1448,11 @@ class SegmentWriter(object):
     def __init__(
             self, url, container, object_name, token, mimetype, ioloop,
             content_length, segment_size=DEFAULT_SEGMENT_SIZE, dynamic=False,
-            extra_headers=None):
+            extra_headers=None, transport=None, concurrency=1,
+            buffer_size=DEFAULT_SEGMENT_BUFFER, journal_path=None,
+            segment_retries=0, spool_size=DEFAULT_SPOOL_SIZE,
+            max_manifest_segments=MAX_MANIFEST_SEGMENTS, adaptive=False,
+            memory_budget=None, on_finish=None, journal_source=None):
         self.url = url
         self.segment_size = segment_size
         self.container = container
@@ -300,12 +1463,59 @@ class SegmentWriter(object):
         self.content_length = content_length
         self.ioloop = ioloop
         self.md5sum = hashlib.md5()
-        self.segments = []
+        # segment index -> manifest entry, for segments that aren't yet
+        # part of a written sub-manifest
+        self.segments = {}
+        self.segment_count = 0
         self.segment_indexes = {}
         self.current_segment_number = 0
+        # static manifests over max_manifest_segments are split into
+        # sub-manifests of that many segments, listed here in order
+        self.max_manifest_segments = max_manifest_segments
+        self.manifests = []
+        self.manifest_lock = locks.Lock()
         self.current_segment_size = 0
         self.current_segment = None
+        # small writes are gathered here into whole frames
+        self.pending = bytearray()
         self.extra_headers = extra_headers or {}
+        self.transport = transport or HTTPTransport()
+        # write() moves on to the next segment once the current one is
+        # queued, so up to concurrency segments are sending at once, each
+        # holding at most buffer_size bytes that haven't been sent yet.
+        self.segment_slots = locks.Semaphore(concurrency)
+        self.queue_size = max(1, buffer_size // CHUNK_SIZE)
+        self.uploads = []
+        self.upload_error = None
+        # completed segments are appended here as JSON lines, so a later
+        # writer can resume() instead of starting over. the first line
+        # names the object and journal_source (anything JSON describing
+        # the data, like a file's size and mtime), which resume() checks.
+        self.journal_path = journal_path
+        self.journal_source = journal_source
+        # with segment_retries, each segment is spooled (in memory up to
+        # spool_size, then in a temporary file) until its etag is checked
+        self.segment_retries = segment_retries
+        self.spool_size = spool_size
+        if memory_budget is not None:
+            # each segment in flight holds its queue, up to two batches
+            # waiting to be hashed and its in-memory spool (a spool size
+            # of 0 would never spill to disk)
+            per_segment = (
+                memory_budget // concurrency - buffer_size -
+                2 * EXECUTOR_HASH_SIZE)
+            self.spool_size = max(1, min(spool_size, per_segment))
+        # adaptive sizing ignores segment_size, starting from the content
+        # length and then following how fast segments actually upload
+        self.adaptive = adaptive
+        self.concurrency = concurrency
+        self.bytes_written = 0
+        if adaptive:
+            self.segment_size = initial_segment_size(
+                content_length, concurrency, max_manifest_segments)
+        self.next_segment_size = self.segment_size
+        # called once finish() is over, however it went
+        self.on_finish = on_finish
 
     def create_segment(self, segment_name=None):
         if not segment_name:
@@ -317,64 +1527,357 @@ class SegmentWriter(object):
 
         LOGGER.debug("Creating new segment {0}".format(segment_url))
 
-        segment = BodyWriter(
-            segment_url, self.container, self.object_name, self.token,
-            "application/video-segment", self.ioloop, content_length=0)
+        spool = None
+        if self.segment_retries:
+            spool = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        segment = self.build_segment_writer(segment_url, spool)
 
         segment_path = "/{0}/{1}/{2}".format(
             self.container, self.object_name, segment_name)
 
-        self.segment_indexes[id(segment)] = len(self.segments)
+        self.segment_indexes[id(segment)] = self.segment_count
 
-        self.segments.append({
+        self.segments[self.segment_count] = {
             "path": segment_path,
             "etag": "",
             "size_bytes": 0
-        })
+        }
+        self.segment_count += 1
 
         return segment
 
-    async def write(self, data):
-        if not self.current_segment:
-            self.current_segment = self.create_segment()
-            self.current_segment_size = 0
-
-        chunk_size = \
-            CHUNK_SIZE if CHUNK_SIZE < self.segment_size else self.segment_size
-
-        if self.segment_size < self.current_segment_size + chunk_size:
-            chunk_size = self.segment_size - self.current_segment_size
-
-        if len(data) < chunk_size:
-            chunk_size = len(data)
-
-        await self.current_segment.write(data[:chunk_size])
-
-        remaining_data = data[chunk_size:]
-        self.current_segment_size += chunk_size
-
-        if self.current_segment_size >= self.segment_size:
-            await self.close_segment(self.current_segment)
-            self.current_segment = None
-            self.current_segment_size = 0
+    def build_segment_writer(self, segment_url, spool=None):
+        return BodyWriter(
+            segment_url, self.container, self.object_name, self.token,
+            "application/video-segment", self.ioloop, content_length=0,
+            transport=self.transport, spool=spool,
+            hash_batch_size=EXECUTOR_HASH_SIZE)
 
-        if remaining_data:
-            await self.write(remaining_data)
+    async def write(self, data):
+        if self.upload_error is not None:
+            raise self.upload_error
+
+        # frames are queued rather than sent straight away, so they can
+        # only be views of data that can't change after this returns.
+        copy = not isinstance(data, bytes)
+        frame_size = min(CHUNK_SIZE, self.segment_size)
+        view = memoryview(data).cast("B")
+
+        while view:
+            if not self.current_segment:
+                self.current_segment = await self.start_segment()
+                self.current_segment_size = 0
+
+            space = min(
+                frame_size - len(self.pending),
+                self.segment_size - self.current_segment_size)
+            part = view[:space]
+            view = view[space:]
+            self.current_segment_size += len(part)
+            self.bytes_written += len(part)
+
+            if not self.pending and len(part) == space:
+                frame = bytes(part) if copy else part
+            else:
+                self.pending += part
+                if len(self.pending) < frame_size and \
+                        self.current_segment_size < self.segment_size:
+                    break
+                frame, self.pending = self.pending, bytearray()
+
+            await self.current_segment.put(frame)
+
+            if self.current_segment_size >= self.segment_size:
+                await self.current_segment.put(None)
+                self.current_segment = None
+                self.current_segment_size = 0
+
+    async def start_segment(self):
+        # waits for a free slot, then returns the queue that feeds the new
+        # segment. putting None on it closes the segment.
+        await self.segment_slots.acquire()
+        # sizes only change between segments
+        self.segment_size = self.next_segment_size
+        segment = self.create_segment()
+        queue = queues.Queue(maxsize=self.queue_size)
+        # finished uploads are forgotten (their entries are in segments),
+        # apart from failures, which finish() raises
+        self.uploads = [
+            upload for upload in self.uploads
+            if not upload.done() or upload.exception() is not None]
+        self.uploads.append(
+            gen.convert_yielded(self._upload_segment(segment, queue)))
+        return queue
+
+    async def _upload_segment(self, segment, queue):
+        closed = False
+        started = time.monotonic()
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    closed = True
+                    break
+                await segment.write(chunk)
+            result = await self.close_segment(segment)
+            if self.adaptive:
+                self.adjust_segment_size(
+                    result["length"], time.monotonic() - started)
+            return result
+        except Exception as error:
+            self.upload_error = error
+            # keep draining, so write() can't block on a full queue
+            while not closed:
+                closed = await queue.get() is None
+            raise
+        finally:
+            self.segment_slots.release()
+
+    def adjust_segment_size(self, length, elapsed):
+        # aims for segments that take TARGET_SEGMENT_SECONDS at the rate
+        # the last one managed, changing by at most half or double a step.
+        if length < self.segment_size or elapsed <= 0:
+            # the last, short segment says little about the rate
+            return
+        size = length / elapsed * TARGET_SEGMENT_SECONDS
+        size = min(max(size, self.segment_size / 2), self.segment_size * 2)
+
+        lowest = MIN_SEGMENT_SIZE
+        remaining_segments = self.max_manifest_segments - self.segment_count
+        if self.content_length > 0 and remaining_segments > 0:
+            # still fit the rest into a single manifest
+            remaining = self.content_length - self.bytes_written
+            lowest = max(lowest, -(-remaining // remaining_segments))
+        self.next_segment_size = int(
+            min(max(size, lowest), MAX_SEGMENT_SIZE))
+        LOGGER.debug("Segment size for {0} is now {1}".format(
+            self.url, self.next_segment_size))
 
     async def close_segment(self, segment):
         result = await segment.finish()
-        # TODO: verify and retry
+        try:
+            if not segment_uploaded(segment, result):
+                result = await self.retry_segment(segment, result)
+        finally:
+            if segment.spool is not None:
+                segment.spool.close()
         segment_index = self.segment_indexes[id(segment)]
         self.segments[segment_index]["etag"] = result["md5sum"]
         self.segments[segment_index]["size_bytes"] = result["length"]
-        self.md5sum.update(result["md5sum"].encode("utf8"))
+        if self.journal_path is not None:
+            self.record_segment(segment_index)
+        await self.flush_manifests()
         return result
 
+    async def flush_manifests(self, final=False):
+        # writes each run of max_manifest_segments finished segments (and
+        # the rest, when final) as a sub-manifest, in order, and forgets
+        # their entries. a run is only written once a segment after it
+        # exists, so an object that fits one manifest never nests.
+        if self.dynamic:
+            return
+        async with self.manifest_lock:
+            while True:
+                start = len(self.manifests) * self.max_manifest_segments
+                end = min(
+                    start + self.max_manifest_segments, self.segment_count)
+                if end == start:
+                    return
+                if not final and (
+                        end - start < self.max_manifest_segments or
+                        end == self.segment_count):
+                    return
+                entries = [self.segments[i] for i in range(start, end)]
+                if not all(entry["etag"] for entry in entries):
+                    return
+                self.manifests.append(await self.put_sub_manifest(
+                    len(self.manifests) + 1, entries))
+                for index in range(start, end):
+                    del self.segments[index]
+
+    async def put_sub_manifest(self, number, entries):
+        manifest_name = "manifests/%06d" % number
+        manifest_url = "{0}/{1}?multipart-manifest=put".format(
+            self.url, manifest_name)
+        headers = {
+            "X-Auth-Token": self.token,
+            "Content-type": "application/video-segment"
+        }
+        response = await self.put_manifest(
+            manifest_url, json.dumps(entries), headers)
+        if response.code not in range(200, 300):
+            raise StreamError("Failed to write manifest {0}: {1}".format(
+                manifest_url, response.code))
+
+        # swift's etag for a manifest is the md5 of its segments' etags
+        etags = "".join(entry["etag"] for entry in entries)
+        return {
+            "path": "/{0}/{1}/{2}".format(
+                self.container, self.object_name, manifest_name),
+            "etag": hashlib.md5(etags.encode("utf8")).hexdigest(),
+            "size_bytes": sum(entry["size_bytes"] for entry in entries)
+        }
+
+    async def put_manifest(self, manifest_url, body, headers):
+        with utilities.gen_retry(
+                self.ioloop, max_retries=MANIFEST_RETRIES) as wait:
+            while True:
+                response = await self.transport.fetch(
+                    manifest_url, method="PUT", body=body, headers=headers,
+                    raise_error=False, service=SERVICE_LABEL,
+                    operation="put_manifest", url_template=OBJECT_TEMPLATE)
+                if response.code < 500:
+                    return response
+                LOGGER.warning("Retrying manifest {0} ({1})".format(
+                    manifest_url, response.code))
+                try:
+                    await wait()
+                except utilities.MaxRetriesExceeded:
+                    return response
+
+    async def retry_segment(self, segment, result):
+        # uploads the spooled copy again until the etag matches
+        expected = segment.md5sum.hexdigest()
+        with utilities.gen_retry(
+                self.ioloop, max_retries=self.segment_retries) as wait:
+            while True:
+                LOGGER.warning("Segment {0} failed ({1})".format(
+                    segment.url, result.get("code") or result["md5sum"]))
+                if segment.spool is None:
+                    raise StreamError(
+                        "Failed to upload {0}".format(segment.url))
+                try:
+                    await wait()
+                except utilities.MaxRetriesExceeded:
+                    raise StreamError(
+                        "Failed to upload {0}".format(segment.url))
+
+                retry = self.build_segment_writer(segment.url)
+                segment.spool.seek(0)
+                try:
+                    while True:
+                        chunk = segment.spool.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        await retry.write(chunk)
+                except IOError as error:
+                    # finish() reports the failed request, so this just
+                    # goes round again
+                    LOGGER.warning("Failed writing to {0} ({1})".format(
+                        segment.url, error))
+                result = await retry.finish()
+                if segment_uploaded(retry, result) and \
+                        retry.md5sum.hexdigest() == expected:
+                    return result
+
+    @property
+    def segment_prefix(self):
+        return "/{0}/{1}/segments/".format(self.container, self.object_name)
+
+    def journal_header(self):
+        return {
+            "object": "/{0}/{1}".format(self.container, self.object_name),
+            "source": self.journal_source
+        }
+
+    def record_segment(self, segment_index):
+        entry = dict(self.segments[segment_index], index=segment_index)
+        with open(self.journal_path, "a") as fp:
+            if not fp.tell():
+                fp.write(json.dumps(self.journal_header()) + "\n")
+            fp.write(json.dumps(entry) + "\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    async def resume(self, concurrency=10):
+        # reloads the journal and HEADs its segments, keeping them from the
+        # first one up to the first that is missing or doesn't match. the
+        # caller continues writing from the returned byte offset.
+        if self.segment_count:
+            raise ValueError("Can only resume before writing.")
+        header, entries = load_journal(self.journal_path)
+        if header is not None and header["object"] != \
+                self.journal_header()["object"]:
+            raise ValueError("Journal {0} is for {1}, not {2}.".format(
+                self.journal_path, header["object"], self.url))
+        if header is not None and \
+                header["source"] != self.journal_source:
+            # the data has changed, so none of the segments can be used
+            LOGGER.warning("Discarding journal {0} for changed data".format(
+                self.journal_path))
+            os.remove(self.journal_path)
+            entries = {}
+
+        candidates = []
+        while len(candidates) in entries and entries[len(candidates)][
+                "path"].startswith(self.segment_prefix):
+            candidates.append(entries[len(candidates)])
+
+        semaphore = locks.Semaphore(concurrency)
+
+        async def check(entry):
+            async with semaphore:
+                return await self.check_segment(entry)
+
+        results = await gen.multi([check(entry) for entry in candidates])
+        offset = 0
+        for entry, uploaded in zip(candidates, results):
+            if not uploaded:
+                break
+            self.segments[self.segment_count] = {
+                "path": entry["path"],
+                "etag": entry["etag"],
+                "size_bytes": entry["size_bytes"]
+            }
+            self.segment_count += 1
+            offset += entry["size_bytes"]
+
+        self.current_segment_number = self.segment_count
+        LOGGER.debug("Resuming {0} from {1} segments ({2} bytes)".format(
+            self.url, self.segment_count, offset))
+        await self.flush_manifests()
+        return offset
+
+    async def check_segment(self, entry):
+        suffix = "/{0}/{1}".format(self.container, self.object_name)
+        segment_url = self.url[:-len(suffix)] + entry["path"]
+        response = await self.transport.fetch(
+            segment_url, method="HEAD", headers={"X-Auth-Token": self.token},
+            raise_error=False, service=SERVICE_LABEL,
+            operation="check_segment", url_template=OBJECT_TEMPLATE)
+        return response.code == 200 and \
+            response.headers.get("Etag") == entry["etag"] and \
+            int(response.headers.get("Content-length", -1)) == \
+            entry["size_bytes"]
+
     async def finish(self):
+        try:
+            return await self._finish()
+        finally:
+            if self.on_finish is not None:
+                self.on_finish()
+
+    async def _finish(self):
         if self.current_segment:
-            await self.close_segment(self.current_segment)
+            if self.pending:
+                await self.current_segment.put(self.pending)
+                self.pending = bytearray()
+            await self.current_segment.put(None)
+            self.current_segment = None
+        await gen.multi(self.uploads)
+
+        # dynamic manifests have no segment limit, so they never nest
+        nested = self.manifests or \
+            self.segment_count > self.max_manifest_segments
+        if nested and not self.dynamic:
+            await self.flush_manifests(final=True)
+            entries = self.manifests
+        else:
+            entries = [self.segments[i] for i in range(self.segment_count)]
 
-        client = AsyncHTTPClient()
+        # segments may finish in any order, so this waits until the end
+        for entry in entries:
+            self.md5sum.update(entry["etag"].encode("utf8"))
 
         headers = {
             "X-Auth-Token": self.token,
@@ -396,24 +1899,236 @@ class SegmentWriter(object):
             # static manifests are more stable, since they include
             # explicit information about the chunks, but they do have size
             # limitations
-            body = json.dumps(self.segments)
+            body = json.dumps(entries)
             manifest_url = self.url + "?multipart-manifest=put"
 
-        response = await client.fetch(
-            manifest_url, method="PUT", body=body, headers=headers)
+        response = await self.put_manifest(manifest_url, body, headers)
 
-        LOGGER.debug("Finished segmented delivery {0}".format(self.url))
+        if response.code not in range(200, 300):
+            LOGGER.debug("Manifest {0} failed: {1}".format(
+                self.url, response.code))
+            return {
+                "status": "error",
+                "code": response.code,
+                "body": response.body
+            }
 
-        # TODO: verify and retry
+        LOGGER.debug("Finished segmented delivery {0}".format(self.url))
+        if self.journal_path is not None and \
+                os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
 
         return {
             "etag": response.headers["Etag"],
             "status": "success",
             "md5sum": self.md5sum.hexdigest(),
-            "length": sum([s["size_bytes"] for s in self.segments])
+            "length": sum([s["size_bytes"] for s in entries])
         }
 
 
+def initial_segment_size(content_length, concurrency, max_segments):
+    if content_length <= 0:
+        return DEFAULT_ADAPTIVE_SEGMENT_SIZE
+    # enough segments to keep every slot busy, but few enough to fit in
+    # one manifest
+    size = content_length // (concurrency * SEGMENTS_PER_SLOT)
+    size = max(size, -(-content_length // max_segments))
+    return min(max(size, MIN_SEGMENT_SIZE), MAX_SEGMENT_SIZE)
+
+
+def segment_uploaded(segment, result):
+    if result["status"] != "success" or not result["md5sum"]:
+        return False
+    return result["md5sum"].strip('"') == segment.md5sum.hexdigest()
+
+
+def load_journal(path):
+    # the header (None if there isn't one) and segment index -> entry. a
+    # segment recorded twice (re-uploaded after a resume) keeps its latest
+    # entry.
+    header = None
+    entries = {}
+    if path is None or not os.path.exists(path):
+        return header, entries
+    with open(path) as fp:
+        for line in fp:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line may be partial if we died writing it
+                continue
+            if "index" not in entry:
+                header = entry
+                continue
+            entries[entry["index"]] = entry
+    return header, entries
+
+
+def hash_frames(md5sum, frames):
+    for frame in frames:
+        md5sum.update(frame)
+
+
+async def write_frames(writer, view):
+    # big enough frames to be hashed off the IOLoop (see BodyWriter)
+    for offset in range(0, len(view), EXECUTOR_HASH_SIZE):
+        await writer.write(view[offset:offset + EXECUTOR_HASH_SIZE])
+
+
+async def write_tar_member(write, name, data):
+    info = tarfile.TarInfo(name)
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    if isinstance(data, str):
+        info.size = os.path.getsize(data)
+        await write(info.tobuf(tarfile.PAX_FORMAT, "utf-8"))
+        with open(data, "rb") as fp:
+            while True:
+                chunk = fp.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                await write(chunk)
+    else:
+        view = memoryview(data).cast("B")
+        info.size = len(view)
+        await write(info.tobuf(tarfile.PAX_FORMAT, "utf-8"))
+        for offset in range(0, len(view), CHUNK_SIZE):
+            await write(view[offset:offset + CHUNK_SIZE])
+
+    remainder = info.size % tarfile.BLOCKSIZE
+    if remainder:
+        await write(b"\0" * (tarfile.BLOCKSIZE - remainder))
+
+
+def parse_extract_archive(container_name, names, response):
+    # like bulk delete, swift only reports the files that failed
+    if response.code >= 400:
+        return [{
+            "name": name, "status": "error", "code": response.code,
+            "body": response.body
+        } for name in names]
+
+    report = json.loads(response.body.decode("utf8"))
+    prefix = "{0}/".format(container_name)
+    errors = {}
+    for path, status in report.get("Errors", []):
+        path = urlparse.unquote(path).lstrip("/")
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+        errors[path] = status
+
+    # a failing status with no listed errors means nothing was created
+    archive_status = report.get("Response Status", "201 Created")
+    archive_failed = not errors and int(archive_status.split()[0]) >= 400
+
+    results = []
+    for name in names:
+        status = errors.get(name)
+        if status is None and not archive_failed:
+            results.append({"name": name, "status": "success"})
+            continue
+        status = status or archive_status
+        results.append({
+            "name": name, "status": "error",
+            "code": int(status.split()[0]), "body": status
+        })
+    return results
+
+
+def parse_bulk_delete(paths, response):
+    # the whole batch shares one error if the request itself failed
+    if response.code >= 400:
+        return [{
+            "path": path, "status": "error", "code": response.code,
+            "body": response.body
+        } for path in paths]
+
+    report = json.loads(response.body.decode("utf8"))
+    errors = {}
+    for path, status in report.get("Errors", []):
+        errors[urlparse.unquote(path)] = status
+
+    # a failing status with no listed errors means nothing was deleted
+    batch_status = report.get("Response Status", "200 OK")
+    batch_failed = not errors and int(batch_status.split()[0]) >= 400
+
+    results = []
+    for path in paths:
+        status = errors.get(path)
+        if status is None and not batch_failed:
+            results.append({"path": path, "status": "success"})
+            continue
+        status = status or batch_status
+        results.append({
+            "path": path, "status": "error",
+            "code": int(status.split()[0]), "body": status
+        })
+    return results
+
+
+def is_part_response(code, byte_range):
+    # a 206 is the range asked for. a 200 is the whole object, which is
+    # only the part if the range starts at 0 (and, checked by the caller,
+    # the object isn't longer than the range).
+    if code == 206:
+        return True
+    return code == 200 and (byte_range is None or byte_range[0] == 0)
+
+
+def describe_part(url, byte_range):
+    if byte_range is None:
+        return url
+    return "bytes {0}-{1} of {2}".format(byte_range[0], byte_range[1], url)
+
+
+def split_range(start, end, part_size):
+    # inclusive (start, end) byte ranges of at most part_size bytes
+    return [
+        (offset, min(offset + part_size, end + 1) - 1)
+        for offset in range(start, end + 1, part_size)
+    ]
+
+
+def copy_info(info):
+    # cached info is handed out as copies so callers can't alter it
+    return dict(info, metadata=dict(info["metadata"]))
+
+
+def supported_options(function, **options):
+    # the options function accepts, or all of them if it takes **kwargs
+    try:
+        parameters = inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        return options
+    if any(parameter.kind == parameter.VAR_KEYWORD
+           for parameter in parameters.values()):
+        return options
+    return dict(
+        (key, value) for key, value in options.items() if key in parameters)
+
+
+def invalidate_caches(url, object_cache, info_cache):
+    if object_cache is not None:
+        object_cache.invalidate(url)
+    if info_cache is not None:
+        info_cache.invalidate(url)
+
+
+def iterate_chunks(body):
+    # splits a body we already have in hand the way a response would be
+    view = memoryview(body)
+    for offset in range(0, len(body), CHUNK_SIZE):
+        yield bytes(view[offset:offset + CHUNK_SIZE])
+
+
+def parse_content_range(content_range):
+    # total object length from a "bytes 0-99/2048" header, if known
+    if not content_range or "/" not in content_range:
+        return None
+    total = content_range.rsplit("/", 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+
 class StreamError(Exception):
     pass
 
@@ -0,0 +1,70 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+
+LOGGER = logging.getLogger("rax:token-cache")
+
+
+class FileTokenCache(object):
+    # shares authorizations between processes (e.g. pre-forked workers)
+    # through a single JSON file. entries are keyed by identity URL and a
+    # hash of the credentials, so the credentials never hit the disk, and
+    # writers atomically replace the file under an exclusive lock.
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + ".lock"
+
+    def load(self, identity_url, credentials):
+        with self._lock(fcntl.LOCK_SH):
+            entries = self._read()
+        return entries.get(build_key(identity_url, credentials))
+
+    def store(self, identity_url, credentials, entry):
+        with self._lock(fcntl.LOCK_EX):
+            entries = self._read()
+            entries[build_key(identity_url, credentials)] = entry
+            self._write(entries)
+
+    @contextlib.contextmanager
+    def _lock(self, operation):
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, operation)
+            yield
+        finally:
+            os.close(fd)
+
+    def _read(self):
+        try:
+            with open(self.path) as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            LOGGER.warning("Ignoring corrupt token cache {0}".format(
+                self.path))
+            return {}
+
+    def _write(self, entries):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        # mkstemp creates the file as 0600, which is what we want for tokens
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tokens-")
+        try:
+            with os.fdopen(fd, "w") as fp:
+                json.dump(entries, fp)
+            os.replace(temp_path, self.path)
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+
+def build_key(identity_url, credentials):
+    serialized = json.dumps(credentials, sort_keys=True).encode("utf8")
+    return "{0}#{1}".format(
+        identity_url, hashlib.sha256(serialized).hexdigest())
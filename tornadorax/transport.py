@@ -0,0 +1,138 @@
+try:
+    import urlparse
+except ImportError:
+    import urllib.parse as urlparse
+
+from tornado import gen
+from tornado import locks
+from tornado.httpclient import AsyncHTTPClient
+from tornado.util import import_object
+
+from tornadorax.instrumentation import instrument
+
+
+IMPLEMENTATIONS = {
+    "simple": "tornado.simple_httpclient.SimpleAsyncHTTPClient",
+    # requires pycurl, so it's only imported when asked for
+    "curl": "tornado.curl_httpclient.CurlAsyncHTTPClient"
+}
+
+
+class HTTPTransport(object):
+    # a single configured HTTP client shared by the identity client and
+    # every service built from it. with no options it's just the default
+    # shared AsyncHTTPClient, which is what the library always used.
+
+    def __init__(
+            self, implementation=None, max_clients=None,
+            max_clients_per_host=None, connect_timeout=None,
+            request_timeout=None, keep_alive=True, retry_policy=None):
+        self.implementation = implementation
+        self.max_clients = max_clients
+        self.max_clients_per_host = max_clients_per_host
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.keep_alive = keep_alive
+        self.retry_policy = retry_policy
+        self._client = None
+        self._owns_client = False
+        self._host_semaphores = {}
+        self.listeners = []
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._build_client()
+        return self._client
+
+    def _build_client(self):
+        kwargs = {}
+        defaults = {}
+
+        if self.max_clients is not None:
+            kwargs["max_clients"] = self.max_clients
+        if self.connect_timeout is not None:
+            defaults["connect_timeout"] = self.connect_timeout
+        if self.request_timeout is not None:
+            defaults["request_timeout"] = self.request_timeout
+        if defaults:
+            kwargs["defaults"] = defaults
+
+        if self.implementation is None and not kwargs:
+            return AsyncHTTPClient()
+
+        client_class = self.implementation or "simple"
+        if client_class in IMPLEMENTATIONS:
+            client_class = import_object(IMPLEMENTATIONS[client_class])
+
+        # a private instance, so these settings don't leak into (or get
+        # ignored because of) the IOLoop's shared client
+        self._owns_client = True
+        return client_class(force_instance=True, **kwargs)
+
+    def add_listener(self, listener):
+        # listeners get a RequestEvent for every request attempt
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def fetch(
+            self, url, retry=None, service=None, operation=None,
+            url_template=None, **kwargs):
+        # returns a future (not a coroutine) like AsyncHTTPClient.fetch,
+        # so streaming requests start as soon as this is called. retry
+        # overrides the retry policy's idempotency rules for this call,
+        # and service / operation / url_template label it for listeners.
+        labels = {
+            "service": service,
+            "operation": operation,
+            "url_template": url_template
+        }
+
+        if not self.keep_alive:
+            headers = dict(kwargs.get("headers") or {})
+            headers["Connection"] = "close"
+            kwargs["headers"] = headers
+
+        if self.retry_policy is None:
+            return self._fetch(url, kwargs, labels)
+
+        if "body_producer" in kwargs or "streaming_callback" in kwargs:
+            # the body (or the consumer) can't be rewound, so these still
+            # count towards the circuit breaker but are never retried
+            retry = False
+
+        return gen.convert_yielded(self.retry_policy.fetch(
+            lambda: self._fetch(url, kwargs, labels), url,
+            method=kwargs.get("method", "GET"), retry=retry))
+
+    def _fetch(self, url, kwargs, labels):
+        if self.listeners:
+            # a copy, so retries don't stack the byte counting wrappers
+            return instrument(
+                self.listeners, self._send, url, labels, dict(kwargs))
+        return self._send(url, kwargs)
+
+    def _send(self, url, kwargs):
+        if not self.max_clients_per_host:
+            return self.client.fetch(url, **kwargs)
+
+        host = urlparse.urlparse(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = locks.Semaphore(
+                self.max_clients_per_host)
+
+        return gen.convert_yielded(
+            self._limited_fetch(self._host_semaphores[host], url, kwargs))
+
+    async def _limited_fetch(self, semaphore, url, kwargs):
+        async with semaphore:
+            return await self.client.fetch(url, **kwargs)
+
+    def close(self):
+        # the default shared client belongs to the IOLoop, not to us
+        if self._client is not None and self._owns_client:
+            self._client.close()
+        self._client = None
+        self._owns_client = False